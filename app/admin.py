@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserTracker, DeviceTracker
+from .models import UserTracker, DeviceTracker, IdentificationResult, EwasteCenter, DeviceCatalog
 
 class UserTrackerAdmin(admin.ModelAdmin):
     list_display = ['user_id', 'total_devices', 'total_co2', 'total_kwh']
@@ -9,5 +9,20 @@ class DeviceTrackerAdmin(admin.ModelAdmin):
     list_display = ['device_name', 'user', 'device_co2', 'device_kwh']
     search_fields = ['device_name', 'user__username']
 
+class IdentificationResultAdmin(admin.ModelAdmin):
+    list_display = ['digest', 'created_at']
+    search_fields = ['digest']
+
+class EwasteCenterAdmin(admin.ModelAdmin):
+    list_display = ['name', 'address', 'latitude', 'longitude', 'updated_at']
+    search_fields = ['name', 'address']
+
+class DeviceCatalogAdmin(admin.ModelAdmin):
+    list_display = ['name', 'device_co2', 'device_kwh', 'samples', 'updated_at']
+    search_fields = ['name']
+
 admin.site.register(UserTracker, UserTrackerAdmin)
-admin.site.register(DeviceTracker, DeviceTrackerAdmin)
\ No newline at end of file
+admin.site.register(DeviceTracker, DeviceTrackerAdmin)
+admin.site.register(IdentificationResult, IdentificationResultAdmin)
+admin.site.register(EwasteCenter, EwasteCenterAdmin)
+admin.site.register(DeviceCatalog, DeviceCatalogAdmin)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # Registers the signal handlers that keep the in-memory indexes fresh
+        # and count each request's database queries
+        from . import catalog, metrics, spatial  # noqa: F401
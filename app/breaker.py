@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error):
+    # Timeouts, dropped connections, rate limiting and server errors say
+    # the API is unhealthy; other 4xx responses are about our request
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+class CircuitBreaker:
+    """Stop calling a failing dependency, then probe until it recovers.
+
+    Outcomes are kept for the last ``CLAUDE_BREAKER_WINDOW`` seconds. Once
+    at least ``CLAUDE_BREAKER_MIN_CALLS`` calls in the window failed at
+    ``CLAUDE_BREAKER_ERROR_RATE`` or more, the breaker opens and calls
+    raise ``CircuitOpenError`` at once. After ``CLAUDE_BREAKER_OPEN_SECONDS``
+    it is half-open: up to ``CLAUDE_BREAKER_HALF_OPEN_PROBES`` calls go
+    through at a time, the first success closes it and any failure opens
+    it again. State is per process.
+    """
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.opened_at = None
+            self.outcomes = deque()  # (time, failed)
+            self.probes = 0
+            self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def _trim(self, now):
+        horizon = now - settings.CLAUDE_BREAKER_WINDOW
+        while self.outcomes and self.outcomes[0][0] < horizon:
+            self.outcomes.popleft()
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.probes = 0
+        self.stats['opened'] += 1
+        logger.warning("Circuit breaker for %s opened", self.name)
+
+    def retry_after(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + settings.CLAUDE_BREAKER_OPEN_SECONDS - self.clock())
+
+    def before_call(self):
+        """Admit a call or raise ``CircuitOpenError``."""
+        with self._lock:
+            now = self.clock()
+            if self.state == OPEN and now - self.opened_at >= settings.CLAUDE_BREAKER_OPEN_SECONDS:
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == HALF_OPEN and self.probes < settings.CLAUDE_BREAKER_HALF_OPEN_PROBES:
+                self.probes += 1
+                return
+            if self.state != CLOSED:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(self.name, self.retry_after() or settings.CLAUDE_BREAKER_OPEN_SECONDS)
+
+    def record_success(self):
+        with self._lock:
+            now = self.clock()
+            self.stats['successes'] += 1
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.outcomes.clear()
+                logger.info("Circuit breaker for %s closed", self.name)
+            self.outcomes.append((now, False))
+            self._trim(now)
+
+    def record_failure(self):
+        with self._lock:
+            now = self.clock()
+            self.stats['failures'] += 1
+            if self.state == HALF_OPEN:
+                self._open(now)
+                return
+            self.outcomes.append((now, True))
+            self._trim(now)
+            failures = sum(failed for _, failed in self.outcomes)
+            if (self.state == CLOSED and len(self.outcomes) >= settings.CLAUDE_BREAKER_MIN_CALLS
+                    and failures / len(self.outcomes) >= settings.CLAUDE_BREAKER_ERROR_RATE):
+                self._open(now)
+
+    def release(self):
+        # A half-open probe that ended without a verdict frees its slot
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes:
+                self.probes -= 1
+
+    @contextmanager
+    def call(self):
+        """Guard one call: ``with breaker.call(): ...``.
+
+        Only upstream failures count against the dependency; other
+        exceptions pass through without a verdict.
+        """
+        self.before_call()
+        try:
+            yield
+        except Exception as error:
+            if is_upstream_failure(error):
+                self.record_failure()
+            else:
+                self.release()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            failures = sum(failed for _, failed in self.outcomes)
+            return {
+                'state': self.state,
+                'retry_after': round(self.retry_after(), 1),
+                'window_calls': len(self.outcomes),
+                'window_error_rate': round(failures / len(self.outcomes), 4) if self.outcomes else 0.0,
+                **self.stats,
+            }
+
+
+claude_breaker = CircuitBreaker('Claude API')
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from collections import deque
+from django.conf import settings
+from .parsing import NO_DEVICE, UNKNOWN_DEVICE
+
+TIERS = ('triage', 'full')
+ESCALATION_REASONS = ('low_confidence', 'no_confidence', 'unknown_device', 'triage_error')
+# Recent call latencies kept per tier for percentiles
+LATENCY_WINDOW = 1000
+
+TRIAGE_NOTE = """
+
+Also include this line directly after DEVICE_KWH:
+CONFIDENCE: [How sure you are of the device identification, from 0 to 100]
+
+Keep the DISPOSAL and REUSE IDEAS sections brief: 3 bullet points and 3 reuse ideas of one short sentence each."""
+
+TRIAGE_VERSION = hashlib.sha256(TRIAGE_NOTE.encode('utf-8')).hexdigest()[:8]
+
+
+def enabled():
+    return bool(settings.IDENTIFY_TRIAGE_MODEL)
+
+
+def model_version():
+    """Who answers identifications: the single model, or the cascade's tiers and threshold."""
+    if not enabled():
+        return settings.IDENTIFY_MODEL
+    return (f"{settings.IDENTIFY_TRIAGE_MODEL}>{settings.IDENTIFY_MODEL}"
+            f"@{settings.IDENTIFY_ESCALATE_BELOW}/{TRIAGE_VERSION}")
+
+
+def tier_model(tier):
+    # Model, token budget and per-call timeout of a cascade tier
+    if tier == 'triage':
+        return settings.IDENTIFY_TRIAGE_MODEL, settings.IDENTIFY_TRIAGE_MAX_TOKENS, settings.IDENTIFY_TRIAGE_TIMEOUT
+    return settings.IDENTIFY_MODEL, settings.IDENTIFY_MAX_TOKENS, settings.IDENTIFY_TIMEOUT
+
+
+def triage_prompt(prompt):
+    return prompt + TRIAGE_NOTE
+
+
+def escalation_reason(payload):
+    """Why a triage answer needs the full model, or None to accept it."""
+    name = payload.get('class') or UNKNOWN_DEVICE
+    confidence = payload.get('confidence')
+    if name != NO_DEVICE and name.lower().startswith('unknown'):
+        return 'unknown_device'
+    if confidence is None:
+        return 'no_confidence'
+    if confidence < settings.IDENTIFY_ESCALATE_BELOW:
+        return 'low_confidence'
+    return None
+
+
+def _tokens(usage, name):
+    value = getattr(usage, name, 0)
+    return value if isinstance(value, int) else 0
+
+
+class CascadeStats:
+    """Per-tier latency and token usage, and how often triage escalates."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.tiers = {
+                tier: {'calls': 0, 'errors': 0, 'input_tokens': 0, 'output_tokens': 0, 'seconds': 0.0}
+                for tier in TIERS
+            }
+            self.latencies = {tier: deque(maxlen=LATENCY_WINDOW) for tier in TIERS}
+            self.accepted = 0
+            self.escalations = dict.fromkeys(ESCALATION_REASONS, 0)
+
+    def record_call(self, tier, seconds, usage=None):
+        with self._lock:
+            stats = self.tiers[tier]
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['input_tokens'] += _tokens(usage, 'input_tokens')
+            stats['output_tokens'] += _tokens(usage, 'output_tokens')
+            self.latencies[tier].append(seconds)
+
+    def record_error(self, tier):
+        with self._lock:
+            self.tiers[tier]['errors'] += 1
+
+    def record_outcome(self, reason):
+        # reason: None when the triage answer was used
+        with self._lock:
+            if reason is None:
+                self.accepted += 1
+            else:
+                self.escalations[reason] += 1
+
+    def snapshot(self):
+        with self._lock:
+            tiers = {}
+            for tier, stats in self.tiers.items():
+                latencies = sorted(self.latencies[tier])
+                tiers[tier] = {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'input_tokens': stats['input_tokens'],
+                    'output_tokens': stats['output_tokens'],
+                    'mean_ms': round(stats['seconds'] / stats['calls'] * 1000, 1) if stats['calls'] else 0.0,
+                    'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else 0.0,
+                }
+            escalated = sum(self.escalations.values())
+            triaged = self.accepted + escalated
+            return {
+                'enabled': enabled(),
+                'model': model_version(),
+                'tiers': tiers,
+                'triaged': triaged,
+                'escalated': escalated,
+                'escalation_rate': round(escalated / triaged, 4) if triaged else 0.0,
+                'escalations': dict(self.escalations),
+            }
+
+
+cascade_stats = CascadeStats()
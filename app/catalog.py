@@ -0,0 +1,238 @@
+import re
+import statistics
+import threading
+from collections import Counter, namedtuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import DeviceCatalog, DeviceTracker
+from .parsing import NO_DEVICE
+from .versions import bump_version, data_version
+
+VERSION_NAME = 'catalog'
+
+CatalogEntry = namedtuple('CatalogEntry', ['id', 'name', 'device_co2', 'device_kwh'])
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+_ARTICLES = {'a', 'an', 'the'}
+
+
+def normalize_name(name):
+    words = _NON_WORD.sub(' ', name.lower()).split()
+    return ' '.join(word for word in words if word not in _ARTICLES)
+
+
+def trigrams(text):
+    # pg_trgm style: each word padded with two leading spaces and one trailing
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class CatalogMatcher:
+    """Map free-text device names to catalog entries.
+
+    Exact matches on a normalized name or alias are a dict lookup. Anything
+    else goes through an inverted trigram index: only keys sharing at
+    least one trigram with the query are scored, by trigram Jaccard
+    similarity, so matching stays fast as the catalog grows.
+    """
+
+    def __init__(self, entries):
+        # entries: DeviceCatalog rows (or anything with the same attributes)
+        self.exact = {}
+        self.keys = []
+        self.postings = {}
+        for row in entries:
+            entry = CatalogEntry(row.id, row.name, row.device_co2, row.device_kwh)
+            for spelling in [row.name, *(row.aliases or [])]:
+                key = normalize_name(spelling)
+                if not key or key in self.exact:
+                    continue
+                self.exact[key] = entry
+                grams = trigrams(key)
+                for gram in grams:
+                    self.postings.setdefault(gram, []).append(len(self.keys))
+                self.keys.append((entry, len(grams)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, name, threshold=None):
+        """The best entry for ``name``, or None if nothing is similar enough."""
+        if threshold is None:
+            threshold = settings.CATALOG_MATCH_THRESHOLD
+        key = normalize_name(name or '')
+        if not key:
+            return None
+        entry = self.exact.get(key)
+        if entry is not None:
+            return entry
+
+        grams = trigrams(key)
+        shared = Counter(index for gram in grams for index in self.postings.get(gram, ()))
+        best, best_score = None, threshold
+        for index, count in shared.items():
+            entry, size = self.keys[index]
+            score = count / (len(grams) + size - count)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+
+def catalog_version():
+    return data_version(VERSION_NAME)
+
+
+def invalidate_catalog():
+    # Call inside the transaction that changes the catalog
+    bump_version(VERSION_NAME)
+
+
+class LiveCatalog:
+    """The current ``CatalogMatcher``, rebuilt whenever the catalog changes.
+
+    The version lives in the database, so edits made by ``seed_catalog``
+    or in another worker reach every process.
+    """
+
+    def __init__(self):
+        self._matcher = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = catalog_version()
+        if self._matcher is not None and self._version == version:
+            return self._matcher
+        with self._lock:
+            if self._matcher is None or self._version != version:
+                self._matcher = CatalogMatcher(DeviceCatalog.objects.all())
+                self._version = version
+            return self._matcher
+
+    def match(self, name):
+        return self.get().match(name)
+
+
+live_catalog = LiveCatalog()
+
+
+def apply_catalog(payload):
+    """Return ``payload`` with its device and footprint taken from the catalog.
+
+    The payload is copied, never modified, since it may be shared through
+    the result cache. Unmatched devices keep the model's own estimates.
+    """
+    if not payload or payload.get('class') in (None, NO_DEVICE):
+        return payload
+    entry = live_catalog.match(payload['class'])
+    if entry is None:
+        return payload
+    return {
+        **payload,
+        'class': entry.name,
+        'device_co2': entry.device_co2,
+        'device_kwh': entry.device_kwh,
+        'catalog_id': entry.id,
+    }
+
+
+def catalog_events(events):
+    # Streaming counterpart of apply_catalog: once the device line matches,
+    # send the catalog figures straight away and drop the model's estimates
+    entry = None
+    for event, data in events:
+        if event == 'device' and data['class'] != NO_DEVICE:
+            entry = live_catalog.match(data['class'])
+            if entry is not None:
+                yield 'device', {'class': entry.name}
+                yield 'device_co2', {'device_co2': entry.device_co2}
+                yield 'device_kwh', {'device_kwh': entry.device_kwh}
+                continue
+        elif event in ('device_co2', 'device_kwh') and entry is not None:
+            continue
+        yield event, data
+
+
+def _history_figures(spellings, limit):
+    # Median of the most recent estimates: robust to the model's occasional wild guess
+    rows = list(
+        DeviceTracker.objects.filter(device_name__in=spellings)
+        .order_by('-created_at').values_list('device_co2', 'device_kwh')[:limit]
+    )
+    return statistics.median_low(r[0] for r in rows), statistics.median_low(r[1] for r in rows)
+
+
+def seed_from_history(min_samples=3, update_figures=False, dry_run=False, sample_limit=500):
+    """Create and extend catalog entries from uncatalogued tracked devices.
+
+    Names are grouped by their normalized form; groups seen at least
+    ``min_samples`` times either join the entry they match (as aliases)
+    or become a new entry whose figures are the median of their history.
+    Existing figures are only recomputed with ``update_figures``. Matching
+    history rows are linked to their entry. Returns one report dict per
+    group acted on.
+    """
+    groups = {}
+    names = (
+        DeviceTracker.objects.filter(catalog__isnull=True).exclude(device_name=NO_DEVICE)
+        .values('device_name').annotate(count=Count('id')).order_by()
+    )
+    for row in names.iterator():
+        key = normalize_name(row['device_name'])
+        if key:
+            group = groups.setdefault(key, {'count': 0, 'spellings': Counter()})
+            group['count'] += row['count']
+            group['spellings'][row['device_name']] = row['count']
+
+    report = []
+    with transaction.atomic():
+        entries = list(DeviceCatalog.objects.all())
+        matcher = CatalogMatcher(entries)
+        for key, group in sorted(groups.items(), key=lambda item: -item[1]['count']):
+            if group['count'] < min_samples:
+                continue
+            spellings = list(group['spellings'])
+            name = group['spellings'].most_common(1)[0][0]
+            match = matcher.match(name)
+
+            if match is None:
+                co2, kwh = _history_figures(spellings, sample_limit)
+                entry = DeviceCatalog.objects.create(
+                    name=name, aliases=sorted(set(spellings) - {name}),
+                    device_co2=co2, device_kwh=kwh, samples=group['count']
+                )
+                entries.append(entry)
+                action = 'created'
+            else:
+                entry = next(e for e in entries if e.id == match.id)
+                known = {normalize_name(spelling) for spelling in [entry.name, *entry.aliases]}
+                entry.aliases = entry.aliases + sorted(s for s in spellings if normalize_name(s) not in known)
+                entry.samples += group['count']
+                if update_figures:
+                    entry.device_co2, entry.device_kwh = _history_figures(
+                        [entry.name, *entry.aliases], sample_limit
+                    )
+                entry.save()
+                action = 'extended'
+
+            DeviceTracker.objects.filter(catalog__isnull=True, device_name__in=spellings).update(catalog=entry)
+            matcher = CatalogMatcher(entries)
+            report.append({
+                'action': action, 'name': entry.name, 'samples': group['count'],
+                'device_co2': entry.device_co2, 'device_kwh': entry.device_kwh, 'spellings': spellings,
+            })
+
+        if dry_run:
+            transaction.set_rollback(True)
+    return report
+
+
+@receiver([post_save, post_delete], sender=DeviceCatalog)
+def _catalog_changed(sender, **kwargs):
+    invalidate_catalog()
@@ -0,0 +1,57 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from .models import CommunityTotals, UserTracker
+
+VERSION_KEY = 'community:version'
+
+
+def community_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate_community():
+    # Bumping the version orphans every cached snapshot at once
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Version was evicted; restart from a value no old key can have used
+        cache.add(VERSION_KEY, time.time_ns(), None)
+
+
+def community_snapshot(limit=None):
+    """Site-wide totals and the top ``limit`` users by CO2 saved.
+
+    Built from the few CommunityTotals shards and an index walk of the
+    first ``limit`` trackers, so the cost does not grow with the number of
+    users, and cached until the next tracked device bumps the version.
+    """
+    if limit is None:
+        limit = settings.COMMUNITY_LEADERBOARD_SIZE
+    key = f'community:{community_version()}:{limit}'
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    totals = CommunityTotals.objects.aggregate(devices=Sum('devices'), co2=Sum('co2'), kwh=Sum('kwh'))
+    leaders = (
+        UserTracker.objects.filter(total_co2__gt=0)
+        .order_by('-total_co2', 'user_id')
+        .values('user_id__username', 'total_devices', 'total_co2', 'total_kwh')[:limit]
+    )
+    snapshot = {
+        'totals': {field: value or 0 for field, value in totals.items()},
+        'leaderboard': [
+            {
+                'rank': rank,
+                'username': leader['user_id__username'],
+                'total_devices': leader['total_devices'],
+                'total_co2': leader['total_co2'],
+                'total_kwh': leader['total_kwh']
+            }
+            for rank, leader in enumerate(leaders, 1)
+        ],
+    }
+    cache.set(key, snapshot, settings.COMMUNITY_CACHE_TTL)
+    return snapshot
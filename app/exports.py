@@ -0,0 +1,111 @@
+import csv
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import DeviceTracker, UserTracker
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+DATASETS = ('devices', 'totals')
+# Encoded rows are sent in chunks of roughly this many characters
+CHUNK_SIZE = 64 * 1024
+# Spreadsheets read text cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def device_rows(user=None, start=None, end=None, device=None):
+    """Column names and a row iterator for tracked devices, oldest first.
+
+    ``user`` limits the export to one user's history; without it every
+    user's rows are exported with their username. ``start`` and ``end``
+    are inclusive dates and ``device`` matches part of the device name.
+    Rows come from ``values_list`` through a chunked iterator, so no model
+    instances are built and only one chunk is in memory at a time.
+    """
+    fields = ('created_at', 'device_name', 'device_co2', 'device_kwh')
+    devices = DeviceTracker.objects.all()
+    if user is not None:
+        devices = devices.filter(user=user)
+        # Walks the (user, created_at) index
+        order = ('created_at', 'id')
+    else:
+        fields = ('id', 'user__username') + fields
+        order = ('id',)
+    if start:
+        devices = devices.filter(created_at__gte=_day_start(start))
+    if end and end < date.max:
+        # The last representable day has no next day to stop before, and needs no bound
+        devices = devices.filter(created_at__lt=_day_start(end + timedelta(days=1)))
+    if device:
+        devices = devices.filter(device_name__icontains=device)
+
+    columns = [field.replace('user__', '') for field in fields]
+    rows = devices.order_by(*order).values_list(*fields).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    return columns, rows
+
+
+def total_rows(user=None):
+    # Tracker totals for one user, or for everyone
+    fields = ('user_id__username', 'total_devices', 'total_co2', 'total_kwh')
+    trackers = UserTracker.objects.all() if user is None else UserTracker.objects.filter(user_id=user)
+    rows = trackers.order_by('id').values_list(*fields).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    return ['username', 'total_devices', 'total_co2', 'total_kwh'], rows
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_cell(value):
+    # Device names are free text; a leading quote keeps them from running as formulas
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _Echo:
+    # A csv.writer target that hands each formatted line straight back
+    def write(self, line):
+        return line
+
+
+def encode_rows(columns, rows, export_format):
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow([_csv_cell(value) for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(columns, map(_plain, row)))) + '\n'
+
+
+def export_stream(columns, rows, export_format, compress=False):
+    """Encode rows as CSV or NDJSON and yield them as bytes in large chunks.
+
+    With ``compress`` the output is a gzip stream compressed as it goes,
+    so memory stays bounded by the chunk size whatever the row count.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip header and trailer
+    lines, size = [], 0
+    for line in encode_rows(columns, rows, export_format):
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            chunk = ''.join(lines).encode('utf-8')
+            lines, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = ''.join(lines).encode('utf-8')
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
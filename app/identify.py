@@ -0,0 +1,463 @@
+import asyncio
+import base64
+import hashlib
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+import anthropic
+from .breaker import CircuitOpenError, claude_breaker
+from .cascade import cascade_stats, escalation_reason, model_version, tier_model, triage_prompt
+from .catalog import apply_catalog, catalog_events
+from .imaging import normalize_image, perceptual_hash
+from .metrics import record_usage, stage
+from .parsing import StreamParser, parse_devices, parse_response, payload_events
+from .result_cache import result_cache
+from .singleflight import single_flight
+
+# Initialize Claude client
+claude_client = anthropic.Anthropic(api_key=settings.CLAUDE_API_KEY, base_url=settings.CLAUDE_BASE_URL)
+
+# Caps simultaneous blocking API calls across every request in this process,
+# so batch fan-out cannot exceed the account's concurrency budget
+_api_slots = threading.BoundedSemaphore(settings.IDENTIFY_MAX_CONCURRENT_CALLS)
+
+# Async clients, one per event loop: each wraps a pooled HTTP client whose
+# keep-alive connections are bound to the loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+IDENTIFY_PROMPT = """Identify the electronic device or component in this image and provide comprehensive e-waste guidance. It is crucial that you only identify devices that are electronic. If the item in the image is not an electronic device (e.g., furniture, clothing, non-electronic household items), you must respond with "No Device Detected" for the device name.
+
+Please format your response EXACTLY as follows:
+
+DEVICE: [Name of the electronic device/component]
+DEVICE_CO2: [Estimated CO2 emissions for manufacturing this device in kg, as an integer]
+DEVICE_KWH: [Estimated kWh of electricity consumed by this device annually, as an integer]
+
+DISPOSAL:
+[Provide 3-5 bullet points on how to properly dispose of this device, including:
+- E-waste recycling centers
+- Manufacturer take-back programs
+- Retail drop-off locations
+- Special handling requirements (if any)
+- Environmental considerations]
+
+REUSE IDEAS:
+1. [Creative reuse idea #1]
+2. [Creative reuse idea #2]
+3. [Creative reuse idea #3]
+4. [Creative reuse idea #4]
+5. [Creative reuse idea #5]
+
+Focus on practical, safe, and creative ways to repurpose the device or its components. Consider both functional reuses and artistic/decorative purposes. If the device is still functional, prioritize extending its useful life. If it's broken, think about how individual components could be repurposed.
+
+If you cannot clearly identify the device, provide your best assessment and general e-waste guidance, and set CO2 and KWH to 0. If no device is detected, or if the item is not an electronic device, respond with "No Device Detected" for the device name and set all other fields to 0 or empty."""
+
+# One call for a photo of several items, e.g. a whole drop-off bin. Guidance
+# is shorter per device so a full bin fits in IDENTIFY_MULTI_MAX_TOKENS.
+MULTI_IDENTIFY_PROMPT = """Identify every separate electronic device or component visible in this image and provide e-waste guidance for each one. Only list items that are electronic; ignore furniture, clothing, packaging and other non-electronic items. List at most {max_devices} devices, the most clearly visible first. Identical items each get their own entry.
+
+Repeat the following block EXACTLY once per device, with a blank line between blocks:
+
+DEVICE: [Name of the electronic device/component]
+DEVICE_CO2: [Estimated CO2 emissions for manufacturing this device in kg, as an integer]
+DEVICE_KWH: [Estimated kWh of electricity consumed by this device annually, as an integer]
+
+DISPOSAL:
+- [2-3 bullet points on how to properly dispose of this device, including any special handling such as batteries or screens]
+
+REUSE IDEAS:
+1. [Reuse idea #1]
+2. [Reuse idea #2]
+
+If you cannot clearly identify an item, give your best assessment and set its CO2 and KWH to 0. If there are no electronic devices in the image, respond only with "DEVICE: No Device Detected"."""
+
+# Changes whenever the prompt text changes, so cached results never outlive it
+PROMPT_VERSION = hashlib.sha256(IDENTIFY_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+# An upload that missed every cache tier and still needs an API call
+PendingIdentification = namedtuple('PendingIdentification', ['digest', 'version', 'image', 'phash', 'prompt'])
+
+
+def image_digest(image_data, model=None, prompt_version=PROMPT_VERSION):
+    # Content address of an identification: same bytes, model and prompt give the same answer
+    digest = hashlib.sha256()
+    digest.update(f"{model or model_version()}:{prompt_version}:".encode('utf-8'))
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+def build_messages(image_data, image_type, prompt=IDENTIFY_PROMPT):
+    with stage('encode'):
+        image_base64 = base64.b64encode(image_data).decode('utf-8')
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": image_type,
+                        "data": image_base64
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": prompt
+                }
+            ]
+        }
+    ]
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = anthropic.AsyncAnthropic(api_key=settings.CLAUDE_API_KEY, base_url=settings.CLAUDE_BASE_URL)
+        _async_clients[loop] = client
+    return client
+
+
+def multi_prompt():
+    prompt = MULTI_IDENTIFY_PROMPT.format(max_devices=settings.IDENTIFY_MULTI_MAX_DEVICES)
+    return prompt, hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def _create(client, tier, image_data, image_type, prompt, max_tokens=None):
+    model, tier_max_tokens, timeout = tier_model(tier)
+    max_tokens = max_tokens or tier_max_tokens
+    messages = build_messages(image_data, image_type, prompt)
+    with claude_breaker.call(), stage(f'upstream_{tier}'):
+        start = time.perf_counter()
+        try:
+            with _api_slots:
+                message = client.messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=messages,
+                    timeout=timeout
+                )
+        except Exception:
+            cascade_stats.record_error(tier)
+            raise
+    usage = getattr(message, 'usage', None)
+    cascade_stats.record_call(tier, time.perf_counter() - start, usage)
+    record_usage(model, usage)
+
+    # Extract the response from Claude
+    return message.content[0].text.strip()
+
+
+def triage(image_data, image_type, client, prompt):
+    """Ask the fast model first; return its response, or None to escalate.
+
+    A triage failure escalates rather than failing the identification.
+    """
+    try:
+        text = _create(client, 'triage', image_data, image_type, triage_prompt(prompt))
+    except anthropic.APIError:
+        cascade_stats.record_outcome('triage_error')
+        return None
+    reason = escalation_reason(parse_response(text))
+    cascade_stats.record_outcome(reason)
+    return text if reason is None else None
+
+
+def call_claude(image_data, image_type, client=None, prompt=IDENTIFY_PROMPT):
+    """The response text for an image, from the cheapest tier that is sure of it.
+
+    With the cascade enabled the triage model answers first and the full
+    model is only called when ``escalation_reason`` objects to its answer.
+    """
+    client = client or claude_client
+    if settings.IDENTIFY_TRIAGE_MODEL:
+        text = triage(image_data, image_type, client, prompt)
+        if text is not None:
+            return text
+    return _create(client, 'full', image_data, image_type, prompt)
+
+
+def prepare_image(image_data, image_type):
+    # CPU-bound: decode, downscale and hash the upload
+    with stage('prepare'):
+        image = normalize_image(image_data, image_type)
+        return image, perceptual_hash(image.data)
+
+
+async def _acreate(tier, image_data, image_type, prompt):
+    model, max_tokens, timeout = tier_model(tier)
+    messages = build_messages(image_data, image_type, prompt)
+    with claude_breaker.call(), stage(f'upstream_{tier}'):
+        start = time.perf_counter()
+        try:
+            message = await get_async_client().messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                messages=messages,
+                timeout=timeout
+            )
+        except Exception:
+            cascade_stats.record_error(tier)
+            raise
+    usage = getattr(message, 'usage', None)
+    cascade_stats.record_call(tier, time.perf_counter() - start, usage)
+    record_usage(model, usage)
+    return message.content[0].text.strip()
+
+
+async def acall_claude(image_data, image_type, prompt=IDENTIFY_PROMPT):
+    # Async counterpart of call_claude
+    if settings.IDENTIFY_TRIAGE_MODEL:
+        try:
+            text = await _acreate('triage', image_data, image_type, triage_prompt(prompt))
+            reason = escalation_reason(parse_response(text))
+        except anthropic.APIError:
+            text, reason = None, 'triage_error'
+        cascade_stats.record_outcome(reason)
+        if reason is None:
+            return text
+    return await _acreate('full', image_data, image_type, prompt)
+
+
+def find_cached(image_data, image_type):
+    """Look an upload up by content digest, then by perceptual hash.
+
+    Returns ``(payload, None)`` on a hit and ``(None, pending)`` on a miss,
+    where ``pending`` carries the normalized image to send to Claude.
+    """
+    digest = image_digest(image_data)
+    with stage('cache_lookup'):
+        payload = result_cache.get(digest)
+    if payload is not None:
+        return payload, None
+
+    version = f"{model_version()}:{PROMPT_VERSION}"
+    image, phash = prepare_image(image_data, image_type)
+    if phash is not None:
+        with stage('cache_lookup'):
+            payload = result_cache.get_similar(phash, version)
+        if payload is not None:
+            result_cache.memory.set(digest, payload)
+            return payload, None
+
+    return None, PendingIdentification(digest, version, image, phash, IDENTIFY_PROMPT)
+
+
+def remember(pending, full_response, parse=parse_response):
+    with stage('parse'):
+        payload = parse(full_response)
+    with stage('cache_store'):
+        result_cache.set(pending.digest, payload, version=pending.version, phash=pending.phash)
+    return payload
+
+
+def degraded_result(pending):
+    """The closest cached answer for an upload while Claude is unavailable, or None.
+
+    Looser than a normal near-duplicate lookup: any model or prompt
+    version, expired rows included, up to ``IDENTIFY_DEGRADED_PHASH_DISTANCE``
+    bits away. The payload is marked ``degraded`` and never cached.
+    """
+    if pending.phash is None or settings.IDENTIFY_DEGRADED_PHASH_DISTANCE < 0:
+        return None
+    payload = result_cache.get_similar(
+        pending.phash, None, max_distance=settings.IDENTIFY_DEGRADED_PHASH_DISTANCE, include_stale=True
+    )
+    return {**payload, 'degraded': True} if payload is not None else None
+
+
+def identify_image(image_data, image_type, client=None, allow_degraded=True):
+    """Return the parsed identification payload for an uploaded image.
+
+    Only a miss in every cache tier reaches the Claude API, through
+    ``client`` if given (e.g. one with different retry options).
+    Concurrent misses for the same bytes share a single API call. Devices
+    found in the catalog get the catalog's name and footprint. While the
+    circuit breaker is open, a degraded cached answer is returned if
+    allowed and one exists; otherwise ``CircuitOpenError`` propagates.
+    """
+    payload, pending = find_cached(image_data, image_type)
+    if payload is None:
+        try:
+            payload = single_flight.do(
+                pending.digest,
+                lambda: remember(pending, call_claude(
+                    pending.image.data, pending.image.media_type, client=client, prompt=pending.prompt
+                )),
+                recheck=lambda: result_cache.peek(pending.digest)
+            )
+        except CircuitOpenError:
+            payload = degraded_result(pending) if allow_degraded else None
+            if payload is None:
+                raise
+    return apply_catalog(payload)
+
+
+async def aidentify_image(image_data, image_type):
+    """Async counterpart of ``identify_image``.
+
+    Cache lookups run on Django's thread-sensitive executor, image work on
+    the shared thread pool, and the API call on the event loop, so a
+    worker is never blocked while Claude is thinking. Concurrent misses
+    share one API call with each other and with ``identify_image``.
+    """
+    digest = image_digest(image_data)
+    payload = await sync_to_async(result_cache.get)(digest)
+    if payload is not None:
+        return await sync_to_async(apply_catalog)(payload)
+
+    version = f"{model_version()}:{PROMPT_VERSION}"
+    image, phash = await sync_to_async(prepare_image, thread_sensitive=False)(image_data, image_type)
+    if phash is not None:
+        payload = await sync_to_async(result_cache.get_similar)(phash, version)
+        if payload is not None:
+            result_cache.memory.set(digest, payload)
+            return await sync_to_async(apply_catalog)(payload)
+
+    pending = PendingIdentification(digest, version, image, phash, IDENTIFY_PROMPT)
+
+    async def call():
+        return await sync_to_async(remember)(pending, await acall_claude(image.data, image.media_type, pending.prompt))
+
+    try:
+        payload = await single_flight.ado(digest, call, recheck=sync_to_async(lambda: result_cache.peek(digest)))
+    except CircuitOpenError:
+        payload = await sync_to_async(degraded_result)(pending)
+        if payload is None:
+            raise
+    return await sync_to_async(apply_catalog)(payload)
+
+
+def _replay(payload):
+    yield from catalog_events(payload_events(payload))
+    yield 'done', apply_catalog(payload)
+
+
+def _api_events(pending, claim):
+    # Streams the answer and leaves the uncatalogued payload in ``claim`` for concurrent waiters
+    if settings.IDENTIFY_TRIAGE_MODEL:
+        # A confident triage answer is quick enough to send whole
+        text = triage(pending.image.data, pending.image.media_type, claude_client, pending.prompt)
+        if text is not None:
+            claim.result = remember(pending, text)
+            yield from _replay(claim.result)
+            return
+
+    parser = StreamParser()
+
+    def parsed_events():
+        model, max_tokens, timeout = tier_model('full')
+        messages = build_messages(pending.image.data, pending.image.media_type, pending.prompt)
+        with claude_breaker.call(), stage('upstream_full'):
+            start = time.perf_counter()
+            try:
+                with _api_slots, claude_client.messages.stream(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=messages,
+                    timeout=timeout
+                ) as stream:
+                    for text in stream.text_stream:
+                        yield from parser.feed(text)
+                    usage = getattr(stream.get_final_message(), 'usage', None)
+            except Exception:
+                cascade_stats.record_error('full')
+                raise
+        cascade_stats.record_call('full', time.perf_counter() - start, usage)
+        record_usage(model, usage)
+        yield from parser.close()
+
+    yield from catalog_events(parsed_events())
+
+    claim.result = remember(pending, parser.text.strip())
+    yield 'done', apply_catalog(claim.result)
+
+
+def stream_identification(image_data, image_type):
+    """Yield ``(event, data)`` pairs for an upload as the answer is produced.
+
+    Cached results, and confident answers from the cascade's triage
+    model, are replayed immediately. Otherwise the full response is
+    streamed from the API and parsed line by line, so the device name and
+    footprint arrive long before the reuse ideas. The final ``done`` event
+    carries the same payload ``identify_image`` would have returned,
+    including a degraded answer while the circuit breaker is open.
+    Concurrent misses for the same bytes share one API call: the first
+    streams it and the others replay its result.
+    """
+    payload, pending = find_cached(image_data, image_type)
+    if payload is None:
+        try:
+            with single_flight.flight(pending.digest, recheck=lambda: result_cache.peek(pending.digest)) as claim:
+                if not claim.shared:
+                    events = _api_events(pending, claim)
+                    # An open breaker refuses before the first event
+                    first = next(events)
+                    yield first
+                    yield from events
+                    return
+                payload = claim.result
+        except CircuitOpenError:
+            payload = degraded_result(pending)
+            if payload is None:
+                raise
+    yield from _replay(payload)
+
+
+def identify_devices(image_data, image_type, client=None):
+    """Identify every device in one photo with a single call to the full model.
+
+    Returns ``{'devices': [...], 'full_response': ...}``, each device a
+    payload like ``identify_image`` returns, catalog applied, and at most
+    ``IDENTIFY_MULTI_MAX_DEVICES`` of them. The cascade is skipped, since
+    triage confidence is about a single device. Results are cached by
+    digest only: a similar-looking photo of a bin may hold other items,
+    so there are no near-duplicate hits and no degraded answers.
+    """
+    prompt, prompt_version = multi_prompt()
+    digest = image_digest(image_data, model=settings.IDENTIFY_MODEL, prompt_version=prompt_version)
+    with stage('cache_lookup'):
+        payload = result_cache.get(digest)
+    if payload is None:
+        image, _ = prepare_image(image_data, image_type)
+        pending = PendingIdentification(digest, f"{settings.IDENTIFY_MODEL}:{prompt_version}", image, None, prompt)
+        payload = single_flight.do(
+            digest,
+            lambda: remember(pending, _create(
+                client or claude_client, 'full', image.data, image.media_type, prompt,
+                max_tokens=settings.IDENTIFY_MULTI_MAX_TOKENS
+            ), parse=parse_devices),
+            recheck=lambda: result_cache.peek(digest)
+        )
+    devices = payload['devices'][:settings.IDENTIFY_MULTI_MAX_DEVICES]
+    return {**payload, 'devices': [apply_catalog(device) for device in devices]}
+
+
+def identify_batch(images, concurrency=None):
+    """Identify several uploads concurrently.
+
+    ``images`` is a list of ``(image_data, image_type)`` pairs. Returns one
+    ``(payload, error)`` pair per image, in order; a failing image never
+    fails the batch. Upstream concurrency is further capped by
+    ``IDENTIFY_MAX_CONCURRENT_CALLS``.
+    """
+    if concurrency is None:
+        concurrency = settings.IDENTIFY_BATCH_CONCURRENCY
+
+    def identify_one(image):
+        try:
+            return identify_image(*image), None
+        except Exception as e:
+            return None, e
+        finally:
+            # Worker threads open their own connections; don't leave them behind
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(images)))) as pool:
+        return list(pool.map(identify_one, images))
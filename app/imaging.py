@@ -0,0 +1,139 @@
+import io
+import logging
+import threading
+from collections import namedtuple
+from django.conf import settings
+from PIL import ExifTags, Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+
+# Media types the Claude API accepts as-is
+SUPPORTED_MEDIA_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+ENCODERS = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+# ``Image.info`` keys that carry camera, location or editing metadata
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'icc_profile', 'comment')
+
+NormalizedImage = namedtuple('NormalizedImage', ['data', 'media_type', 'original_bytes', 'width', 'height'])
+
+
+class NormalizationStats:
+    """Images normalized in this process and the bytes they went in and out with."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.images = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def record(self, bytes_in, bytes_out):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+            }
+
+
+normalization_stats = NormalizationStats()
+
+
+def normalize_image(image_data, media_type):
+    """Shrink an upload to what the model needs before it is base64-encoded.
+
+    Decodes at reduced scale where the codec allows it (JPEG draft mode,
+    then ``reduce`` inside ``thumbnail``), applies the EXIF orientation,
+    caps the longest edge at ``IMAGE_MAX_EDGE`` and re-encodes without
+    metadata. The original bytes are kept only when they are already
+    smaller, carry no metadata and the model accepts them. Undecodable
+    uploads are returned unchanged.
+    """
+    if not settings.IMAGE_NORMALIZE:
+        return NormalizedImage(image_data, media_type, len(image_data), None, None)
+
+    max_edge = settings.IMAGE_MAX_EDGE
+    output_format = settings.IMAGE_FORMAT.upper()
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            original_size = image.size
+            exif = image.getexif()
+            upright = exif.get(ExifTags.Base.Orientation, 1) == 1
+            # PNG text chunks show up as ``text``; EXIF can hide in any format
+            bare = not exif and not getattr(image, 'text', None) and not any(key in image.info for key in METADATA_KEYS)
+            image.draft('RGB', (max_edge, max_edge))
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            image = ImageOps.exif_transpose(image)
+            if output_format == 'JPEG' and image.mode != 'RGB':
+                image = _flatten(image)
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+            buffer = io.BytesIO()
+            image.save(buffer, output_format, quality=settings.IMAGE_QUALITY, optimize=output_format == 'JPEG')
+            width, height = image.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return NormalizedImage(image_data, media_type, len(image_data), None, None)
+
+    data = buffer.getvalue()
+    within_limits = upright and bare and max(original_size) <= max_edge
+    if within_limits and media_type in SUPPORTED_MEDIA_TYPES and len(image_data) <= len(data):
+        data, output_media_type, (width, height) = image_data, media_type, original_size
+    else:
+        output_media_type = ENCODERS[output_format]
+
+    normalization_stats.record(len(image_data), len(data))
+    logger.info(
+        "Normalized %s %dx%d (%d bytes) to %s %dx%d (%d bytes), saved %d bytes",
+        media_type, original_size[0], original_size[1], len(image_data),
+        output_media_type, width, height, len(data), len(image_data) - len(data)
+    )
+    return NormalizedImage(data, output_media_type, len(image_data), width, height)
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; composite transparent uploads onto white
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def perceptual_hash(image_data):
+    """64-bit difference hash (dHash) of an encoded image.
+
+    Each bit records whether a pixel is brighter than its right-hand
+    neighbour in a 9x8 greyscale thumbnail, so re-captures of the same
+    scene land within a few bits of each other. Returns None when the
+    bytes cannot be decoded as an image.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            # Let JPEG decode at a fraction of full size; a no-op for other formats
+            image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+            thumbnail = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+            pixels = list(thumbnail.getdata())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
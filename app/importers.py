@@ -0,0 +1,276 @@
+import csv
+import hashlib
+import json
+import math
+import re
+import time
+from django.db import transaction
+from django.utils import timezone
+from .models import EwasteCenter
+from .spatial import invalidate_centers
+
+# Column names used by common public datasets, in order of preference
+FIELD_ALIASES = {
+    'name': ('name', 'site_name', 'facility_name', 'title', 'location_name'),
+    'address': ('address', 'full_address', 'street_address', 'location'),
+    'latitude': ('latitude', 'lat', 'y'),
+    'longitude': ('longitude', 'lon', 'lng', 'long', 'x'),
+    'accepts': ('accepts', 'categories', 'materials', 'accepted_items'),
+    'website': ('website', 'url', 'web'),
+}
+ACCEPTS_SEPARATORS = re.compile(r'[;,|/]')
+CONTENT_FIELDS = ['name', 'address', 'latitude', 'longitude', 'accepts', 'website']
+IMPORTED_FIELDS = CONTENT_FIELDS + ['content_hash', 'updated_at']
+# Invalid rows remembered for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def detect_format(path):
+    lowered = path.lower()
+    if lowered.endswith('.csv'):
+        return 'csv'
+    if lowered.endswith(('.geojsonl', '.geojsons', '.ndjson', '.jsonl')):
+        return 'geojsonl'
+    if lowered.endswith(('.geojson', '.json')):
+        return 'geojson'
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+def read_csv(file):
+    # Yields (line number, row) with lowercased headers
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, {(key or '').strip().lower(): value for key, value in row.items()}
+
+
+def _feature_row(feature):
+    row = {key.lower(): value for key, value in (feature.get('properties') or {}).items()}
+    geometry = feature.get('geometry') or {}
+    if geometry.get('type') == 'Point' and len(geometry.get('coordinates') or ()) >= 2:
+        row['longitude'], row['latitude'] = geometry['coordinates'][:2]
+    else:
+        row['latitude'] = row['longitude'] = None
+    return row
+
+
+def read_geojson(file, chunk_size=1 << 16):
+    """Yield (feature number, row) from a FeatureCollection without loading it whole.
+
+    Top-level members other than ``features`` are decoded and skipped;
+    features are decoded one at a time from a sliding buffer.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+        return not eof
+
+    def skip_space():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    def expect(chars):
+        nonlocal position
+        skip_space()
+        if position >= len(buffer) or buffer[position] not in chars:
+            found = buffer[position] if position < len(buffer) else 'end of file'
+            raise ValueError(f"Invalid GeoJSON: expected one of {chars!r}, found {found!r}")
+        position += 1
+        return buffer[position - 1]
+
+    def value():
+        nonlocal position
+        skip_space()
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise
+            # A number could continue past the end of the buffer
+            if end == len(buffer) and not eof and fill():
+                continue
+            position = end
+            return decoded
+
+    expect('{')
+    count = 0
+    while True:
+        skip_space()
+        if buffer[position:position + 1] == '}':
+            return
+        key = value()
+        expect(':')
+        if key != 'features':
+            value()
+        else:
+            expect('[')
+            skip_space()
+            if buffer[position:position + 1] == ']':
+                position += 1
+            else:
+                while True:
+                    count += 1
+                    yield count, _feature_row(value())
+                    if expect(',]') == ']':
+                        break
+        if expect(',}') == '}':
+            return
+
+
+def read_geojsonl(file):
+    # One Feature per line (GeoJSON text sequences / newline-delimited)
+    for line_number, line in enumerate(file, 1):
+        line = line.strip().lstrip('\x1e')
+        if line:
+            yield line_number, _feature_row(json.loads(line))
+
+
+READERS = {'csv': read_csv, 'geojson': read_geojson, 'geojsonl': read_geojsonl}
+
+
+def _pick(row, field):
+    for alias in FIELD_ALIASES[field]:
+        if row.get(alias) not in (None, ''):
+            return row[alias]
+    return None
+
+
+def normalize_center(row):
+    """Validate one raw row and return the fields of an ``EwasteCenter``.
+
+    Raises ValueError describing the first problem found.
+    """
+    name = ' '.join(str(_pick(row, 'name') or '').split())
+    if not name:
+        raise ValueError("missing name")
+    if len(name) > 255:
+        raise ValueError("name longer than 255 characters")
+
+    try:
+        latitude = float(_pick(row, 'latitude'))
+        longitude = float(_pick(row, 'longitude'))
+    except (TypeError, ValueError):
+        raise ValueError("missing or non-numeric coordinates")
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        raise ValueError("non-numeric coordinates")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("coordinates out of range")
+
+    accepts = _pick(row, 'accepts') or []
+    if isinstance(accepts, str):
+        accepts = ACCEPTS_SEPARATORS.split(accepts)
+    accepts = sorted({' '.join(str(item).split()).lower() for item in accepts} - {''})
+
+    website = str(_pick(row, 'website') or '').strip()
+    if website and not website.lower().startswith(('http://', 'https://')):
+        website = f'https://{website}' if '.' in website and ' ' not in website else ''
+    if len(website) > 200:
+        website = ''
+
+    center = {
+        'name': name,
+        'address': ' '.join(str(_pick(row, 'address') or '').split())[:500],
+        'latitude': round(latitude, 6),
+        'longitude': round(longitude, 6),
+        'accepts': accepts,
+        'website': website,
+    }
+    center['dedupe_key'] = EwasteCenter.make_dedupe_key(name, center['latitude'], center['longitude'])
+    center['content_hash'] = hashlib.sha256(
+        json.dumps([center[field] for field in CONTENT_FIELDS]).encode('utf-8')
+    ).hexdigest()[:32]
+    return center
+
+
+class CenterImporter:
+    """Upsert normalized centers in chunks, each chunk in its own transaction.
+
+    Centers are matched on ``dedupe_key``; only new centers are inserted
+    and only those whose ``content_hash`` changed are updated. Within one
+    file the first occurrence of a key wins.
+    """
+
+    def __init__(self, batch_size=1000, dry_run=False, progress=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0, 'invalid': 0}
+        self.errors = []
+        self._seen = set()
+        self._start = None
+
+    def run(self, rows):
+        self._start = time.perf_counter()
+        chunk = []
+        for line, row in rows:
+            self.stats['rows'] += 1
+            try:
+                center = normalize_center(row)
+            except ValueError as e:
+                self.stats['invalid'] += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append((line, str(e)))
+                continue
+            if center['dedupe_key'] in self._seen:
+                self.stats['duplicates'] += 1
+                continue
+            self._seen.add(center['dedupe_key'])
+            chunk.append(center)
+            if len(chunk) >= self.batch_size:
+                self._write(chunk)
+                chunk = []
+        if chunk:
+            self._write(chunk)
+
+        self.stats['seconds'] = round(time.perf_counter() - self._start, 2)
+        self.stats['rows_per_second'] = self.rate()
+        return self.stats
+
+    def rate(self):
+        elapsed = time.perf_counter() - self._start
+        return round(self.stats['rows'] / elapsed, 1) if elapsed else 0.0
+
+    def _write(self, chunk):
+        with transaction.atomic():
+            existing = {}
+            for pk, key, content_hash in EwasteCenter.objects.filter(
+                dedupe_key__in=[center['dedupe_key'] for center in chunk]
+            ).values_list('id', 'dedupe_key', 'content_hash'):
+                existing.setdefault(key, (pk, content_hash))
+
+            now = timezone.now()
+            to_create, to_update = [], []
+            for center in chunk:
+                match = existing.get(center['dedupe_key'])
+                if match is None:
+                    to_create.append(EwasteCenter(updated_at=now, **center))
+                elif match[1] != center['content_hash']:
+                    to_update.append(EwasteCenter(id=match[0], updated_at=now, **center))
+                else:
+                    self.stats['unchanged'] += 1
+
+            if not self.dry_run:
+                EwasteCenter.objects.bulk_create(to_create, batch_size=self.batch_size)
+                EwasteCenter.objects.bulk_update(to_update, IMPORTED_FIELDS, batch_size=self.batch_size)
+                if to_create or to_update:
+                    # Bulk writes skip model signals; every worker's finder index reloads
+                    # once this chunk commits
+                    invalidate_centers()
+            self.stats['created'] += len(to_create)
+            self.stats['updated'] += len(to_update)
+
+        if self.progress is not None:
+            self.progress(self.stats, self.rate())
@@ -0,0 +1,201 @@
+import logging
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Avg, F, Sum
+from django.utils import timezone
+from . import identify
+from .breaker import CircuitOpenError, is_upstream_failure
+from .catalog import apply_catalog
+from .models import IdentificationJob
+from .result_cache import result_cache
+
+logger = logging.getLogger(__name__)
+
+# Wakes idle in-process workers as soon as a job is submitted
+_job_submitted = threading.Event()
+
+
+def submit(image_data, media_type):
+    """Queue an upload for identification and return the job.
+
+    Uploads whose exact bytes are already cached complete immediately.
+    """
+    payload = result_cache.get(identify.image_digest(image_data))
+    if payload is not None:
+        now = timezone.now()
+        return IdentificationJob.objects.create(
+            status=IdentificationJob.DONE, image=b'', media_type=media_type,
+            result=apply_catalog(payload), started_at=now, finished_at=now
+        )
+
+    job = IdentificationJob.objects.create(image=image_data, media_type=media_type)
+    _job_submitted.set()
+    ensure_workers()
+    return job
+
+
+def is_retryable(error):
+    return isinstance(error, CircuitOpenError) or is_upstream_failure(error)
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before the next attempt.
+
+    Honours the server's retry-after header when present, otherwise uses
+    full-jitter exponential backoff capped at IDENTIFY_JOB_BACKOFF_MAX.
+    An open circuit breaker says when it will next let a call through.
+    """
+    if isinstance(error, CircuitOpenError):
+        return error.retry_after + random.uniform(0, settings.IDENTIFY_JOB_BACKOFF_BASE)
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            if 'retry-after-ms' in response.headers:
+                return float(response.headers['retry-after-ms']) / 1000
+            if 'retry-after' in response.headers:
+                return float(response.headers['retry-after'])
+        except ValueError:
+            pass
+    ceiling = min(settings.IDENTIFY_JOB_BACKOFF_MAX, settings.IDENTIFY_JOB_BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def claim_next():
+    """Atomically move the oldest runnable job to RUNNING and return it, or None.
+
+    Claiming is a compare-and-set UPDATE on the status column, so it is
+    safe across threads and processes without row locks.
+    """
+    while True:
+        candidate = (
+            IdentificationJob.objects
+            .filter(status=IdentificationJob.QUEUED, available_at__lte=timezone.now())
+            .order_by('available_at')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        claimed = IdentificationJob.objects.filter(id=candidate, status=IdentificationJob.QUEUED).update(
+            status=IdentificationJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            return IdentificationJob.objects.get(id=candidate)
+
+
+def run(job):
+    # The queue does its own retrying, so the SDK must not retry underneath
+    # it, and it can wait out an outage rather than settle for a degraded answer
+    client = identify.claude_client.with_options(max_retries=0)
+    try:
+        payload = identify.identify_image(bytes(job.image), job.media_type, client=client, allow_degraded=False)
+    except Exception as error:
+        if is_retryable(error) and job.attempts < settings.IDENTIFY_JOB_MAX_ATTEMPTS:
+            delay = retry_delay(error, job.attempts)
+            logger.info("Job %s attempt %d failed (%s); retrying in %.1fs", job.id, job.attempts, error, delay)
+            IdentificationJob.objects.filter(id=job.id).update(
+                status=IdentificationJob.QUEUED,
+                available_at=timezone.now() + timedelta(seconds=delay),
+                error=str(error)
+            )
+        else:
+            IdentificationJob.objects.filter(id=job.id).update(
+                status=IdentificationJob.FAILED, error=str(error), finished_at=timezone.now()
+            )
+        return
+
+    # The image is no longer needed once the result is stored
+    IdentificationJob.objects.filter(id=job.id).update(
+        status=IdentificationJob.DONE, result=payload, error='', image=b'', finished_at=timezone.now()
+    )
+
+
+def process_next():
+    job = claim_next()
+    if job is None:
+        return False
+    run(job)
+    return True
+
+
+def requeue_stale():
+    # Jobs left RUNNING by a worker that died are handed back to the queue
+    cutoff = timezone.now() - timedelta(seconds=settings.IDENTIFY_JOB_TIMEOUT)
+    return IdentificationJob.objects.filter(status=IdentificationJob.RUNNING, started_at__lt=cutoff).update(
+        status=IdentificationJob.QUEUED, available_at=timezone.now()
+    )
+
+
+def work(stop_event, poll_interval=None):
+    """Drain the queue until ``stop_event`` is set."""
+    if poll_interval is None:
+        poll_interval = settings.IDENTIFY_JOB_POLL_INTERVAL
+    last_sweep = 0
+    try:
+        while not stop_event.is_set():
+            if time.monotonic() - last_sweep > settings.IDENTIFY_JOB_TIMEOUT:
+                requeue_stale()
+                last_sweep = time.monotonic()
+            try:
+                if process_next():
+                    continue
+            except Exception:
+                logger.exception("Identification worker error")
+            _job_submitted.wait(poll_interval)
+            _job_submitted.clear()
+    finally:
+        connection.close()
+
+
+_workers = []
+_workers_lock = threading.Lock()
+_stop_workers = threading.Event()
+
+
+def ensure_workers(count=None):
+    """Start the in-process worker pool once, if enabled."""
+    if count is None:
+        count = settings.IDENTIFY_JOB_WORKERS
+    with _workers_lock:
+        if _workers or count <= 0:
+            return
+        for i in range(count):
+            thread = threading.Thread(target=work, args=(_stop_workers,), name=f'identify-worker-{i}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def wait_for(job_id, timeout):
+    """Poll a job until it finishes or ``timeout`` seconds pass.
+
+    ``timeout`` is clamped to 0..``IDENTIFY_JOB_MAX_WAIT``.
+    """
+    # NaN compares false with everything, so its deadline would never pass
+    timeout = 0 if math.isnan(timeout) else min(max(timeout, 0), settings.IDENTIFY_JOB_MAX_WAIT)
+    deadline = time.monotonic() + timeout
+    while True:
+        job = IdentificationJob.objects.defer('image').get(id=job_id)
+        if job.status in (IdentificationJob.DONE, IdentificationJob.FAILED) or time.monotonic() >= deadline:
+            return job
+        time.sleep(min(0.25, max(0, deadline - time.monotonic())))
+
+
+def queue_stats():
+    now = timezone.now()
+    jobs = IdentificationJob.objects
+    oldest = jobs.filter(status=IdentificationJob.QUEUED).order_by('created_at').values_list('created_at', flat=True).first()
+    recent = jobs.filter(started_at__gte=now - timedelta(hours=1))
+    wait = recent.aggregate(wait=Avg(F('started_at') - F('created_at')))['wait']
+    return {
+        'queued': jobs.filter(status=IdentificationJob.QUEUED).count(),
+        'running': jobs.filter(status=IdentificationJob.RUNNING).count(),
+        'failed': jobs.filter(status=IdentificationJob.FAILED).count(),
+        'oldest_queued_seconds': round((now - oldest).total_seconds(), 2) if oldest else 0.0,
+        'avg_wait_seconds_last_hour': round(wait.total_seconds(), 2) if wait else 0.0,
+        'retries': jobs.filter(attempts__gt=1).aggregate(retries=Sum(F('attempts') - 1))['retries'] or 0,
+    }
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def bench_database():
+    """Run a benchmark against a throwaway database with the current schema.
+
+    SQLite benchmarks get a temporary file rather than Django's shared
+    in-memory test database so that concurrent writers behave as they
+    would in production.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    tmpdir = None
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        tmpdir = tempfile.mkdtemp(prefix='greenbyte-bench-')
+        test_settings['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if tmpdir:
+            test_settings['NAME'] = None
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies_ms, elapsed_s):
+    return {
+        'requests': len(latencies_ms),
+        'throughput_rps': round(len(latencies_ms) / elapsed_s, 2) if elapsed_s else 0.0,
+        'p50_ms': round(percentile(latencies_ms, 0.50), 2),
+        'p95_ms': round(percentile(latencies_ms, 0.95), 2),
+        'p99_ms': round(percentile(latencies_ms, 0.99), 2),
+    }
@@ -0,0 +1,118 @@
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMessagesAPI:
+    """A local stand-in for the Claude Messages API, for benchmarks and tests.
+
+    Serves ``POST /v1/messages`` on a free localhost port from a background
+    thread: every call waits ``latency`` seconds, fails with a 529
+    overloaded error at ``error_rate``, and otherwise answers with the next
+    of ``responses`` in turn. Token usage is estimated from the request and
+    response sizes. Point an SDK client at ``url``::
+
+        with FakeMessagesAPI(['DEVICE: Laptop']) as api:
+            client = anthropic.Anthropic(api_key='test', base_url=api.url)
+    """
+
+    def __init__(self, responses, latency=0.0, error_rate=0.0, seed=0):
+        if not responses:
+            raise ValueError("FakeMessagesAPI needs at least one canned response")
+        self.latency = latency
+        self.error_rate = error_rate
+        self._responses = itertools.cycle(responses)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()  # by model
+        self.errors = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-claude', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def snapshot(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'errors': self.errors}
+
+    def reply(self, request):
+        # (status, body) for one decoded request
+        with self._lock:
+            self.calls[request.get('model')] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            else:
+                text = next(self._responses)
+        if request.get('stream'):
+            return 400, {'type': 'error', 'error': {
+                'type': 'invalid_request_error', 'message': "The benchmark stub does not stream"
+            }}
+        if failed:
+            return 529, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': "Overloaded"}}
+        return 200, {
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': request.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': request['_size'] // 4, 'output_tokens': max(1, len(text) // 4)},
+        }
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so the SDK's connection pool behaves as it would in production
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path.split('?', 1)[0] != '/v1/messages':
+                    return self.send_json(404, {'type': 'error', 'error': {
+                        'type': 'not_found_error', 'message': self.path
+                    }})
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    return self.send_json(400, {'type': 'error', 'error': {
+                        'type': 'invalid_request_error', 'message': "Body is not JSON"
+                    }})
+                request['_size'] = len(body)
+                if api.latency:
+                    time.sleep(api.latency)
+                self.send_json(*api.reply(request))
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,134 @@
+import base64
+import io
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from PIL import Image
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from ._bench import bench_database
+from .bench_identify_concurrency import CANNED_RESPONSE
+from .bench_normalize import MEDIA_TYPES, synthetic_photo
+
+# The identify page draws webcam frames onto a canvas this size
+WEBCAM_EDGE = 224
+
+
+def webcam_frame(seed=0):
+    # Smooth scene with sensor noise, roughly what a webcam delivers
+    rng = random.Random(seed)
+    image = Image.frombytes('RGB', (12, 9), rng.randbytes(12 * 9 * 3)).resize((640, 480), Image.Resampling.BICUBIC)
+    noise = Image.effect_noise(image.size, 12).convert('RGB')
+    return Image.blend(image, noise, 0.08).resize((WEBCAM_EDGE, WEBCAM_EDGE), Image.Resampling.BILINEAR)
+
+
+def encode(image, fmt, quality=None):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **({'quality': quality} if quality else {}))
+    return buffer.getvalue()
+
+
+def client_encode(image):
+    # What encodeCanvas produces: the configured format, stepping quality
+    # down by 0.15 until the upload fits CAPTURE_MAX_BYTES
+    fmt = 'WEBP' if settings.IMAGE_FORMAT.upper() == 'WEBP' else 'JPEG'
+    quality = settings.IMAGE_QUALITY
+    data = encode(image.convert('RGB'), fmt, quality)
+    while len(data) > settings.CAPTURE_MAX_BYTES and quality > 40:
+        quality -= 15
+        data = encode(image.convert('RGB'), fmt, quality)
+    return data, f'image/{fmt.lower()}'
+
+
+def client_downscale(data):
+    # preparePickedFile: files beyond the size or edge cap are scaled and re-encoded
+    with Image.open(io.BytesIO(data)) as image:
+        if len(data) <= settings.CAPTURE_MAX_BYTES and max(image.size) <= settings.IMAGE_MAX_EDGE:
+            return data, Image.MIME[image.format]
+        image.thumbnail((settings.IMAGE_MAX_EDGE, settings.IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+        return client_encode(image)
+
+
+def data_url(data, media_type):
+    return f'data:{media_type};base64,{base64.b64encode(data).decode()}'
+
+
+class Command(BaseCommand):
+    help = ("Compare what the identify page uploads and stores for webcam captures and picked photos: "
+            "the old PNG data URLs and full-size files against browser-encoded, size-capped blobs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='*', help="Photos to treat as picked files (defaults to a synthetic 12MP photo)")
+        parser.add_argument('--repeat', type=int, default=5, help="Uploads timed per payload")
+        parser.add_argument('--uplink-mbps', type=float, default=5.0,
+                            help="Client upload bandwidth used to estimate transfer time")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        picked = []
+        for path in options['images']:
+            path = Path(path)
+            if path.suffix.lower() not in MEDIA_TYPES:
+                raise CommandError(f"Unsupported image type: {path}")
+            picked.append((path.name, path.read_bytes(), MEDIA_TYPES[path.suffix.lower()]))
+        if not picked:
+            picked.append(('synthetic-12mp.jpg', synthetic_photo(), 'image/jpeg'))
+
+        frame = webcam_frame()
+        cases = [('webcam', (encode(frame, 'PNG'), 'image/png'), client_encode(frame))]
+        for name, data, media_type in picked:
+            cases.append((name, (data, media_type), client_downscale(data)))
+
+        client_mock = mock.MagicMock()
+        client_mock.messages.create.return_value = SimpleNamespace(content=[SimpleNamespace(text=CANNED_RESPONSE)])
+        results = []
+        # A single model, so one stubbed call answers every upload
+        with bench_database(), mock.patch('app.identify.claude_client', client_mock), \
+                override_settings(IDENTIFY_TRIAGE_MODEL=''):
+            for name, before, after in cases:
+                results.append({
+                    'image': name,
+                    'before': self.measure(*before, options),
+                    'after': self.measure(*after, options),
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            before, after = result['before'], result['after']
+            self.stdout.write(f"{result['image']}:")
+            self.stdout.write(f"  upload   {before['upload_bytes']:>12,} -> {after['upload_bytes']:>12,} bytes "
+                              f"({before['media_type']} -> {after['media_type']})")
+            self.stdout.write(f"  stored   {before['data_url_bytes']:>12,} -> {'IndexedDB blob':>12} "
+                              f"(localStorage keeps a key instead of the data URL)")
+            self.stdout.write(f"  transfer {before['transfer_ms']:>10.1f}ms -> {after['transfer_ms']:>10.1f}ms "
+                              f"at {options['uplink_mbps']} Mbit/s")
+            self.stdout.write(f"  server   {before['server_ms']:>10.1f}ms -> {after['server_ms']:>10.1f}ms")
+
+    def measure(self, data, media_type, options):
+        client = Client()
+        url = reverse('identify_predict')
+        timings = []
+        for _ in range(options['repeat']):
+            # Every upload is a cache miss, so normalization is always timed
+            with mock.patch('app.identify.result_cache.get', return_value=None), \
+                    mock.patch('app.identify.result_cache.get_similar', return_value=None):
+                start = time.perf_counter()
+                client.post(url, {'image': SimpleUploadedFile('capture', data, content_type=media_type)})
+                timings.append((time.perf_counter() - start) * 1000)
+        return {
+            'media_type': media_type,
+            'upload_bytes': len(data),
+            'data_url_bytes': len(data_url(data, media_type)),
+            'transfer_ms': round(len(data) * 8 / (options['uplink_mbps'] * 1000), 1),
+            'server_ms': round(statistics.median(timings), 2),
+        }
+
@@ -0,0 +1,84 @@
+import json
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum
+from app.community import community_snapshot, invalidate_community
+from app.models import CommunityTotals, UserTracker
+from ._bench import bench_database, summarize
+
+
+def naive_snapshot(limit):
+    # What a community page costs without the precomputed totals and cache
+    totals = UserTracker.objects.aggregate(devices=Sum('total_devices'), co2=Sum('total_co2'), kwh=Sum('total_kwh'))
+    leaders = list(
+        UserTracker.objects.order_by('-total_co2')
+        .values('user_id__username', 'total_devices', 'total_co2', 'total_kwh')[:limit]
+    )
+    return {'totals': totals, 'leaderboard': leaders}
+
+
+def cold_snapshot(limit):
+    invalidate_community()
+    return community_snapshot(limit)
+
+
+class Command(BaseCommand):
+    help = "Show community page latency staying flat as the number of users grows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default='1000,10000,100000', help="Comma-separated user counts")
+        parser.add_argument('--reads', type=int, default=200, help="Snapshots timed per mode and size")
+        parser.add_argument('--limit', type=int, default=10, help="Leaderboard size")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['users'].split(','))
+        results = {}
+        with bench_database():
+            created = 0
+            for size in sizes:
+                self.grow(created, size)
+                created = size
+                results[size] = {
+                    name: self.time(mode, options['limit'], options['reads'])
+                    for name, mode in (('naive', naive_snapshot), ('cold', cold_snapshot), ('cached', community_snapshot))
+                }
+        cache.clear()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for size, modes in results.items():
+            self.stdout.write(f"{size:>8} users: " + "  ".join(
+                f"{name} p50 {r['p50_ms']:.3f}ms p95 {r['p95_ms']:.3f}ms" for name, r in modes.items()
+            ))
+
+    def grow(self, start, end, batch=5000):
+        for offset in range(start, end, batch):
+            count = min(batch, end - offset)
+            users = User.objects.bulk_create([
+                User(username=f'bench-{i}', password='!') for i in range(offset, offset + count)
+            ])
+            trackers = [
+                UserTracker(user_id=user, total_devices=random.randint(1, 20),
+                            total_co2=random.randint(1, 5000), total_kwh=random.randint(1, 800))
+                for user in users
+            ]
+            UserTracker.objects.bulk_create(trackers)
+            CommunityTotals.objects.filter(shard=0).update(
+                devices=F('devices') + sum(t.total_devices for t in trackers),
+                co2=F('co2') + sum(t.total_co2 for t in trackers),
+                kwh=F('kwh') + sum(t.total_kwh for t in trackers)
+            )
+
+    def time(self, mode, limit, reads):
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(reads):
+            began = time.perf_counter()
+            mode(limit)
+            latencies.append((time.perf_counter() - began) * 1000)
+        return summarize(latencies, time.perf_counter() - start)
@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from app.models import UserTracker
+from app.tracking import device_history, record_devices
+from ._bench import bench_database, percentile
+
+DEVICE = {'class': 'Phone', 'device_co2': 3, 'device_kwh': 2}
+
+# Django's stock SQLite connection: rollback journal, deferred transactions, 5s timeout
+STOCK_OPTIONS = {'init_command': 'PRAGMA journal_mode=DELETE'}
+
+
+@contextmanager
+def sqlite_options(options):
+    # Every connection opened inside uses ``options``; connections share
+    # the settings dict, so threads started inside pick them up too
+    settings_dict = connection.settings_dict
+    saved = settings_dict['OPTIONS']
+    connection.close()
+    settings_dict['OPTIONS'] = options
+    try:
+        yield
+    finally:
+        connection.close()
+        settings_dict['OPTIONS'] = saved
+
+
+class Command(BaseCommand):
+    help = ("Concurrent tracker writes and history reads against a SQLite file, comparing Django's stock "
+            "connection settings with the tuned profile from settings (WAL, IMMEDIATE transactions, "
+            "busy timeout, mmap).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16)
+        parser.add_argument('--readers', type=int, default=4, help="Threads reading tracker history meanwhile")
+        parser.add_argument('--updates', type=int, default=50, help="Updates per writer")
+        parser.add_argument('--users', type=int, default=4, help="Users the writers share")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark compares SQLite connection profiles; the database is "
+                               f"{connection.vendor}")
+        tuned = settings.DATABASES['default'].get('OPTIONS', {})
+
+        results = {}
+        with bench_database():
+            for name, profile in (('stock', STOCK_OPTIONS), ('tuned', tuned)):
+                with sqlite_options(profile):
+                    results[name] = self.run(name, options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:>5}: {r['updates_per_second']:>8.1f} updates/s  p95 {r['update_p95_ms']:>7.1f}ms  "
+                f"p99 {r['update_p99_ms']:>7.1f}ms  {r['locked_errors']} locked  {r['other_errors']} other errors  "
+                f"totals {'exact' if r['totals_exact'] else 'WRONG'}  {r['reads_per_second']:>8.1f} reads/s"
+            )
+
+    def run(self, name, options):
+        users = [User.objects.create_user(f'contention-{name}-{i}') for i in range(max(1, options['users']))]
+        for user in users:
+            UserTracker.objects.create(user_id=user)
+
+        latencies, errors, reads = [], [], []
+        writing = threading.Event()
+        writing.set()
+
+        def write(writer):
+            try:
+                user = users[writer % len(users)]
+                for _ in range(options['updates']):
+                    start = time.perf_counter()
+                    try:
+                        record_devices(user, [DEVICE])
+                    except Exception as e:
+                        errors.append(e)
+                    else:
+                        latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        def read(reader):
+            count = 0
+            try:
+                user = users[reader % len(users)]
+                while writing.is_set():
+                    device_history(user, limit=settings.TRACKER_PAGE_SIZE)
+                    count += 1
+            finally:
+                reads.append(count)
+                connection.close()
+
+        readers = [threading.Thread(target=read, args=(i,)) for i in range(options['readers'])]
+        writers = [threading.Thread(target=write, args=(i,)) for i in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        locked = sum(1 for e in errors if isinstance(e, OperationalError) and 'locked' in str(e))
+        total_devices = UserTracker.objects.filter(user_id__in=users).aggregate(total=Sum('total_devices'))['total']
+        return {
+            'journal_mode': self.journal_mode(),
+            'updates': len(latencies),
+            'updates_per_second': round(len(latencies) / elapsed, 1),
+            'update_p50_ms': round(percentile(latencies, 0.50), 2),
+            'update_p95_ms': round(percentile(latencies, 0.95), 2),
+            'update_p99_ms': round(percentile(latencies, 0.99), 2),
+            'locked_errors': locked,
+            'other_errors': len(errors) - locked,
+            'totals_exact': total_devices == len(latencies),
+            'reads_per_second': round(sum(reads) / elapsed, 1),
+        }
+
+    def journal_mode(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
@@ -0,0 +1,233 @@
+import asyncio
+import io
+import json
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import anthropic
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from app.breaker import claude_breaker
+from app.cascade import model_version
+from app.models import IdentificationResult
+from app.result_cache import result_cache
+from ._bench import bench_database, summarize
+from ._fake_claude import FakeMessagesAPI
+from .bench_parser import DEFAULT_CORPUS, load_corpus
+
+MODES = ('wsgi', 'asgi')
+SCENARIOS = ('identify', 'identify_async', 'update_tracker', 'tracker_view')
+DEVICES = (('Laptop', 300, 50), ('Smartphone', 70, 4), ('Router', 40, 60), ('Monitor', 500, 120))
+
+
+def load_responses(path):
+    # A JSON list of response texts, or a parser corpus of {"response": ...} entries
+    return [entry['response'] if isinstance(entry, dict) else entry for entry in load_corpus(path)]
+
+
+def make_images(count, size, hit_rate, seed):
+    """JPEG uploads for ``count`` identify requests.
+
+    Each new upload is a distinct upscaled noise pattern, so it misses both
+    the digest and the perceptual-hash cache; a ``hit_rate`` fraction of
+    requests repeat an earlier upload instead.
+    """
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        if images and rng.random() < hit_rate:
+            images.append(rng.choice(images))
+            continue
+        image = Image.frombytes('RGB', (16, 16), rng.randbytes(16 * 16 * 3))
+        image = image.resize((size, size), Image.Resampling.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def is_failure(response):
+    # Identification errors come back as 200s with an "error" key
+    if response.status_code >= 400:
+        return True
+    if response.get('Content-Type', '').startswith('application/json'):
+        body = json.loads(response.content)
+        return 'error' in body or body.get('success') is False
+    return False
+
+
+class Command(BaseCommand):
+    help = ("End-to-end load test: drive the identify and tracker views at a fixed concurrency through "
+            "Django's WSGI and ASGI handlers, with Claude replaced by a local stub of the Messages API, "
+            "and report latency percentiles, throughput and queries per request.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Requests per scenario and mode")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--latency', type=float, default=0.2, help="Stub API latency in seconds")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of stub API calls that fail with 529 Overloaded")
+        parser.add_argument('--responses', default=str(DEFAULT_CORPUS),
+                            help="JSON file of canned model outputs (a list of strings or a parser corpus)")
+        parser.add_argument('--hit-rate', type=float, default=0.0,
+                            help="Fraction of identify requests that repeat an earlier upload")
+        parser.add_argument('--image-size', type=int, default=1024, help="Edge of the uploaded images in pixels")
+        parser.add_argument('--users', type=int, default=8, help="Users the tracker requests are spread over")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', metavar='PATH', help="Also write the JSON results to PATH")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        try:
+            responses = load_responses(options['responses'])
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read responses {options['responses']}: {e}")
+        if not responses:
+            raise CommandError("No canned responses")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+
+        images = make_images(options['requests'], options['image_size'], options['hit_rate'], options['seed'])
+        results = {
+            'config': {
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'latency': options['latency'],
+                'error_rate': options['error_rate'],
+                'hit_rate': options['hit_rate'],
+                'image_size': options['image_size'],
+                'users': options['users'],
+                'model': model_version(),
+                'metrics': settings.METRICS_ENABLED,
+            },
+        }
+
+        api = FakeMessagesAPI(responses, options['latency'], options['error_rate'], options['seed'])
+        with bench_database(), api, \
+                override_settings(CLAUDE_API_KEY='bench', CLAUDE_BASE_URL=api.url), \
+                mock.patch('app.identify.claude_client', anthropic.Anthropic(api_key='bench', base_url=api.url)):
+            users = [User.objects.create_user(f'bench-{i}') for i in range(max(1, options['users']))]
+            for mode in options['modes']:
+                run = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+                results[mode] = {}
+                for scenario in options['scenarios']:
+                    IdentificationResult.objects.all().delete()
+                    result_cache.memory.clear()
+                    claude_breaker.reset()
+                    before = api.snapshot()
+                    result = run(self.request_factory(scenario, images), options['requests'],
+                                 options['concurrency'], users)
+                    after = api.snapshot()
+                    result['upstream_calls'] = sum(after['calls'].values()) - sum(before['calls'].values())
+                    result['upstream_errors'] = after['errors'] - before['errors']
+                    results[mode][scenario] = result
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+                file.write('\n')
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for mode in options['modes']:
+            for scenario, r in results[mode].items():
+                self.stdout.write(
+                    f"{mode:>4} {scenario:<15} {r['throughput_rps']:>8.2f} req/s  p50 {r['p50_ms']:>7.1f}ms  "
+                    f"p95 {r['p95_ms']:>7.1f}ms  p99 {r['p99_ms']:>7.1f}ms  "
+                    f"{r['queries_per_request']:>5} queries/req  {r['failures']} failed  "
+                    f"{r['upstream_calls']} API calls"
+                )
+
+    def request_factory(self, scenario, images):
+        # i -> (method, path, client kwargs) for the i-th request of a scenario
+        if scenario in ('identify', 'identify_async'):
+            url = reverse('identify_predict' if scenario == 'identify' else 'identify_predict_async')
+            return lambda i: ('post', url, {
+                'data': {'image': SimpleUploadedFile('capture.jpg', images[i], content_type='image/jpeg')}
+            })
+        if scenario == 'update_tracker':
+            url = reverse('update_tracker')
+
+            def update(i):
+                name, co2, kwh = DEVICES[i % len(DEVICES)]
+                body = {'action': 'dispose_reuse', 'device_name': name, 'device_co2': co2, 'device_kwh': kwh}
+                return 'post', url, {'data': json.dumps(body), 'content_type': 'application/json'}
+            return update
+        url = reverse('tracker')
+        return lambda i: ('get', url, {})
+
+    def sample(self, response, start):
+        request = getattr(response, 'wsgi_request', None) or getattr(response, 'asgi_request', None)
+        metrics = getattr(request, 'metrics', None)
+        return ((time.perf_counter() - start) * 1000, response.status_code, is_failure(response),
+                metrics.queries if metrics is not None else None)
+
+    def report(self, samples, elapsed):
+        result = summarize([latency for latency, _, _, _ in samples], elapsed)
+        queries = [count for _, _, _, count in samples if count is not None]
+        result['statuses'] = dict(sorted(Counter(str(status) for _, status, _, _ in samples).items()))
+        result['failures'] = sum(failed for _, _, failed, _ in samples)
+        # None when the metrics middleware is disabled
+        result['queries_per_request'] = round(statistics.fmean(queries), 2) if queries else None
+        result['max_queries'] = max(queries) if queries else None
+        return result
+
+    def run_wsgi(self, make_request, total, concurrency, users):
+        # One client per worker thread, as in a threaded WSGI server
+        clients = []
+        for worker in range(concurrency):
+            client = Client(raise_request_exception=False)
+            client.force_login(users[worker % len(users)])
+            clients.append(client)
+
+        def work(worker):
+            samples = []
+            try:
+                for i in range(worker, total, concurrency):
+                    method, path, kwargs = make_request(i)
+                    start = time.perf_counter()
+                    samples.append(self.sample(getattr(clients[worker], method)(path, **kwargs), start))
+            finally:
+                connection.close()
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [sample for worker in pool.map(work, range(concurrency)) for sample in worker]
+        return self.report(samples, time.perf_counter() - start)
+
+    def run_asgi(self, make_request, total, concurrency, users):
+        # Concurrent requests on one event loop; sync views run on Django's
+        # thread-sensitive executor exactly as under an ASGI server
+
+        async def work(client, worker):
+            samples = []
+            for i in range(worker, total, concurrency):
+                method, path, kwargs = make_request(i)
+                start = time.perf_counter()
+                samples.append(self.sample(await getattr(client, method)(path, **kwargs), start))
+            return samples
+
+        async def run():
+            clients = []
+            for worker in range(concurrency):
+                client = AsyncClient(raise_request_exception=False)
+                await client.aforce_login(users[worker % len(users)])
+                clients.append(client)
+            start = time.perf_counter()
+            workers = await asyncio.gather(*(work(client, worker) for worker, client in enumerate(clients)))
+            return [sample for worker in workers for sample in worker], time.perf_counter() - start
+
+        samples, elapsed = asyncio.run(run())
+        return self.report(samples, elapsed)
@@ -0,0 +1,67 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from app.models import EwasteCenter
+from app.spatial import CenterIndex, haversine_km
+from ._bench import summarize
+
+
+def synthetic_centers(count, rare_every=1000):
+    # Centers scattered over inhabited latitudes; one in ``rare_every``
+    # takes only "solar" so the filtered benchmark has a sparse category
+    categories = EwasteCenter.CATEGORIES
+    for i in range(count):
+        accepts = ['solar'] if i % rare_every == 0 else random.sample(categories, 3)
+        yield (i + 1, f'Center {i + 1}', '', random.uniform(-55, 70), random.uniform(-180, 180), accepts, '')
+
+
+def brute_force(centers, lat, lon, k, accepts):
+    matches = (c for c in centers if accepts is None or accepts in c[5])
+    return [c[0] for c in sorted(matches, key=lambda c: haversine_km(lat, lon, c[3], c[4]))[:k]]
+
+
+class Command(BaseCommand):
+    help = "Time nearest-center queries against a large synthetic spatial index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centers', type=int, default=300000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('-k', type=int, default=5)
+        parser.add_argument('--verify', type=int, default=10, help="Queries checked against a linear scan")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        centers = list(synthetic_centers(options['centers']))
+        start = time.perf_counter()
+        index = CenterIndex(centers)
+        results = {'centers': len(index), 'build_seconds': round(time.perf_counter() - start, 2)}
+
+        points = [(random.uniform(-55, 70), random.uniform(-180, 180)) for _ in range(options['queries'])]
+        for name, accepts in (('any', None), ('phones', 'phones'), ('solar (sparse)', 'solar')):
+            latencies = []
+            began = time.perf_counter()
+            for lat, lon in points:
+                query_start = time.perf_counter()
+                index.nearest(lat, lon, options['k'], accepts)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+            results[name] = summarize(latencies, time.perf_counter() - began)
+
+        mismatches = 0
+        for lat, lon in points[:options['verify']]:
+            for accepts in (None, 'solar'):
+                found = [center['id'] for center in index.nearest(lat, lon, options['k'], accepts)]
+                mismatches += found != brute_force(centers, lat, lon, options['k'], accepts)
+        results['verify_mismatches'] = mismatches
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"Indexed {results['centers']} centers in {results['build_seconds']}s")
+        for name in ('any', 'phones', 'solar (sparse)'):
+            r = results[name]
+            self.stdout.write(f"{name:>15}: p50 {r['p50_ms'] * 1000:.0f}us  p95 {r['p95_ms'] * 1000:.0f}us  "
+                              f"p99 {r['p99_ms'] * 1000:.0f}us  ({r['throughput_rps']:.0f} queries/s)")
+        self.stdout.write(f"Linear-scan check: {mismatches} mismatches")
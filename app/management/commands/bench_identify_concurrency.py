@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from app.result_cache import result_cache
+from ._bench import bench_database, summarize
+
+CANNED_RESPONSE = "DEVICE: Router\nDEVICE_CO2: 40\nDEVICE_KWH: 60\nCONFIDENCE: 95\n\nDISPOSAL:\n- Recycle\n\nREUSE IDEAS:\n1. Repeater\n"
+
+
+def canned_message():
+    return SimpleNamespace(content=[SimpleNamespace(text=CANNED_RESPONSE)])
+
+
+class Command(BaseCommand):
+    help = ("Load-test the sync and async identify endpoints against a stubbed Claude API "
+            "with fixed latency and compare throughput.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=1.0, help="Simulated API latency in seconds")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Worker threads available to the sync path, as in a threaded WSGI server")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+
+        def slow_create(**kwargs):
+            time.sleep(latency)
+            return canned_message()
+
+        async def aslow_create(**kwargs):
+            await asyncio.sleep(latency)
+            return canned_message()
+
+        sync_client = mock.MagicMock()
+        sync_client.messages.create.side_effect = slow_create
+        async_client = mock.MagicMock()
+        async_client.messages.create.side_effect = aslow_create
+
+        with bench_database(), \
+                mock.patch('app.identify.claude_client', sync_client), \
+                mock.patch('app.identify.get_async_client', return_value=async_client):
+            results = {
+                'sync': self.run_sync(options['requests'], options['threads']),
+                'async': self.run_async(options['requests']),
+            }
+        results['speedup'] = round(results['async']['throughput_rps'] / results['sync']['throughput_rps'], 2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name in ('sync', 'async'):
+            r = results[name]
+            self.stdout.write(f"{name:>5}: {r['throughput_rps']:>8.2f} req/s  "
+                              f"p50 {r['p50_ms']:.0f}ms  p95 {r['p95_ms']:.0f}ms  p99 {r['p99_ms']:.0f}ms")
+        self.stdout.write(f"async/sync throughput: {results['speedup']}x")
+
+    def upload(self, prefix, i):
+        # Unique bytes per request so every request reaches the stubbed API
+        return SimpleUploadedFile('capture.png', f'{prefix}-{i}'.encode(), content_type='image/png')
+
+    def run_sync(self, total, threads):
+        result_cache.memory.clear()
+        url = reverse('identify_predict')
+
+        def one(i):
+            start = time.perf_counter()
+            Client().post(url, {'image': self.upload('sync', i)})
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(one, range(total)))
+        return summarize(latencies, time.perf_counter() - start)
+
+    def run_async(self, total):
+        result_cache.memory.clear()
+        url = reverse('identify_predict_async')
+
+        async def one(client, i):
+            start = time.perf_counter()
+            await client.post(url, {'image': self.upload('async', i)})
+            return (time.perf_counter() - start) * 1000
+
+        async def run():
+            client = AsyncClient()
+            return await asyncio.gather(*(one(client, i) for i in range(total)))
+
+        start = time.perf_counter()
+        latencies = asyncio.run(run())
+        return summarize(latencies, time.perf_counter() - start)
@@ -0,0 +1,89 @@
+import base64
+import io
+import json
+import statistics
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from app.identify import call_claude
+from app.imaging import normalize_image
+
+MEDIA_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp', '.gif': 'image/gif'}
+
+
+def synthetic_photo(width=4032, height=3024):
+    # Noisy full-resolution frame, roughly the size of a modern phone photo
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare payload size and latency of identification uploads with and without normalization."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='*', help="Image files to benchmark (defaults to a synthetic 12MP photo)")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--live', action='store_true', help="Also time real Claude calls for both payloads")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        samples = []
+        for path in options['images']:
+            path = Path(path)
+            if path.suffix.lower() not in MEDIA_TYPES:
+                raise CommandError(f"Unsupported image type: {path}")
+            samples.append((path.name, path.read_bytes(), MEDIA_TYPES[path.suffix.lower()]))
+        if not samples:
+            samples.append(('synthetic-12mp.jpg', synthetic_photo(), 'image/jpeg'))
+
+        results = []
+        for name, data, media_type in samples:
+            before_ms, after_ms = [], []
+            for _ in range(options['repeat']):
+                raw_b64, elapsed = timed(base64.b64encode, data)
+                before_ms.append(elapsed)
+
+                start = time.perf_counter()
+                image = normalize_image(data, media_type)
+                normalized_b64 = base64.b64encode(image.data)
+                after_ms.append((time.perf_counter() - start) * 1000)
+
+            result = {
+                'image': name,
+                'max_edge': settings.IMAGE_MAX_EDGE,
+                'format': settings.IMAGE_FORMAT,
+                'quality': settings.IMAGE_QUALITY,
+                'bytes_before': len(data),
+                'bytes_after': len(image.data),
+                'base64_before': len(raw_b64),
+                'base64_after': len(normalized_b64),
+                'prepare_ms_before': round(statistics.median(before_ms), 2),
+                'prepare_ms_after': round(statistics.median(after_ms), 2),
+            }
+            if options['live']:
+                _, result['claude_ms_before'] = timed(call_claude, data, media_type)
+                _, result['claude_ms_after'] = timed(call_claude, image.data, image.media_type)
+            results.append(result)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for result in results:
+            saved = result['bytes_before'] - result['bytes_after']
+            self.stdout.write(f"{result['image']}:")
+            self.stdout.write(f"  payload  {result['base64_before']:>12,} -> {result['base64_after']:>12,} base64 bytes "
+                              f"({saved:,} bytes saved)")
+            self.stdout.write(f"  prepare  {result['prepare_ms_before']:>10.2f}ms -> {result['prepare_ms_after']:>10.2f}ms")
+            if options['live']:
+                self.stdout.write(f"  claude   {result['claude_ms_before']:>10.2f}ms -> {result['claude_ms_after']:>10.2f}ms")
@@ -0,0 +1,141 @@
+import json
+import statistics
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from app.models import IdentificationResult
+from app.parsing import parse_response
+from ._bench import percentile
+
+DEFAULT_CORPUS = Path(__file__).resolve().parents[2] / 'testdata' / 'parser_corpus.json'
+
+
+def legacy_parse(full_response):
+    # The original startswith/replace loop, kept as the benchmark baseline
+    device_name, device_co2, device_kwh = "Unknown Device", 0, 0
+    section, disposal_lines, reuse_lines = None, [], []
+    for line in full_response.split('\n'):
+        line = line.strip()
+        if line.startswith('DEVICE:'):
+            device_name = line.replace('DEVICE:', '').strip()
+        elif line.startswith('DEVICE_CO2:'):
+            try:
+                device_co2 = int(line.replace('DEVICE_CO2:', '').strip().split(' ')[0])
+            except ValueError:
+                device_co2 = 0
+        elif line.startswith('DEVICE_KWH:'):
+            try:
+                device_kwh = int(line.replace('DEVICE_KWH:', '').strip().split(' ')[0])
+            except ValueError:
+                device_kwh = 0
+        elif line.startswith('DISPOSAL:'):
+            section = 'disposal'
+        elif line.startswith('REUSE IDEAS:'):
+            section = 'reuse'
+        elif line and section == 'disposal':
+            disposal_lines.append(line)
+        elif line and section == 'reuse':
+            reuse_lines.append(line)
+
+    for prefix in ["This is a ", "This appears to be a ", "I can see a ",
+                   "The image shows a ", "This looks like a ", "I identify this as a "]:
+        if device_name.lower().startswith(prefix.lower()):
+            device_name = device_name[len(prefix):].strip()
+    device_name = device_name.split('(')[0].strip()
+    device_name = device_name[:1].upper() + device_name[1:]
+    if device_name == "No Device Detected":
+        return {'class': device_name}
+    return {
+        'class': device_name, 'full_response': full_response,
+        'disposal_info': '\n'.join(disposal_lines), 'reuse_ideas': '\n'.join(reuse_lines),
+        'device_co2': device_co2, 'device_kwh': device_kwh,
+    }
+
+
+def load_corpus(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def matches(payload, expected):
+    return {key: value for key, value in payload.items() if key != 'full_response'} == expected
+
+
+def time_parser(parse, corpus, repeat):
+    # Microseconds per response, one sample per corpus pass
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for entry in corpus:
+            parse(entry['response'])
+        samples.append((time.perf_counter() - start) * 1e6 / len(corpus))
+    return samples
+
+
+class Command(BaseCommand):
+    help = "Benchmark the response parser on a corpus of model outputs against the original parser."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=str(DEFAULT_CORPUS), help="Corpus JSON file")
+        parser.add_argument('--repeat', type=int, default=2000, help="Passes over the corpus")
+        parser.add_argument('--max-mean-us', type=float,
+                            help="Fail if the mean parse time per response exceeds this many microseconds")
+        parser.add_argument('--record', metavar='PATH',
+                            help="Write the stored identification results' raw responses to PATH as a "
+                                 "corpus, with their current parses as the expected output, and exit")
+        parser.add_argument('--limit', type=int, default=500, help="Most recent results to --record")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        if options['record']:
+            return self.record(options['record'], options['limit'])
+
+        try:
+            corpus = load_corpus(options['corpus'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read corpus {options['corpus']}: {e}")
+        if not corpus:
+            raise CommandError("The corpus is empty")
+
+        results = {'responses': len(corpus), 'repeat': options['repeat']}
+        for name, parse in (('parser', parse_response), ('legacy', legacy_parse)):
+            samples = time_parser(parse, corpus, options['repeat'])
+            results[name] = {
+                'mean_us': round(statistics.fmean(samples), 2),
+                'p50_us': round(percentile(samples, 0.50), 2),
+                'p95_us': round(percentile(samples, 0.95), 2),
+                'mismatches': [entry['name'] for entry in corpus
+                               if 'expected' in entry and not matches(parse(entry['response']), entry['expected'])],
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(f"{results['responses']} responses x {results['repeat']} passes")
+            for name in ('parser', 'legacy'):
+                result = results[name]
+                self.stdout.write(
+                    f"  {name:<7} mean {result['mean_us']:>8.2f}us  p50 {result['p50_us']:>8.2f}us  "
+                    f"p95 {result['p95_us']:>8.2f}us  mismatches {len(result['mismatches'])}"
+                )
+
+        if results['parser']['mismatches']:
+            raise CommandError(f"Parser output changed for: {', '.join(results['parser']['mismatches'])}")
+        if options['max_mean_us'] is not None and results['parser']['mean_us'] > options['max_mean_us']:
+            raise CommandError(
+                f"Mean parse time {results['parser']['mean_us']}us exceeds {options['max_mean_us']}us"
+            )
+
+    def record(self, path, limit):
+        corpus = []
+        rows = IdentificationResult.objects.order_by('-created_at').values_list('digest', 'payload')[:limit]
+        for digest, payload in rows:
+            response = payload.get('full_response')
+            if response:
+                expected = parse_response(response)
+                expected.pop('full_response', None)
+                corpus.append({'name': digest[:12], 'response': response, 'expected': expected})
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(corpus, file, indent=2, ensure_ascii=False)
+            file.write('\n')
+        self.stdout.write(f"Recorded {len(corpus)} responses to {path}")
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.importers import READERS, CenterImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = ("Stream recycling-center data from a CSV, GeoJSON or newline-delimited GeoJSON file "
+            "into EwasteCenter, inserting new centers and updating changed ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help="Defaults to the file extension")
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and diff without writing")
+        parser.add_argument('--show-errors', type=int, default=10, help="Invalid rows to list at the end")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        try:
+            fmt = options['format'] or detect_format(options['path'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        importer = CenterImporter(
+            batch_size=options['batch_size'], dry_run=options['dry_run'], progress=self.report_progress
+        )
+        try:
+            with open(options['path'], encoding=options['encoding'], newline='') as file:
+                stats = importer.run(READERS[fmt](file))
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+        except ValueError as e:
+            raise CommandError(f"Could not parse {options['path']}: {e}")
+
+        for line, error in importer.errors[:options['show_errors']]:
+            self.stderr.write(f"  row {line}: {error}")
+        summary = (
+            f"{stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/s): "
+            f"{stats['created']} created, {stats['updated']} updated, {stats['unchanged']} unchanged, "
+            f"{stats['duplicates']} duplicates, {stats['invalid']} invalid"
+        )
+        if options['dry_run']:
+            summary += " (dry run, nothing written)"
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def report_progress(self, stats, rate):
+        if self.verbosity >= 1:
+            self.stdout.write(f"  {stats['rows']} rows read, {stats['created']} created, "
+                              f"{stats['updated']} updated ({rate} rows/s)")
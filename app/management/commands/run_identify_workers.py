@@ -0,0 +1,34 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = "Run a dedicated pool of identification queue workers until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        threads = [
+            threading.Thread(target=jobs.work, args=(stop,), name=f'identify-worker-{i}')
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} identification workers")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
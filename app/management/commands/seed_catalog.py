@@ -0,0 +1,33 @@
+import json
+from django.core.management.base import BaseCommand
+from app.catalog import seed_from_history
+
+
+class Command(BaseCommand):
+    help = ("Seed the device catalog from tracked history: frequent device names become entries "
+            "with median footprint figures, and spelling variants become aliases.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-samples', type=int, default=3, help="Times a device must be tracked to be added")
+        parser.add_argument('--update-figures', action='store_true',
+                            help="Recompute figures of existing entries from history")
+        parser.add_argument('--dry-run', action='store_true', help="Report without writing")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        report = seed_from_history(
+            min_samples=options['min_samples'], update_figures=options['update_figures'], dry_run=options['dry_run']
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for item in report:
+            self.stdout.write(
+                f"{item['action']:>8} {item['name']}: {item['device_co2']} kg CO2, {item['device_kwh']} kWh "
+                f"({item['samples']} samples; {', '.join(item['spellings'])})"
+            )
+        created = sum(1 for item in report if item['action'] == 'created')
+        summary = f"{created} entries created, {len(report) - created} extended"
+        if options['dry_run']:
+            summary += " (dry run, nothing written)"
+        self.stdout.write(self.style.SUCCESS(summary))
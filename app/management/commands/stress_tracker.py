@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from app.models import DeviceTracker, UserTracker
+from app.tracking import record_devices
+from ._bench import bench_database
+
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+DEVICE = {'class': 'Phone', 'device_co2': 3, 'device_kwh': 2}
+
+
+def legacy_update(user, device):
+    # The read-modify-write update_tracker used before totals moved into the database
+    tracker, _ = UserTracker.objects.get_or_create(user_id=user)
+    tracker.total_devices += 1
+    tracker.total_co2 += device['device_co2']
+    tracker.total_kwh += device['device_kwh']
+    tracker.save()
+    DeviceTracker.objects.create(
+        user=user, device_name=device['class'], device_co2=device['device_co2'], device_kwh=device['device_kwh']
+    )
+
+
+def atomic_update(user, device):
+    record_devices(user, [device])
+
+
+class Command(BaseCommand):
+    help = ("Hammer one user's tracker from many threads and check the totals stay exact, "
+            "comparing the atomic update path with the old read-modify-write one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16)
+        parser.add_argument('--updates', type=int, default=50, help="Updates per writer")
+        parser.add_argument('--json', action='store_true', help="Print machine-readable results")
+
+    def handle(self, *args, **options):
+        with bench_database():
+            results = {
+                name: self.run(name, update, options['writers'], options['updates'])
+                for name, update in (('legacy', legacy_update), ('atomic', atomic_update))
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:>6}: expected {r['expected']}, counted {r['total_devices']} "
+                f"({r['lost_updates']} lost, {r['errors']} errors), history rows {r['history_rows']}, "
+                f"{r['queries_per_call']} queries/call, {r['updates_per_second']} updates/s"
+            )
+
+    def run(self, name, update, writers, per_writer):
+        user = User.objects.create_user(f'stress-{name}')
+        update(user, DEVICE)
+
+        # Data statements issued by one call once the tracker row exists
+        with CaptureQueriesContext(connection) as queries:
+            update(user, DEVICE)
+        queries_per_call = sum(
+            1 for query in queries.captured_queries
+            if not query['sql'].upper().startswith(TRANSACTION_CONTROL)
+        )
+
+        errors = []
+
+        def write():
+            try:
+                for _ in range(per_writer):
+                    try:
+                        update(user, DEVICE)
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        expected = 2 + writers * per_writer
+        tracker = UserTracker.objects.get(user_id=user)
+        return {
+            'expected': expected,
+            'total_devices': tracker.total_devices,
+            'total_co2_exact': tracker.total_co2 == expected * DEVICE['device_co2'],
+            'lost_updates': expected - len(errors) - tracker.total_devices,
+            'errors': len(errors),
+            'history_rows': DeviceTracker.objects.filter(user=user).count(),
+            'queries_per_call': queries_per_call,
+            'updates_per_second': round(writers * per_writer / elapsed, 1),
+        }
@@ -0,0 +1,286 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .breaker import CLOSED, HALF_OPEN, OPEN, claude_breaker
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; buckets are only made cumulative when rendered."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {round(total, 6)}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read when metrics are scraped."""
+
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        _registry.append(self)
+
+    def render(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge', f'{self.name} {self.read()}']
+
+
+REQUEST_SECONDS = Histogram('greenbyte_request_duration_seconds', "Time to produce a response, by view.",
+                            ('view', 'method', 'status'))
+STAGE_SECONDS = Histogram('greenbyte_stage_duration_seconds', "Time spent in each instrumented stage.", ('stage',))
+REQUEST_QUERIES = Histogram('greenbyte_request_db_queries', "Database queries per request, by view.",
+                            ('view',), buckets=QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('greenbyte_request_db_seconds', "Time in database queries per request, by view.",
+                               ('view',))
+REQUEST_BYTES = Counter('greenbyte_request_bytes_total', "Request body bytes received, by view.", ('view',))
+RESPONSE_BYTES = Counter('greenbyte_response_bytes_total', "Response body bytes sent, by view.", ('view',))
+UPSTREAM_TOKENS = Counter('greenbyte_upstream_tokens_total', "Claude API tokens used, by model and direction.",
+                          ('model', 'direction'))
+BREAKER_STATE = Gauge('greenbyte_claude_breaker_state', "Claude circuit breaker: 0 closed, 1 half-open, 2 open.",
+                      lambda: {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[claude_breaker.state])
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    # Everything measured while serving one request
+    __slots__ = ('stages', 'queries', 'db_seconds', 'tokens')
+
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.tokens = {}
+
+
+# Copied into sync_to_async threads, so ORM work done there still counts
+_current = contextvars.ContextVar('greenbyte_request_metrics', default=None)
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.name)
+        request = _current.get()
+        if request is not None:
+            request.stages[self.name] = request.stages.get(self.name, 0.0) + elapsed
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Time a block as one stage of the current request: ``with stage('parse'): ...``"""
+    if not settings.METRICS_ENABLED:
+        return _NO_STAGE
+    return _Stage(name)
+
+
+def record_usage(model, usage):
+    # Token counts from a Claude ``message.usage``
+    if not settings.METRICS_ENABLED or usage is None:
+        return
+    request = _current.get()
+    for direction in ('input', 'output'):
+        tokens = getattr(usage, f'{direction}_tokens', 0)
+        if isinstance(tokens, int) and tokens:
+            UPSTREAM_TOKENS.inc(tokens, model, direction)
+            if request is not None:
+                request.tokens[direction] = request.tokens.get(direction, 0) + tokens
+
+
+def _count_query(execute, sql, params, many, context):
+    request = _current.get()
+    if request is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request.queries += 1
+        request.db_seconds += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if settings.METRICS_ENABLED and _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class MetricsMiddleware:
+    """Time every request and record its stages, queries and bytes.
+
+    Removed from the stack entirely when ``METRICS_ENABLED`` is off.
+    The request's counters are available as ``request.metrics``. With ``METRICS_LOG_REQUESTS`` each request is also logged as one JSON
+    object. Streamed response bodies are counted as they are sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        metrics = request.metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        metrics = request.metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        bytes_in = int(request.META.get('CONTENT_LENGTH') or 0)
+
+        REQUEST_SECONDS.observe(elapsed, view, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(metrics.queries, view)
+        REQUEST_DB_SECONDS.observe(metrics.db_seconds, view)
+        REQUEST_BYTES.inc(bytes_in, view)
+        if not response.streaming:
+            bytes_out = len(response.content)
+            RESPONSE_BYTES.inc(bytes_out, view)
+        else:
+            bytes_out = None
+            if not response.is_async:
+                response.streaming_content = self._counted(response.streaming_content, view)
+
+        if settings.METRICS_LOG_REQUESTS:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in metrics.stages.items()},
+                'db_queries': metrics.queries,
+                'db_ms': round(metrics.db_seconds * 1000, 2),
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out,
+                'tokens': metrics.tokens,
+            }))
+
+    @staticmethod
+    def _counted(chunks, view):
+        for chunk in chunks:
+            RESPONSE_BYTES.inc(len(chunk), view)
+            yield chunk
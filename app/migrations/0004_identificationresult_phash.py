@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_identificationresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='identificationresult',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='identificationresult',
+            name='phash_band_0',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='identificationresult',
+            name='phash_band_1',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='identificationresult',
+            name='phash_band_2',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='identificationresult',
+            name='phash_band_3',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='identificationresult',
+            name='version',
+            field=models.CharField(default='', max_length=100),
+        ),
+    ]
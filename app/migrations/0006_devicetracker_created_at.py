@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:15
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_identificationjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicetracker',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='devicetracker',
+            index=models.Index(fields=['user', 'created_at'], name='device_user_created_idx'),
+        ),
+    ]
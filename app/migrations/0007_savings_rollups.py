@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    # Charts read only the rollups, so existing history has to be in them from the start
+    DeviceTracker = apps.get_model('app', 'DeviceTracker')
+    rollups = {name: apps.get_model('app', name) for name in ('UserDailySavings', 'UserMonthlySavings', 'GlobalDailySavings')}
+    buckets = (
+        DeviceTracker.objects.annotate(period=TruncDate('created_at'))
+        .values('user_id', 'period')
+        .annotate(devices=Count('id'), co2=Sum('device_co2'), kwh=Sum('device_kwh'))
+        .order_by()
+    )
+    totals = {name: {} for name in rollups}
+    for bucket in buckets.iterator(chunk_size=5000):
+        figures = (bucket['devices'], bucket['co2'] or 0, bucket['kwh'] or 0)
+        for name, key in (('UserDailySavings', (bucket['user_id'], bucket['period'])),
+                          ('UserMonthlySavings', (bucket['user_id'], bucket['period'].replace(day=1))),
+                          ('GlobalDailySavings', (None, bucket['period']))):
+            totals[name][key] = [a + b for a, b in zip(totals[name].get(key, (0, 0, 0)), figures)]
+
+    for name, model in rollups.items():
+        model.objects.bulk_create([
+            model(period=period, devices=devices, co2=co2, kwh=kwh, **({} if user_id is None else {'user_id': user_id}))
+            for (user_id, period), (devices, co2, kwh) in totals[name].items()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_devicetracker_created_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalDailySavings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('devices', models.IntegerField(default=0)),
+                ('co2', models.IntegerField(default=0)),
+                ('kwh', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period',), name='global_daily_savings_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDailySavings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('devices', models.IntegerField(default=0)),
+                ('co2', models.IntegerField(default=0)),
+                ('kwh', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'period'), name='user_daily_savings_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserMonthlySavings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('devices', models.IntegerField(default=0)),
+                ('co2', models.IntegerField(default=0)),
+                ('kwh', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'period'), name='user_monthly_savings_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def seed_totals(apps, schema_editor):
+    UserTracker = apps.get_model('app', 'UserTracker')
+    CommunityTotals = apps.get_model('app', 'CommunityTotals')
+    totals = UserTracker.objects.aggregate(devices=Sum('total_devices'), co2=Sum('total_co2'), kwh=Sum('total_kwh'))
+    CommunityTotals.objects.create(pk=1, **{field: value or 0 for field, value in totals.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_savings_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommunityTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('devices', models.IntegerField(default=0)),
+                ('co2', models.IntegerField(default=0)),
+                ('kwh', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Community Totals',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='usertracker',
+            index=models.Index(fields=['-total_co2', 'user_id'], name='tracker_leaderboard_idx'),
+        ),
+        migrations.RunPython(seed_totals, migrations.RunPython.noop),
+    ]
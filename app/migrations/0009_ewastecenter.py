@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_community_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EwasteCenter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('address', models.CharField(blank=True, default='', max_length=500)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('accepts', models.JSONField(blank=True, default=list)),
+                ('website', models.URLField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:27
+
+import hashlib
+from django.db import migrations, models
+
+
+def fill_dedupe_keys(apps, schema_editor):
+    # Same key as EwasteCenter.make_dedupe_key at the time of this migration
+    EwasteCenter = apps.get_model('app', 'EwasteCenter')
+    centers = list(EwasteCenter.objects.all())
+    for center in centers:
+        identity = f"{' '.join(center.name.split()).casefold()}|{center.latitude:.4f}|{center.longitude:.4f}"
+        center.dedupe_key = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+    EwasteCenter.objects.bulk_update(centers, ['dedupe_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_ewastecenter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ewastecenter',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='ewastecenter',
+            name='dedupe_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_dedupe_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_ewastecenter_import_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceCatalog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('aliases', models.JSONField(blank=True, default=list)),
+                ('device_co2', models.IntegerField(default=0)),
+                ('device_kwh', models.IntegerField(default=0)),
+                ('samples', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Device Catalog Entry',
+                'verbose_name_plural': 'Device Catalog',
+            },
+        ),
+        migrations.AddField(
+            model_name='devicetracker',
+            name='catalog',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.devicecatalog'),
+        ),
+    ]
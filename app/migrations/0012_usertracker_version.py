@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_devicecatalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertracker',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
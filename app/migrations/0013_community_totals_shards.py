@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_usertracker_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communitytotals',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='communitytotals',
+            constraint=models.UniqueConstraint(fields=('shard',), name='community_totals_shard_unique'),
+        ),
+    ]
@@ -1,4 +1,7 @@
+import hashlib
+import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class UserTracker(models.Model):
@@ -6,6 +9,10 @@ class UserTracker(models.Model):
     total_devices = models.IntegerField(default=0)
     total_co2 = models.IntegerField(default=0)
     total_kwh = models.IntegerField(default=0)
+    # Nanosecond time of the last tracked device, 0 before the first. The
+    # tracker page's ETag and Last-Modified come from it, so every worker
+    # agrees on them whatever the cache backend.
+    version = models.BigIntegerField(default=0)
     
     def __str__(self):
         return f"Tracker for {self.user_id.username}"
@@ -13,12 +20,177 @@ class UserTracker(models.Model):
     class Meta:
         verbose_name = "User Tracker"
         verbose_name_plural = "User Trackers"
+        indexes = [
+            # Leaderboard reads walk this index instead of sorting every tracker
+            models.Index(fields=['-total_co2', 'user_id'], name='tracker_leaderboard_idx'),
+        ]
+
+class DeviceCatalog(models.Model):
+    # Canonical device types with fixed footprint figures, so the same
+    # device always counts the same regardless of what the model estimates
+    name = models.CharField(max_length=255, unique=True)
+    aliases = models.JSONField(default=list, blank=True)
+    device_co2 = models.IntegerField(default=0)
+    device_kwh = models.IntegerField(default=0)
+    # Tracked devices that informed the figures, when seeded from history
+    samples = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Device Catalog Entry"
+        verbose_name_plural = "Device Catalog"
 
 class DeviceTracker(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     device_name = models.CharField(max_length=255)
+    catalog = models.ForeignKey(DeviceCatalog, null=True, blank=True, on_delete=models.SET_NULL)
     device_co2 = models.IntegerField(default=0)
     device_kwh = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.device_name
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='device_user_created_idx'),
+        ]
+
+class IdentificationResult(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    version = models.CharField(max_length=100, default='')
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # 64-bit perceptual hash, stored signed, and its four 16-bit bands.
+    # Each band is indexed so near-duplicate lookups never scan the table.
+    phash = models.BigIntegerField(null=True, blank=True)
+    phash_band_0 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_1 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_2 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_band_3 = models.IntegerField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.payload.get('class', '')} ({self.digest[:12]})"
+
+
+class IdentificationJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    image = models.BinaryField()
+    media_type = models.CharField(max_length=50)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Earliest time a worker may pick the job up; pushed back on retries
+    available_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='job_status_available_idx'),
+        ]
+
+class SavingsRollup(models.Model):
+    # Running totals for one time bucket, kept in step with DeviceTracker
+    period = models.DateField()
+    devices = models.IntegerField(default=0)
+    co2 = models.IntegerField(default=0)
+    kwh = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class UserDailySavings(SavingsRollup):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period'], name='user_daily_savings_unique'),
+        ]
+
+class UserMonthlySavings(SavingsRollup):
+    # period is the first day of the month
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period'], name='user_monthly_savings_unique'),
+        ]
+
+class GlobalDailySavings(SavingsRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period'], name='global_daily_savings_unique'),
+        ]
+
+class CommunityTotals(models.Model):
+    # Site-wide totals split across rows by user_id % COMMUNITY_TOTALS_SHARDS,
+    # so concurrent writers rarely wait on the same row; summed on read
+    shard = models.PositiveSmallIntegerField(default=0)
+    devices = models.IntegerField(default=0)
+    co2 = models.IntegerField(default=0)
+    kwh = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Community Totals"
+        constraints = [
+            models.UniqueConstraint(fields=['shard'], name='community_totals_shard_unique'),
+        ]
+
+class DataVersion(models.Model):
+    # Nanosecond time of the last change to a dataset that processes keep in
+    # memory (e.g. "centers"), set in the transaction that changes it so every
+    # worker sees the new version exactly when the data commits
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return self.device_name
\ No newline at end of file
+        return f"{self.name} @ {self.version}"
+
+class EwasteCenter(models.Model):
+    # Device categories a center takes, e.g. "phones", "batteries"
+    CATEGORIES = ['phones', 'computers', 'batteries', 'tvs', 'appliances', 'cables', 'printers']
+
+    name = models.CharField(max_length=255)
+    address = models.CharField(max_length=500, blank=True, default='')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    accepts = models.JSONField(default=list, blank=True)
+    website = models.URLField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    # Identity for imports (name + rounded location) and a hash of the
+    # imported fields, so re-imports only touch rows that changed
+    dedupe_key = models.CharField(max_length=32, blank=True, default='', editable=False, db_index=True)
+    content_hash = models.CharField(max_length=32, blank=True, default='', editable=False)
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def make_dedupe_key(name, latitude, longitude):
+        # Four decimal places is about 11 m, so re-geocoded copies still match
+        identity = f"{' '.join(name.split()).casefold()}|{latitude:.4f}|{longitude:.4f}"
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+
+    def save(self, *args, **kwargs):
+        self.dedupe_key = self.make_dedupe_key(self.name, self.latitude, self.longitude)
+        super().save(*args, **kwargs)
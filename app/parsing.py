@@ -0,0 +1,336 @@
+import re
+import threading
+import time
+
+NO_DEVICE = "No Device Detected"
+UNKNOWN_DEVICE = "Unknown Device"
+
+# A field or section header. Tolerates the drift seen in model output:
+# any case, "DEVICE CO2" for "DEVICE_CO2", markdown headings and bold
+# around the label ("## Reuse Ideas", "**Device:** Laptop").
+_HEADER = re.compile(
+    r'(?:#{1,6}\s*)?(?:\*\*|__)?\s*'
+    r'(device[ _-]?co2|device[ _-]?kwh|device|confidence|disposal|reuse[ _-]?ideas)'
+    r'\s*(?:\*\*|__)?\s*(?::|$)\s*(?:\*\*|__)?\s*',
+    re.IGNORECASE
+)
+# Only lines starting with one of these can be headers
+_HEADER_STARTS = frozenset('cCdDrR#*_')
+_FIELDS = {}
+for _separator in ('_', ' ', '-', ''):
+    _FIELDS[f'device{_separator}co2'] = 'device_co2'
+    _FIELDS[f'device{_separator}kwh'] = 'device_kwh'
+    _FIELDS[f'reuse{_separator}ideas'] = 'reuse'
+_FIELDS.update(device='device', confidence='confidence', disposal='disposal')
+_BULLETS = frozenset('-*•+‣◦▪–')
+_NUMBERED = re.compile(r'\d+[.)]\s+')
+# First number not glued to a word (so the 2 in "CO2" is skipped), with an
+# optional range such as "300-400" or "300 to 400"
+_NUMBER = re.compile(
+    r'(?<![\w.])(\d[\d,]*(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(\d[\d,]*(?:\.\d+)?))?'
+)
+# Confidence given in words rather than as a number
+_CONFIDENCE_WORDS = {'very high': 0.95, 'high': 0.9, 'medium': 0.6, 'moderate': 0.6, 'low': 0.3, 'very low': 0.1}
+_EMPHASIS = re.compile(r'\*+|__|`')
+_DEVICE_PREFIX = re.compile(
+    r'^(?:(?:this is|this appears to be|i can see|the image shows|this looks like|i identify this as)'
+    r'\s+(?:an?|the)\s+)+',
+    re.IGNORECASE
+)
+_DEVICE_TRIM = ' \t.:;,!"\'[]'
+
+
+def _plain(text):
+    # Markdown emphasis removed, skipping the regex for the common plain line
+    if '*' in text or '_' in text or '`' in text:
+        return _EMPHASIS.sub('', text)
+    return text
+
+
+def clean_device_name(device_name):
+    device_name = _DEVICE_PREFIX.sub('', _plain(device_name).strip(_DEVICE_TRIM))
+    # Remove parenthetical text
+    device_name = device_name.split('(', 1)[0].strip(_DEVICE_TRIM)
+    if device_name.lower().startswith('no device'):
+        return NO_DEVICE
+    return device_name[:1].upper() + device_name[1:]
+
+
+def parse_number(text):
+    """First number in ``text`` as an int; ranges give their midpoint, nothing gives 0."""
+    match = _NUMBER.search(text)
+    if match is None:
+        return 0
+    low = float(match.group(1).replace(',', ''))
+    high = float(match.group(2).replace(',', '')) if match.group(2) else low
+    return round((low + high) / 2)
+
+
+def parse_confidence(text):
+    """Confidence as a fraction from 0 to 1, or None if ``text`` gives none.
+
+    Numbers are percentages, as the triage prompt asks for 0 to 100, so
+    "1" is 1%; only a decimal below 1 such as "0.85" is read as a fraction.
+    Also accepts "85%" and the words high, medium and low.
+    """
+    match = _NUMBER.search(text)
+    if match is None:
+        words = ' '.join(_plain(text).lower().strip(_DEVICE_TRIM).split())
+        return _CONFIDENCE_WORDS.get(words)
+    number = match.group(1).replace(',', '')
+    value = float(number)
+    if '%' in text or '.' not in number or value >= 1:
+        value /= 100
+    return min(1.0, max(0.0, value))
+
+
+class _LineClassifier:
+    """The line-by-line state machine that both parsers share.
+
+    Only lines that could be headers are tried against the compiled header
+    pattern. Headers set a field or switch section; other lines belong to
+    the current section. Bullets of any style start a new item and unbulleted
+    lines continue the previous one, so an item is only emitted when the
+    next one starts (or at ``finish``). Items come out in the form the
+    pages render: "- text" for disposal, "N. text" for reuse ideas.
+    With ``per_device`` each DEVICE header closes the open section and
+    restarts item numbering, for responses listing several devices.
+    Events accumulate in ``events``.
+    """
+
+    def __init__(self, per_device=False):
+        self.events = []
+        self.per_device = per_device
+        self.section = None
+        self.awaiting = None  # header whose value is on the next line
+        self.item = None
+        self.counts = {'disposal': 0, 'reuse': 0}
+
+    def line(self, line):
+        line = line.strip()
+        if not line:
+            if self.item is not None:
+                self.flush()
+            return
+        first = line[0]
+        if first in _HEADER_STARTS:
+            match = _HEADER.match(line)
+            if match is not None:
+                self._header(_FIELDS[match.group(1).lower()], line[match.end():])
+                return
+
+        if self.awaiting is not None:
+            field, self.awaiting = self.awaiting, None
+            self._field(field, line)
+        elif self.section is not None:
+            if first in _BULLETS and line[1:2] in (' ', '\t'):
+                self._item(line[2:].lstrip(), True)
+            elif first.isdigit() and (match := _NUMBERED.match(line)) is not None:
+                self._item(line[match.end():], True)
+            else:
+                self._item(line, False)
+
+    def _header(self, field, value):
+        self.flush()
+        if field == 'device' and self.per_device:
+            self.section = None
+            self.counts = {'disposal': 0, 'reuse': 0}
+        if field in self.counts:
+            self.section = field
+            self.awaiting = None
+            if value:
+                self._item(value, True)
+        elif value:
+            self.awaiting = None
+            self._field(field, value)
+        else:
+            self.awaiting = field
+
+    def finish(self):
+        self.flush()
+
+    def flush(self):
+        if self.item is not None:
+            self.counts[self.section] += 1
+            if self.section == 'reuse':
+                self.events.append(('reuse', {'line': f'{self.counts["reuse"]}. {self.item}'}))
+            else:
+                self.events.append(('disposal', {'line': f'- {self.item}'}))
+            self.item = None
+
+    def _item(self, text, bullet):
+        text = _plain(text)
+        if '  ' in text or '\t' in text:
+            text = ' '.join(text.split())
+        if not text:
+            return
+        if not bullet and self.item is not None:
+            self.item = f'{self.item} {text}'
+        else:
+            self.flush()
+            self.item = text
+
+    def _field(self, field, value):
+        if field == 'device':
+            self.events.append(('device', {'class': clean_device_name(value)}))
+        elif field == 'confidence':
+            self.events.append(('confidence', {'confidence': parse_confidence(value)}))
+        else:
+            self.events.append((field, {field: parse_number(value)}))
+
+
+class ParseStats:
+    """Running count and timing of ``parse_response`` calls in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.parsed = 0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.parsed += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'parsed': self.parsed,
+                'mean_us': round(self.total_seconds / self.parsed * 1e6, 1) if self.parsed else 0.0,
+                'max_us': round(self.max_seconds * 1e6, 1),
+            }
+
+
+parse_stats = ParseStats()
+
+
+def _classify(full_response, per_device=False):
+    classifier = _LineClassifier(per_device)
+    for line in full_response.split('\n'):
+        classifier.line(line)
+    classifier.finish()
+    return classifier.events
+
+
+class _DeviceFields:
+    # One device's fields and section lines, gathered from classifier events
+
+    def __init__(self):
+        self.fields = {'class': UNKNOWN_DEVICE, 'device_co2': 0, 'device_kwh': 0, 'confidence': None}
+        self.lines = {'disposal': [], 'reuse': []}
+
+    def add(self, event, data):
+        if event in self.lines:
+            self.lines[event].append(data['line'])
+        else:
+            self.fields.update(data)
+
+    def payload(self, full_response=None):
+        fields = self.fields
+        if fields['class'] == NO_DEVICE:
+            payload = {'class': NO_DEVICE}
+        else:
+            payload = {'class': fields['class'] or UNKNOWN_DEVICE}
+            if full_response is not None:
+                payload['full_response'] = full_response
+            payload.update(
+                disposal_info='\n'.join(self.lines['disposal']),
+                reuse_ideas='\n'.join(self.lines['reuse']),
+                device_co2=fields['device_co2'],
+                device_kwh=fields['device_kwh']
+            )
+        if fields['confidence'] is not None:
+            payload['confidence'] = fields['confidence']
+        return payload
+
+
+def parse_response(full_response):
+    """Parse a complete model response into an identification payload.
+
+    ``confidence`` is only present when the response included one.
+    """
+    start = time.perf_counter()
+    device = _DeviceFields()
+    for event, data in _classify(full_response):
+        device.add(event, data)
+    payload = device.payload(full_response)
+    parse_stats.record(time.perf_counter() - start)
+    return payload
+
+
+def parse_devices(full_response):
+    """Parse a response listing several devices, one DEVICE section each.
+
+    Returns ``{'devices': [...], 'full_response': ...}``, each device a
+    payload like ``parse_response`` gives minus its own full response.
+    Text before the first DEVICE line and "No Device Detected" sections
+    are dropped, so a photo with nothing electronic gives no devices.
+    """
+    start = time.perf_counter()
+    devices = []
+    for event, data in _classify(full_response, per_device=True):
+        if event == 'device':
+            devices.append(_DeviceFields())
+        if devices:
+            devices[-1].add(event, data)
+    payload = {
+        'devices': [payload for payload in (device.payload() for device in devices) if payload['class'] != NO_DEVICE],
+        'full_response': full_response,
+    }
+    parse_stats.record(time.perf_counter() - start)
+    return payload
+
+
+def payload_events(payload):
+    # Replay a finished payload as the events StreamParser would have emitted
+    yield 'device', {'class': payload['class']}
+    if payload['class'] == NO_DEVICE:
+        return
+    yield 'device_co2', {'device_co2': payload.get('device_co2', 0)}
+    yield 'device_kwh', {'device_kwh': payload.get('device_kwh', 0)}
+    for line in payload.get('disposal_info', '').split('\n'):
+        if line:
+            yield 'disposal', {'line': line}
+    for line in payload.get('reuse_ideas', '').split('\n'):
+        if line:
+            yield 'reuse', {'line': line}
+
+
+class StreamParser:
+    """Incremental version of ``parse_response`` for streamed model output.
+
+    ``feed`` accepts text deltas of any size and returns the events made
+    available by the lines they complete: ``device``, ``device_co2`` and
+    ``device_kwh`` as soon as their line ends, then one ``disposal`` or
+    ``reuse`` event per item once the line after it shows the item is
+    complete. ``close`` flushes the final partial line.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pending = ''
+        self._classifier = _LineClassifier()
+
+    def feed(self, delta):
+        self.text += delta
+        self._pending += delta
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            self._classifier.line(line)
+        return self._take()
+
+    def close(self):
+        line, self._pending = self._pending, ''
+        self._classifier.line(line)
+        self._classifier.finish()
+        return self._take()
+
+    def _take(self):
+        events, self._classifier.events = self._classifier.events, []
+        return events
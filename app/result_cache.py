@@ -0,0 +1,218 @@
+import operator
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import reduce
+from itertools import combinations
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+from .imaging import hamming_distance
+from .models import IdentificationResult
+
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+PHASH_BAND_MASK = (1 << PHASH_BAND_BITS) - 1
+
+
+def phash_bands(phash):
+    return [(phash >> (PHASH_BAND_BITS * i)) & PHASH_BAND_MASK for i in range(PHASH_BANDS)]
+
+
+def band_neighbours(band, radius):
+    # Every band value within `radius` flipped bits of `band`
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(PHASH_BAND_BITS), flips):
+            values.append(band ^ reduce(operator.or_, (1 << bit for bit in bits)))
+    return values
+
+
+def to_signed64(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """Two-tier cache of parsed identification payloads keyed by content digest.
+
+    The first tier is a per-process LRU; the second is the
+    ``IdentificationResult`` table, shared by every worker and surviving
+    restarts. Both tiers honour ``IDENTIFY_CACHE_TTL``.
+    """
+
+    def __init__(self):
+        self.memory = LRUCache(settings.IDENTIFY_CACHE_MEMORY_ENTRIES, settings.IDENTIFY_CACHE_TTL)
+        self._stats_lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {
+                'memory_hits': 0, 'db_hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0
+            }
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _fresh_after(self):
+        return timezone.now() - timedelta(seconds=settings.IDENTIFY_CACHE_TTL)
+
+    def get(self, digest):
+        payload = self.memory.get(digest)
+        if payload is not None:
+            self._count('memory_hits')
+            return payload
+
+        row = self.peek(digest)
+        if row is None:
+            self._count('misses')
+            return None
+
+        self.memory.set(digest, row)
+        self._count('db_hits')
+        return row
+
+    def peek(self, digest):
+        # Persistent-tier lookup that leaves the hit/miss counters alone
+        return IdentificationResult.objects.filter(
+            digest=digest, created_at__gte=self._fresh_after()
+        ).values_list('payload', flat=True).first()
+
+    def get_similar(self, phash, version, max_distance=None, include_stale=False):
+        """Return the payload of the closest fresh result within ``max_distance`` bits of ``phash``.
+
+        Uses multi-index hashing: split into four 16-bit bands, any hash
+        within distance d of the query matches at least one band within
+        d // 4 bits, so only rows sharing a (near-)identical band are read.
+        A ``version`` of None accepts results from any version, and
+        ``include_stale`` results past their TTL.
+        """
+        if max_distance is None:
+            max_distance = settings.IDENTIFY_PHASH_MAX_DISTANCE
+        if max_distance < 0:
+            return None
+
+        radius = max_distance // PHASH_BANDS
+        band_filter = Q()
+        for i, band in enumerate(phash_bands(phash)):
+            band_filter |= Q(**{f'phash_band_{i}__in': band_neighbours(band, radius)})
+
+        candidates = IdentificationResult.objects.filter(band_filter)
+        if version is not None:
+            candidates = candidates.filter(version=version)
+        if not include_stale:
+            candidates = candidates.filter(created_at__gte=self._fresh_after())
+        candidates = candidates.values_list('phash', 'payload')
+
+        best = None
+        for candidate_hash, payload in candidates.iterator():
+            distance = hamming_distance(phash, from_signed64(candidate_hash))
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, payload)
+                if distance == 0:
+                    break
+
+        if best is None:
+            return None
+        self._count('near_hits')
+        return best[1]
+
+    def set(self, digest, payload, version='', phash=None):
+        self.memory.set(digest, payload)
+        defaults = {'payload': payload, 'version': version, 'created_at': timezone.now()}
+        if phash is not None:
+            defaults['phash'] = to_signed64(phash)
+            for i, band in enumerate(phash_bands(phash)):
+                defaults[f'phash_band_{i}'] = band
+        try:
+            IdentificationResult.objects.update_or_create(digest=digest, defaults=defaults)
+        except DatabaseError:
+            # The persistent tier is best-effort; the in-process tier still serves this worker
+            return
+        self._count('stores')
+
+        with self._stats_lock:
+            self._writes_since_prune += 1
+            due = self._writes_since_prune >= settings.IDENTIFY_CACHE_PRUNE_EVERY
+            if due:
+                self._writes_since_prune = 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows, then the oldest rows beyond ``IDENTIFY_CACHE_DB_MAX_ENTRIES``."""
+        removed, _ = IdentificationResult.objects.filter(created_at__lt=self._fresh_after()).delete()
+
+        max_entries = settings.IDENTIFY_CACHE_DB_MAX_ENTRIES
+        cutoff = list(
+            IdentificationResult.objects.order_by('-created_at')
+            .values_list('created_at', flat=True)[max_entries:max_entries + 1]
+        )
+        if cutoff:
+            overflow, _ = IdentificationResult.objects.filter(created_at__lte=cutoff[0]).delete()
+            removed += overflow
+
+        self._count('evictions', removed)
+        return removed
+
+    def clear(self):
+        self.memory.clear()
+        IdentificationResult.objects.all().delete()
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        hits = stats['memory_hits'] + stats['db_hits'] + stats['near_hits']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        return stats
+
+
+result_cache = ResultCache()
@@ -0,0 +1,162 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .community import invalidate_community
+from .models import CommunityTotals, DeviceTracker, GlobalDailySavings, UserDailySavings, UserMonthlySavings
+
+GRANULARITIES = ('day', 'week', 'month')
+# Shortest length of each bucket, for bounding the size of a requested range
+MIN_BUCKET_DAYS = {'day': 1, 'week': 7, 'month': 28}
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _add_to_rollup(model, key, devices, co2, kwh):
+    increments = {'devices': F('devices') + devices, 'co2': F('co2') + co2, 'kwh': F('kwh') + kwh}
+    if model.objects.filter(**key).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(devices=devices, co2=co2, kwh=kwh, **key)
+    except IntegrityError:
+        # Another request opened the bucket first
+        model.objects.filter(**key).update(**increments)
+
+
+def community_shard(user_id):
+    return user_id % settings.COMMUNITY_TOTALS_SHARDS
+
+
+def add_to_rollups(user, when, devices, co2, kwh):
+    """Add savings recorded at ``when`` to the user's, global and community buckets.
+
+    Must run inside the transaction that writes the DeviceTracker rows.
+    Buckets are always touched in the same order so concurrent writers
+    cannot deadlock on them. Community totals go to the user's shard.
+    """
+    day = timezone.localdate(when)
+    _add_to_rollup(UserDailySavings, {'user': user, 'period': day}, devices, co2, kwh)
+    _add_to_rollup(UserMonthlySavings, {'user': user, 'period': month_start(day)}, devices, co2, kwh)
+    _add_to_rollup(GlobalDailySavings, {'period': day}, devices, co2, kwh)
+    _add_to_rollup(CommunityTotals, {'shard': community_shard(user.pk)}, devices, co2, kwh)
+
+
+def rebuild_rollups(batch_size=500, progress=None):
+    """Recompute the rollup tables and community totals from DeviceTracker rows.
+
+    Users are processed in batches of ``batch_size``; each batch is one
+    grouped query, so memory stays bounded by the batch rather than the
+    history. ``progress`` is called with the number of users done so far.
+    Returns the number of rows written to each table.
+    """
+    global_daily, community = {}, {}
+    counts = {'user_daily': 0, 'user_monthly': 0, 'global_daily': 0}
+    users_done = 0
+    last_user = 0
+
+    with transaction.atomic():
+        for model in (UserDailySavings, UserMonthlySavings, GlobalDailySavings, CommunityTotals):
+            model.objects.all().delete()
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_user).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_user = user_ids[-1]
+
+            buckets = (
+                DeviceTracker.objects.filter(user_id__in=user_ids)
+                .annotate(period=TruncDate('created_at'))
+                .values('user_id', 'period')
+                .annotate(devices=Count('id'), co2=Sum('device_co2'), kwh=Sum('device_kwh'))
+                .order_by()
+            )
+            daily, monthly = [], {}
+            for bucket in buckets:
+                totals = (bucket['devices'], bucket['co2'], bucket['kwh'])
+                daily.append(UserDailySavings(user_id=bucket['user_id'], period=bucket['period'],
+                                              devices=totals[0], co2=totals[1], kwh=totals[2]))
+                for rollup, key in ((monthly, (bucket['user_id'], month_start(bucket['period']))),
+                                    (global_daily, bucket['period']),
+                                    (community, community_shard(bucket['user_id']))):
+                    rollup[key] = [a + b for a, b in zip(rollup.get(key, (0, 0, 0)), totals)]
+
+            UserDailySavings.objects.bulk_create(daily, batch_size=batch_size)
+            UserMonthlySavings.objects.bulk_create([
+                UserMonthlySavings(user_id=user_id, period=period, devices=devices, co2=co2, kwh=kwh)
+                for (user_id, period), (devices, co2, kwh) in monthly.items()
+            ], batch_size=batch_size)
+            counts['user_daily'] += len(daily)
+            counts['user_monthly'] += len(monthly)
+
+            users_done += len(user_ids)
+            if progress is not None:
+                progress(users_done)
+
+        GlobalDailySavings.objects.bulk_create([
+            GlobalDailySavings(period=period, devices=devices, co2=co2, kwh=kwh)
+            for period, (devices, co2, kwh) in sorted(global_daily.items())
+        ], batch_size=batch_size)
+        counts['global_daily'] = len(global_daily)
+        CommunityTotals.objects.bulk_create([
+            CommunityTotals(shard=shard, devices=devices, co2=co2, kwh=kwh)
+            for shard, (devices, co2, kwh) in sorted(community.items())
+        ])
+        transaction.on_commit(invalidate_community)
+    return counts
+
+
+def savings_series(user, granularity, start, end):
+    """Savings per bucket for the buckets overlapping ``start``..``end``.
+
+    ``user`` of None gives the site-wide series. Every bucket is present
+    and covers its whole day, week or month, zero-filled where nothing was
+    recorded. Reads only rollup rows, so the cost depends on the number of
+    buckets, not on how many devices were tracked.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    if (end - start).days // MIN_BUCKET_DAYS[granularity] >= settings.TRACKER_SERIES_MAX_BUCKETS:
+        raise ValueError(f"range spans more than {settings.TRACKER_SERIES_MAX_BUCKETS} buckets")
+
+    if granularity == 'month' and user is not None:
+        rows = UserMonthlySavings.objects.filter(user=user)
+    elif user is not None:
+        rows = UserDailySavings.objects.filter(user=user)
+    else:
+        rows = GlobalDailySavings.objects.all()
+
+    bucket_of = {'day': lambda day: day, 'week': week_start, 'month': month_start}[granularity]
+    step = {'day': lambda day: day + timedelta(days=1),
+            'week': lambda day: day + timedelta(weeks=1),
+            'month': lambda day: (day + timedelta(days=32)).replace(day=1)}[granularity]
+
+    periods = []
+    period = bucket_of(start)
+    while period <= end:
+        periods.append(period)
+        period = step(period)
+
+    series = {period: {'devices': 0, 'co2': 0, 'kwh': 0} for period in periods}
+    # Weekly and site-wide monthly buckets are summed from at most 31 daily rows each
+    rows = rows.filter(period__gte=periods[0], period__lt=step(periods[-1]))
+    for row in rows.values('period', 'devices', 'co2', 'kwh'):
+        bucket = series[bucket_of(row['period'])]
+        for field in ('devices', 'co2', 'kwh'):
+            bucket[field] += row[field]
+
+    return [{'period': period.isoformat(), **totals} for period, totals in series.items()]
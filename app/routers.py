@@ -0,0 +1,68 @@
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA = 'replica'
+ROUTED_DB_ALIASES = frozenset((DEFAULT_DB_ALIAS, REPLICA))
+
+# Set while a read_from_replica view runs; copied into sync_to_async threads
+_replica_reads = contextvars.ContextVar('greenbyte_replica_reads', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_from_replica(primary_if=None):
+    """Serve a read-only view's queries on this app's models from the replica.
+
+    ``primary_if(request)`` returning True keeps that request on the primary,
+    e.g. right after the user wrote something the replica may not have yet.
+    Does nothing when no replica is configured.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if primary_if is not None and primary_if(request):
+                return view(request, *args, **kwargs)
+            with replica_reads():
+                return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+class ReplicaRouter:
+    """Primary for writes and migrations; the replica only for marked reads.
+
+    Auth, session and other framework tables always stay on the primary, so
+    a login is never missed because it has not replicated yet.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and model._meta.app_label == 'app' and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or Django would write an instance back to the replica it was read from
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        if obj1._state.db in ROUTED_DB_ALIASES and obj2._state.db in ROUTED_DB_ALIASES:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db == REPLICA else None
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within a process only
+    fcntl = None
+
+# Seconds between cache re-checks while another process holds a key's lock
+LOCK_POLL_INTERVAL = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    @property
+    def abandoned(self):
+        # Ended without a result or an error to share, e.g. its client went away
+        return self.result is None and not isinstance(self.error, Exception)
+
+
+class Claim:
+    """What ``flight`` yields: a result ``shared`` by another caller, or the leader's to fill in."""
+
+    def __init__(self, result=None, shared=False):
+        self.result = result
+        self.shared = shared
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    Within a process, the first caller for a key runs the function and
+    every concurrent caller waits for and shares its result (or
+    exception). Across processes, the leader also holds an advisory file
+    lock for the key; callers that find it locked poll the shared cache
+    through ``recheck`` and only do the work themselves if the lock comes
+    free without a result, or they give up waiting.
+
+    ``do`` and ``ado`` run a function; ``flight`` and ``aflight`` let the
+    caller do the work itself, e.g. while streaming it to a client.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'executed': 0, 'coalesced': 0, 'deduplicated_across_processes': 0, 'lock_timeouts': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def do(self, key, fn, recheck=None):
+        with self.flight(key, recheck) as claim:
+            if not claim.shared:
+                claim.result = fn()
+        return claim.result
+
+    async def ado(self, key, fn, recheck=None):
+        # ``do`` for a coroutine function ``fn`` and an async ``recheck``
+        async with self.aflight(key, recheck) as claim:
+            if not claim.shared:
+                claim.result = await fn()
+        return claim.result
+
+    def _join(self, key):
+        # The key's call in this process, and whether the caller leads it
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+        self._count('coalesced')
+        return call, False
+
+    def _land(self, key, call, claim, error):
+        # Hand the leader's outcome to everyone waiting on the key
+        call.result, call.error = claim.result, error
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    @contextmanager
+    def flight(self, key, recheck=None):
+        """Yield a ``Claim`` for ``key``; unless it is ``shared``, set its ``result`` before leaving.
+
+        Waiters raise the leader's exception, but take over from a leader
+        that was abandoned without a result.
+        """
+        call, leader = self._join(key)
+        while not leader:
+            call.done.wait()
+            if not call.abandoned:
+                if call.error is not None:
+                    raise call.error
+                yield Claim(call.result, shared=True)
+                return
+            call, leader = self._join(key)
+
+        claim = Claim()
+        try:
+            with self._process_lock(key, recheck) as cached:
+                if cached is not None:
+                    self._count('deduplicated_across_processes')
+                    claim = Claim(cached, shared=True)
+                yield claim
+                if not claim.shared:
+                    self._count('executed')
+        except BaseException as error:
+            self._land(key, call, claim, error)
+            raise
+        self._land(key, call, claim, None)
+
+    @asynccontextmanager
+    async def aflight(self, key, recheck=None):
+        # ``flight`` for the event loop: waiting sleeps instead of holding a thread
+        call, leader = self._join(key)
+        while not leader:
+            while not call.done.is_set():
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+            if not call.abandoned:
+                if call.error is not None:
+                    raise call.error
+                yield Claim(call.result, shared=True)
+                return
+            call, leader = self._join(key)
+
+        claim = Claim()
+        try:
+            async with self._aprocess_lock(key, recheck) as cached:
+                if cached is not None:
+                    self._count('deduplicated_across_processes')
+                    claim = Claim(cached, shared=True)
+                yield claim
+                if not claim.shared:
+                    self._count('executed')
+        except BaseException as error:
+            self._land(key, call, claim, error)
+            raise
+        self._land(key, call, claim, None)
+
+    @staticmethod
+    def _try_lock(path):
+        # The open, exclusively locked file at ``path``, or None while another process holds it
+        while True:
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+            # The previous holder unlinks the file before releasing it; a lock
+            # on that orphan would not exclude whoever creates the next one
+            try:
+                if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    @staticmethod
+    def _lock_path(key):
+        # The key's lock file, or None when locking across processes is off
+        lock_dir = settings.IDENTIFY_SINGLEFLIGHT_LOCK_DIR
+        if fcntl is None or not lock_dir:
+            return None
+        os.makedirs(lock_dir, exist_ok=True)
+        return os.path.join(lock_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.lock')
+
+    @staticmethod
+    def _unlock(path, lock_file):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+    @contextmanager
+    def _process_lock(self, key, recheck):
+        """Hold the key's lock file across processes; yields a result found by ``recheck``, or None.
+
+        Each key has its own file, removed when released, so unrelated
+        images never wait on each other. A waiter polls ``recheck`` until
+        the holder's result appears, and after ``IDENTIFY_SINGLEFLIGHT_LOCK_WAIT``
+        seconds goes ahead unlocked rather than queueing behind a hung call.
+        """
+        path = self._lock_path(key)
+        if path is None:
+            yield recheck() if recheck is not None else None
+            return
+
+        deadline = time.monotonic() + settings.IDENTIFY_SINGLEFLIGHT_LOCK_WAIT
+        lock_file = self._try_lock(path)
+        while lock_file is None:
+            cached = recheck() if recheck is not None else None
+            if cached is not None:
+                yield cached
+                return
+            if time.monotonic() >= deadline:
+                self._count('lock_timeouts')
+                yield None
+                return
+            time.sleep(LOCK_POLL_INTERVAL)
+            lock_file = self._try_lock(path)
+
+        try:
+            yield recheck() if recheck is not None else None
+        finally:
+            self._unlock(path, lock_file)
+
+    @asynccontextmanager
+    async def _aprocess_lock(self, key, recheck):
+        # ``_process_lock`` with an async ``recheck``; taking the lock never blocks
+        path = self._lock_path(key)
+        if path is None:
+            yield await recheck() if recheck is not None else None
+            return
+
+        deadline = time.monotonic() + settings.IDENTIFY_SINGLEFLIGHT_LOCK_WAIT
+        lock_file = self._try_lock(path)
+        while lock_file is None:
+            cached = await recheck() if recheck is not None else None
+            if cached is not None:
+                yield cached
+                return
+            if time.monotonic() >= deadline:
+                self._count('lock_timeouts')
+                yield None
+                return
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            lock_file = self._try_lock(path)
+
+        try:
+            yield await recheck() if recheck is not None else None
+        finally:
+            self._unlock(path, lock_file)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls)
+        stats['calls_saved'] = stats['coalesced'] + stats['deduplicated_across_processes']
+        return stats
+
+
+single_flight = SingleFlight()
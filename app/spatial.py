@@ -0,0 +1,270 @@
+import heapq
+import logging
+import threading
+import time
+from math import asin, cos, radians, sin, sqrt
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import EwasteCenter
+from .versions import bump_version, data_version
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+# Ranges this small are scanned rather than split further
+LEAF_SIZE = 8
+VERSION_NAME = 'centers'
+
+
+def to_unit_vector(lat, lon):
+    # Points on the unit sphere: straight-line (chord) distance orders
+    # exactly like great-circle distance, so the tree can stay Euclidean
+    phi, lam = radians(lat), radians(lon)
+    return (cos(phi) * cos(lam), cos(phi) * sin(lam), sin(phi))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+class KDTree:
+    """Static 3-d tree stored implicitly in flat lists.
+
+    The node for the half-open range ``lo..hi`` sits at its midpoint, so
+    no child pointers are needed; ranges of up to LEAF_SIZE items are
+    leaves that queries scan. Each node also records the OR of the
+    category bitmasks beneath it, letting filtered queries skip whole
+    subtrees that contain nothing acceptable.
+    """
+
+    def __init__(self, points, masks):
+        # points: (x, y, z) per item; masks: category bitmask per item
+        order = list(range(len(points)))
+        columns = [[point[axis] for point in points] for axis in range(3)]
+        self.axes = [0] * len(order)
+        stack = [(0, len(order))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            # Split on the axis with the widest spread
+            members = order[lo:hi]
+            spreads = []
+            for column in columns:
+                values = list(map(column.__getitem__, members))
+                spreads.append(max(values) - min(values))
+            axis = spreads.index(max(spreads))
+            members.sort(key=columns[axis].__getitem__)
+            order[lo:hi] = members
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+        self.items = order
+        self.points = [points[i] for i in order]
+        self.masks = [masks[i] for i in order]
+        self.subtree_masks = list(self.masks)
+        self._fill_subtree_masks(0, len(order))
+
+    def _fill_subtree_masks(self, lo, hi):
+        # Post-order without recursion: children's masks are final before the parent's
+        stack = [(lo, hi, False)]
+        while stack:
+            lo, hi, children_done = stack.pop()
+            if hi <= lo:
+                continue
+            mid = (lo + hi) // 2
+            if hi - lo <= LEAF_SIZE:
+                mask = 0
+                for item_mask in self.masks[lo:hi]:
+                    mask |= item_mask
+                self.subtree_masks[mid] = mask
+            elif children_done:
+                mask = self.masks[mid]
+                if lo < mid:
+                    mask |= self.subtree_masks[(lo + mid) // 2]
+                if mid + 1 < hi:
+                    mask |= self.subtree_masks[(mid + 1 + hi) // 2]
+                self.subtree_masks[mid] = mask
+            else:
+                stack.append((lo, hi, True))
+                stack.append((lo, mid, False))
+                stack.append((mid + 1, hi, False))
+
+    def __len__(self):
+        return len(self.items)
+
+    def nearest(self, point, k, mask=0):
+        """The ``k`` items closest to ``point`` as ``(squared_chord, item)``, nearest first.
+
+        With a nonzero ``mask`` only items sharing a bit with it count.
+        """
+        if k <= 0 or not self.items:
+            return []
+        qx, qy, qz = query = point
+        points, axes, masks, subtree_masks, items = self.points, self.axes, self.masks, self.subtree_masks, self.items
+        best = []  # max-heap of (-squared distance, item)
+        stack = [(0, len(items), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            mid = (lo + hi) // 2
+            if mask and not subtree_masks[mid] & mask:
+                continue
+
+            if hi - lo <= LEAF_SIZE:
+                for i in range(lo, hi):
+                    if mask and not masks[i] & mask:
+                        continue
+                    px, py, pz = points[i]
+                    d2 = (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+                    if len(best) < k:
+                        heapq.heappush(best, (-d2, items[i]))
+                    elif d2 < -best[0][0]:
+                        heapq.heapreplace(best, (-d2, items[i]))
+                continue
+
+            px, py, pz = points[mid]
+            if not mask or masks[mid] & mask:
+                d2 = (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, items[mid]))
+                elif d2 < -best[0][0]:
+                    heapq.heapreplace(best, (-d2, items[mid]))
+
+            diff = query[axes[mid]] - points[mid][axes[mid]]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # Far side first so the near side is searched next
+            if far[0] < far[1]:
+                stack.append((far[0], far[1], max(bound, diff * diff)))
+            if near[0] < near[1]:
+                stack.append((near[0], near[1], bound))
+        return sorted((-negative, item) for negative, item in best)
+
+
+class CenterIndex:
+    """All e-waste centers in memory, searchable by distance and category."""
+
+    FIELDS = ('id', 'name', 'address', 'latitude', 'longitude', 'accepts', 'website')
+
+    def __init__(self, centers):
+        # centers: tuples in FIELDS order
+        self.centers = list(centers)
+        self.category_bits = {}
+        masks = []
+        for center in self.centers:
+            mask = 0
+            for category in center[5] or ():
+                bit = self.category_bits.setdefault(category.lower(), 1 << len(self.category_bits))
+                mask |= bit
+            masks.append(mask)
+        self.tree = KDTree([to_unit_vector(center[3], center[4]) for center in self.centers], masks)
+
+    @classmethod
+    def from_database(cls):
+        rows = EwasteCenter.objects.values_list(*cls.FIELDS).order_by('id').iterator(chunk_size=5000)
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def nearest(self, lat, lon, k, accepts=None):
+        """The ``k`` nearest centers to ``lat``/``lon``, optionally only those taking ``accepts``."""
+        mask = 0
+        if accepts:
+            mask = self.category_bits.get(accepts.lower())
+            if mask is None:
+                return []
+        results = []
+        for _, item in self.tree.nearest(to_unit_vector(lat, lon), k, mask):
+            center = dict(zip(self.FIELDS, self.centers[item]))
+            center['distance_km'] = round(haversine_km(lat, lon, center['latitude'], center['longitude']), 3)
+            results.append(center)
+        return results
+
+
+def centers_version():
+    return data_version(VERSION_NAME)
+
+
+def invalidate_centers():
+    # Call inside the transaction that changes the centers
+    bump_version(VERSION_NAME)
+
+
+class LiveCenterIndex:
+    """The current ``CenterIndex``, rebuilt when the centers change.
+
+    Changes bump a version row in the database, which every process
+    checks on each lookup. Server processes start building the index in
+    the background as they load (see ``warm``), so requests only wait if
+    they arrive before it is ready. After that, stale indexes keep serving
+    while a background thread rebuilds, unless background refresh is
+    turned off.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._version = None
+        self._build_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        version = centers_version()
+        if self._index is not None and self._version == version:
+            return self._index
+        if self._index is None or not settings.FINDER_INDEX_BACKGROUND_REFRESH:
+            return self.refresh()
+        with self._lock:
+            start = not self._refreshing
+            self._refreshing = True
+        if start:
+            threading.Thread(target=self._refresh_in_background, name='center-index-refresh', daemon=True).start()
+        return self._index
+
+    def warm(self):
+        # Start the first build without waiting for a request to need it
+        if not settings.FINDER_INDEX_PRELOAD:
+            return
+        with self._lock:
+            start = not self._refreshing
+            self._refreshing = True
+        if start:
+            threading.Thread(target=self._refresh_in_background, name='center-index-warm', daemon=True).start()
+
+    def refresh(self):
+        with self._build_lock:
+            version = centers_version()
+            if self._index is None or self._version != version:
+                start = time.perf_counter()
+                self._index = CenterIndex.from_database()
+                self._version = version
+                logger.info("Loaded %d e-waste centers into the spatial index in %.2fs",
+                            len(self._index), time.perf_counter() - start)
+            return self._index
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Spatial index refresh failed")
+        finally:
+            with self._lock:
+                self._refreshing = False
+            connection.close()
+
+
+live_index = LiveCenterIndex()
+
+
+@receiver([post_save, post_delete], sender=EwasteCenter)
+def _center_changed(sender, **kwargs):
+    invalidate_centers()
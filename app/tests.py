@@ -1,3 +1,2116 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+from datetime import date, timedelta
+from importlib import import_module
+from types import SimpleNamespace
+from unittest import mock
+from PIL import Image
+import anthropic
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .imaging import hamming_distance, normalization_stats, normalize_image, perceptual_hash
+from .models import (
+    CommunityTotals, DeviceCatalog, DeviceTracker, EwasteCenter, GlobalDailySavings, IdentificationJob, IdentificationResult, UserDailySavings,
+    UserMonthlySavings, UserTracker
+)
+from . import jobs, metrics
+from .identify import IDENTIFY_PROMPT, aidentify_image
+from .singleflight import SingleFlight, single_flight
+from .tracking import device_history, record_devices, tracker_recently_written
+from .routers import ReplicaRouter, read_from_replica, replica_reads
+from .parsing import StreamParser, parse_confidence, parse_devices, parse_response, payload_events
+from .breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, claude_breaker
+from .cascade import cascade_stats
+from .result_cache import result_cache
+from .rollups import rebuild_rollups, savings_series
+from .community import community_snapshot
+from .spatial import CenterIndex, LiveCenterIndex, centers_version, haversine_km, live_index
+from .importers import read_geojson
+from .management.commands._fake_claude import FakeMessagesAPI
+from .catalog import CatalogMatcher, catalog_events, catalog_version, seed_from_history
 
-# Create your tests here.
+SAMPLE_RESPONSE = """DEVICE: Laptop
+DEVICE_CO2: 300 kg
+DEVICE_KWH: 50
+
+DISPOSAL:
+- Take it to a certified e-waste recycler
+- Use the manufacturer's take-back program
+
+REUSE IDEAS:
+1. Home media server
+2. Digital photo frame
+"""
+
+
+# The single-model path, for tests that count API calls
+single_model = override_settings(IDENTIFY_TRIAGE_MODEL='')
+
+
+def fake_message(text=SAMPLE_RESPONSE):
+    return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+
+def encoded_image(seed, size=224, noise=0, fmt='PNG'):
+    # A deterministic blocky scene; `noise` jitters the tone curve and adds a stray pixel
+    rng = random.Random(seed)
+    image = Image.new('RGB', (8, 8))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64)])
+    image = image.resize((size, size), Image.Resampling.BILINEAR)
+    if noise:
+        jitter = random.Random(noise)
+        image = Image.eval(image, lambda v: max(0, min(255, v + jitter.randint(-3, 3))))
+        image.putpixel((0, 0), (jitter.randrange(256), 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def upload(data=b'fake-image-bytes', name='capture.png', content_type='image/png'):
+    return SimpleUploadedFile(name, data, content_type=content_type)
+
+
+@single_model
+class IdentifyCacheTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        result_cache.reset_stats()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.client_mock.messages.create.return_value = fake_message()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, data=b'fake-image-bytes'):
+        return self.client.post(reverse('identify_predict'), {'image': upload(data)}).json()
+
+    def test_repeat_upload_is_served_from_cache(self):
+        first = self.predict()
+        second = self.predict()
+
+        self.assertEqual(first, second)
+        self.assertEqual(first['class'], 'Laptop')
+        self.assertEqual(first['device_co2'], 300)
+        self.assertEqual(self.client_mock.messages.create.call_count, 1)
+        stats = result_cache.snapshot()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['memory_hits'], 1)
+
+    def test_persistent_tier_survives_memory_eviction(self):
+        self.predict()
+        result_cache.memory.clear()
+        self.predict()
+
+        self.assertEqual(self.client_mock.messages.create.call_count, 1)
+        self.assertEqual(result_cache.snapshot()['db_hits'], 1)
+
+    def test_different_bytes_miss(self):
+        self.predict(b'one')
+        self.predict(b'two')
+        self.assertEqual(self.client_mock.messages.create.call_count, 2)
+
+    @override_settings(IDENTIFY_CACHE_TTL=0)
+    def test_expired_rows_are_not_served(self):
+        self.predict()
+        result_cache.memory.clear()
+        self.predict()
+        self.assertEqual(self.client_mock.messages.create.call_count, 2)
+
+    @override_settings(IDENTIFY_CACHE_DB_MAX_ENTRIES=2)
+    def test_prune_bounds_table_size(self):
+        for i in range(5):
+            result_cache.set(f'digest-{i}', {'class': 'Laptop'})
+        result_cache.prune()
+
+        remaining = set(IdentificationResult.objects.values_list('digest', flat=True))
+        self.assertEqual(remaining, {'digest-3', 'digest-4'})
+
+
+@single_model
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        result_cache.reset_stats()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.client_mock.messages.create.return_value = fake_message()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, data):
+        return self.client.post(reverse('identify_predict'), {'image': upload(data)}).json()
+
+    def test_recapture_is_served_without_api_call(self):
+        first = encoded_image(seed=1)
+        recapture = encoded_image(seed=1, noise=7)
+        self.assertNotEqual(first, recapture)
+        self.assertLessEqual(hamming_distance(perceptual_hash(first), perceptual_hash(recapture)), 6)
+
+        self.predict(first)
+        self.assertEqual(self.predict(recapture)['class'], 'Laptop')
+        self.assertEqual(self.client_mock.messages.create.call_count, 1)
+        self.assertEqual(result_cache.snapshot()['near_hits'], 1)
+
+    def test_different_scene_calls_api(self):
+        self.predict(encoded_image(seed=1))
+        self.predict(encoded_image(seed=2))
+        self.assertEqual(self.client_mock.messages.create.call_count, 2)
+
+    @override_settings(IDENTIFY_PHASH_MAX_DISTANCE=-1)
+    def test_near_duplicates_can_be_disabled(self):
+        self.predict(encoded_image(seed=1))
+        self.predict(encoded_image(seed=1, noise=7))
+        self.assertEqual(self.client_mock.messages.create.call_count, 2)
+
+    def test_band_index_finds_every_hash_within_distance(self):
+        rng = random.Random(0)
+        base = rng.getrandbits(64)
+        result_cache.set('base', {'class': 'Router'}, version='v', phash=base)
+        for distance in range(0, 12):
+            query = base
+            for bit in rng.sample(range(64), distance):
+                query ^= 1 << bit
+            found = result_cache.get_similar(query, 'v', max_distance=11)
+            self.assertEqual(found, {'class': 'Router'}, distance)
+        self.assertIsNone(result_cache.get_similar(base, 'other-version', max_distance=11))
+
+    def test_undecodable_upload_has_no_hash(self):
+        self.assertIsNone(perceptual_hash(b'not an image'))
+
+
+class NormalizeImageTests(TestCase):
+    def photo(self, size=(4000, 3000), orientation=None):
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (30, 120, 60)).save(buffer, 'JPEG', quality=95, exif=exif.tobytes())
+        return buffer.getvalue()
+
+    @override_settings(IMAGE_MAX_EDGE=1024, IMAGE_FORMAT='JPEG')
+    def test_large_photo_is_downscaled_rotated_and_stripped(self):
+        normalized = normalize_image(self.photo(orientation=6), 'image/jpeg')
+
+        self.assertEqual((normalized.width, normalized.height), (768, 1024))
+        self.assertEqual(normalized.media_type, 'image/jpeg')
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            self.assertEqual(image.size, (768, 1024))
+            self.assertEqual(len(image.getexif()), 0)
+
+    @override_settings(IMAGE_FORMAT='WEBP')
+    def test_webp_output(self):
+        normalized = normalize_image(self.photo(), 'image/jpeg')
+        self.assertEqual(normalized.media_type, 'image/webp')
+        self.assertLess(len(normalized.data), normalized.original_bytes)
+
+    def test_small_supported_upload_is_kept(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (16, 16), (30, 120, 60)).save(buffer, 'PNG')
+        data = buffer.getvalue()
+        normalized = normalize_image(data, 'image/png')
+        self.assertEqual(normalized.data, data)
+        self.assertEqual(normalized.media_type, 'image/png')
+
+    def test_small_upload_with_metadata_is_reencoded(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'SecretCam'
+        exif[0x8825] = {1: 'N', 2: (37.0, 46.0, 30.0)}
+        # Noise at low quality: smaller than its own re-encode, so only the metadata forces one
+        rng = random.Random(1)
+        image = Image.new('RGB', (64, 64))
+        image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64 * 64)])
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=30, exif=exif.tobytes())
+        data = buffer.getvalue()
+
+        normalized = normalize_image(data, 'image/jpeg')
+        self.assertNotIn(b'SecretCam', normalized.data)
+        with Image.open(io.BytesIO(normalized.data)) as image:
+            self.assertEqual(len(image.getexif()), 0)
+
+    def test_undecodable_upload_is_passed_through(self):
+        normalized = normalize_image(b'not an image', 'image/png')
+        self.assertEqual(normalized.data, b'not an image')
+
+    @override_settings(IMAGE_MAX_EDGE=1024, IMAGE_FORMAT='JPEG')
+    def test_savings_are_reported_in_cache_stats(self):
+        normalization_stats.reset()
+        photo = self.photo()
+        normalized = normalize_image(photo, 'image/jpeg')
+        normalize_image(b'not an image', 'image/png')
+
+        self.client.force_login(User.objects.create_user('ops', password='pw', is_staff=True))
+        stats = self.client.get(reverse('identify_cache_stats')).json()['normalization']
+        self.assertEqual(stats, {
+            'images': 1, 'bytes_in': len(photo), 'bytes_out': len(normalized.data),
+            'bytes_saved': len(photo) - len(normalized.data),
+        })
+
+    @override_settings(IMAGE_MAX_EDGE=1024, IMAGE_FORMAT='WEBP', IMAGE_QUALITY=80, CAPTURE_MAX_BYTES=500000)
+    def test_identify_page_encodes_captures_like_the_server(self):
+        response = self.client.get(reverse('identify'))
+        self.assertEqual(response.context['capture'], {
+            'maxEdge': 1024, 'type': 'image/webp', 'quality': 0.8, 'maxBytes': 500000,
+            'acceptedTypes': ['image/gif', 'image/jpeg', 'image/png', 'image/webp'],
+        })
+        self.assertContains(response, 'id="capture-config"')
+        self.assertNotContains(response, "toDataURL('image/png')")
+
+
+@single_model
+class AsyncIdentifyTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        result_cache.reset_stats()
+        self.async_client_mock = mock.MagicMock()
+        self.async_client_mock.messages.create = mock.AsyncMock(return_value=fake_message())
+        patcher = mock.patch('app.identify.get_async_client', return_value=self.async_client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_async_predict_uses_async_client_and_cache(self):
+        client = AsyncClient()
+        url = reverse('identify_predict_async')
+        first = (await client.post(url, {'image': upload(encoded_image(seed=4))})).json()
+        second = (await client.post(url, {'image': upload(encoded_image(seed=4))})).json()
+
+        self.assertEqual(first['class'], 'Laptop')
+        self.assertEqual(first, second)
+        self.assertEqual(self.async_client_mock.messages.create.await_count, 1)
+
+    async def test_async_predict_rejects_missing_image(self):
+        response = await AsyncClient().post(reverse('identify_predict_async'))
+        self.assertEqual(response.status_code, 400)
+
+
+@single_model
+class StreamingIdentifyTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        chunks = [SAMPLE_RESPONSE[i:i + 7] for i in range(0, len(SAMPLE_RESPONSE), 7)]
+        stream = mock.MagicMock()
+        stream.__enter__.return_value.text_stream = iter(chunks)
+        self.client_mock.messages.stream.return_value = stream
+
+    def events(self, response):
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for frame in body.strip().split('\n\n'):
+            event_line, data_line = frame.split('\n')
+            events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+        return events
+
+    def test_parser_emits_header_fields_before_body(self):
+        parser = StreamParser()
+        self.assertEqual(parser.feed('DEVICE: This is a Lap'), [])
+        self.assertEqual(parser.feed('top (15")\nDEVICE_CO2: 3'), [('device', {'class': 'Laptop'})])
+        self.assertEqual(parser.feed('00 kg\n'), [('device_co2', {'device_co2': 300})])
+        parser.feed('DISPOSAL:\n- Recycle it')
+        self.assertEqual(parser.close(), [('disposal', {'line': '- Recycle it'})])
+
+    def test_stream_endpoint_emits_events_then_payload(self):
+        response = self.client.post(reverse('identify_predict_stream'), {'image': upload(encoded_image(seed=5))})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = self.events(response)
+
+        names = [name for name, _ in events]
+        self.assertEqual(names[:3], ['device', 'device_co2', 'device_kwh'])
+        self.assertEqual(names.count('disposal'), 2)
+        self.assertEqual(names.count('reuse'), 2)
+        self.assertEqual(events[-1], ('done', parse_response(SAMPLE_RESPONSE.strip())))
+
+    def test_cached_result_is_replayed_without_streaming(self):
+        self.client.post(reverse('identify_predict_stream'), {'image': upload(encoded_image(seed=5))})
+        response = self.client.post(reverse('identify_predict_stream'), {'image': upload(encoded_image(seed=5))})
+
+        events = self.events(response)
+        self.assertEqual(events[0], ('device', {'class': 'Laptop'}))
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(self.client_mock.messages.stream.call_count, 1)
+
+
+PARSER_CORPUS = Path(__file__).resolve().parent / 'testdata' / 'parser_corpus.json'
+# Generous per-response budget: catches an accidental quadratic or
+# per-line regex compile, not machine-to-machine noise
+PARSER_BUDGET_US = 500
+
+
+class ResponseParserTests(TestCase):
+    def setUp(self):
+        self.corpus = json.loads(PARSER_CORPUS.read_text(encoding='utf-8'))
+
+    def test_corpus_parses_as_recorded(self):
+        for entry in self.corpus:
+            with self.subTest(entry['name']):
+                payload = parse_response(entry['response'])
+                payload.pop('full_response', None)
+                self.assertEqual(payload, entry['expected'])
+
+    def test_stream_parser_agrees_with_parse_response(self):
+        for entry in self.corpus:
+            with self.subTest(entry['name']):
+                parser = StreamParser()
+                events = []
+                text = entry['response']
+                for i in range(0, len(text), 7):
+                    events.extend(parser.feed(text[i:i + 7]))
+                events.extend(parser.close())
+                # Replayed payloads always carry both figures; streams only those the model wrote
+                expected = [event for event in payload_events(parse_response(text))
+                            if event[0] not in ('device_co2', 'device_kwh') or event in events]
+                self.assertEqual(events, expected)
+
+    def test_units_ranges_and_markdown(self):
+        payload = parse_response("**Device:** This is a *Laptop* (ThinkPad)\n"
+                                 "Device CO2: ~1,200 kg CO2e\nDEVICE_KWH: 40-60 kWh/year")
+        self.assertEqual((payload['class'], payload['device_co2'], payload['device_kwh']), ('Laptop', 1200, 50))
+
+    def test_confidence_forms(self):
+        for text, expected in (('85', 0.85), ('85%', 0.85), ('0.7', 0.7), ('1', 0.01), ('1.0', 0.01),
+                               ('0.5%', 0.005), ('**High**', 0.9), ('n/a', None)):
+            with self.subTest(text):
+                self.assertEqual(parse_confidence(text), expected)
+
+    def test_parse_time_within_budget(self):
+        responses = [entry['response'] for entry in self.corpus] * 50
+        start = time.perf_counter()
+        for response in responses:
+            parse_response(response)
+        mean_us = (time.perf_counter() - start) * 1e6 / len(responses)
+        self.assertLess(mean_us, PARSER_BUDGET_US)
+
+    def test_bench_command_checks_corpus(self):
+        out = io.StringIO()
+        call_command('bench_parser', '--repeat', '2', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['parser']['mismatches'], [])
+        self.assertEqual(results['responses'], len(self.corpus))
+
+
+MULTI_RESPONSE = """Here is what I can see in the bin:
+
+DEVICE: Smartphone
+DEVICE_CO2: 70
+DEVICE_KWH: 5
+
+DISPOSAL:
+- Remove the SIM card
+- Recycle at an e-waste drop-off
+
+REUSE IDEAS:
+1. Security camera
+2. Music player
+
+**DEVICE:** Cardboard box
+DEVICE_CO2: 0
+
+DEVICE: No Device Detected
+
+## Device: Laptop charger
+DEVICE_CO2: 8 kg
+DEVICE_KWH: 0
+
+DISPOSAL:
+- Recycle with cables and adapters
+
+REUSE IDEAS:
+1. Spare for a compatible laptop
+"""
+
+
+@single_model
+class MultiDeviceTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.client_mock.messages.create.return_value = fake_message(MULTI_RESPONSE)
+        self.addCleanup(patcher.stop)
+
+    def predict(self, **data):
+        return self.client.post(reverse('identify_predict'), {'image': upload(), **data}).json()
+
+    def test_parse_devices_splits_repeated_sections(self):
+        payload = parse_devices(MULTI_RESPONSE)
+        self.assertEqual([device['class'] for device in payload['devices']],
+                         ['Smartphone', 'Cardboard box', 'Laptop charger'])
+        phone, box, charger = payload['devices']
+        self.assertEqual((phone['device_co2'], phone['device_kwh']), (70, 5))
+        self.assertEqual(phone['disposal_info'], '- Remove the SIM card\n- Recycle at an e-waste drop-off')
+        self.assertEqual(phone['reuse_ideas'], '1. Security camera\n2. Music player')
+        # Sections and numbering belong to one device
+        self.assertEqual((box['disposal_info'], box['reuse_ideas']), ('', ''))
+        self.assertEqual(charger['reuse_ideas'], '1. Spare for a compatible laptop')
+        self.assertEqual(charger['device_co2'], 8)
+        self.assertNotIn('full_response', phone)
+        self.assertEqual(parse_devices('DEVICE: No Device Detected')['devices'], [])
+
+    def test_one_call_for_every_device(self):
+        first = self.predict(mode='multi')
+        second = self.predict(mode='multi')
+        self.assertEqual(first, second)
+        self.assertEqual(len(first['devices']), 3)
+        self.assertEqual(self.client_mock.messages.create.call_count, 1)
+        kwargs = self.client_mock.messages.create.call_args.kwargs
+        self.assertEqual(kwargs['max_tokens'], settings.IDENTIFY_MULTI_MAX_TOKENS)
+        self.assertIn('every separate electronic device', kwargs['messages'][0]['content'][1]['text'])
+
+        # Single-device answers for the same bytes are cached apart
+        self.client_mock.messages.create.return_value = fake_message()
+        self.assertEqual(self.predict()['class'], 'Laptop')
+        self.assertEqual(self.client_mock.messages.create.call_count, 2)
+
+    @override_settings(IDENTIFY_MULTI_MAX_DEVICES=2)
+    def test_device_cap(self):
+        self.assertEqual(len(self.predict(mode='multi')['devices']), 2)
+        prompt = self.client_mock.messages.create.call_args.kwargs['messages'][0]['content'][1]['text']
+        self.assertIn('at most 2 devices', prompt)
+
+
+TRIAGE_RESPONSE = """DEVICE: Laptop
+DEVICE_CO2: 280
+DEVICE_KWH: 45
+CONFIDENCE: {confidence}
+
+DISPOSAL:
+- Take it to a certified e-waste recycler
+
+REUSE IDEAS:
+1. Home media server
+"""
+
+
+@override_settings(IDENTIFY_TRIAGE_MODEL='triage-model', IDENTIFY_MODEL='full-model', IDENTIFY_ESCALATE_BELOW=0.8)
+class ModelCascadeTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        claude_breaker.reset()
+        cascade_stats.reset()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.triage_text = TRIAGE_RESPONSE.format(confidence=92)
+
+        def create(model, **kwargs):
+            text = self.triage_text if model == 'triage-model' else SAMPLE_RESPONSE
+            usage = SimpleNamespace(input_tokens=1000, output_tokens=100 if model == 'triage-model' else 400)
+            return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=usage)
+        self.client_mock.messages.create.side_effect = create
+
+    def models_called(self):
+        return [call.kwargs['model'] for call in self.client_mock.messages.create.call_args_list]
+
+    def predict(self, seed=11):
+        return self.client.post(reverse('identify_predict'), {'image': upload(encoded_image(seed=seed))}).json()
+
+    def test_confident_triage_answer_is_used(self):
+        payload = self.predict()
+
+        self.assertEqual(self.models_called(), ['triage-model'])
+        self.assertEqual((payload['device_co2'], payload['confidence']), (280, 0.92))
+        self.assertIn('CONFIDENCE:', self.client_mock.messages.create.call_args.kwargs['messages'][0]['content'][1]['text'])
+        stats = cascade_stats.snapshot()
+        self.assertEqual((stats['triaged'], stats['escalated']), (1, 0))
+        self.assertEqual(stats['tiers']['triage']['output_tokens'], 100)
+        self.assertEqual(stats['tiers']['full']['calls'], 0)
+
+    def test_low_confidence_escalates_to_full_model(self):
+        self.triage_text = TRIAGE_RESPONSE.format(confidence=55)
+        payload = self.predict()
+
+        self.assertEqual(self.models_called(), ['triage-model', 'full-model'])
+        self.assertEqual(payload['device_co2'], 300)
+        self.assertNotIn('confidence', payload)
+        stats = cascade_stats.snapshot()
+        self.assertEqual(stats['escalations']['low_confidence'], 1)
+        self.assertEqual(stats['escalation_rate'], 1.0)
+        self.assertEqual(stats['tiers']['full']['input_tokens'], 1000)
+
+    def test_unknown_device_escalates(self):
+        self.triage_text = "DEVICE: Unknown device\nCONFIDENCE: 95\n"
+        self.predict()
+
+        self.assertEqual(self.models_called(), ['triage-model', 'full-model'])
+        self.assertEqual(cascade_stats.snapshot()['escalations']['unknown_device'], 1)
+
+    def test_triage_error_escalates(self):
+        full = self.client_mock.messages.create.side_effect
+        self.client_mock.messages.create.side_effect = [
+            api_status_error(anthropic.InternalServerError, 500), full(model='full-model')
+        ]
+        payload = self.predict()
+
+        self.assertEqual(payload['device_co2'], 300)
+        stats = cascade_stats.snapshot()
+        self.assertEqual((stats['tiers']['triage']['errors'], stats['escalations']['triage_error']), (1, 1))
+
+    def test_confident_answer_is_replayed_on_stream(self):
+        response = self.client.post(reverse('identify_predict_stream'), {'image': upload(encoded_image(seed=12))})
+        body = b''.join(response.streaming_content).decode()
+
+        self.assertIn('event: device\ndata: {"class": "Laptop"}', body)
+        self.assertIn('event: done', body)
+        self.assertEqual(self.client_mock.messages.stream.call_count, 0)
+
+    def test_cascade_results_are_cached_apart_from_single_model(self):
+        self.predict()
+        with self.settings(IDENTIFY_TRIAGE_MODEL=''):
+            self.predict()
+        self.assertEqual(self.models_called(), ['triage-model', 'full-model'])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(CLAUDE_BREAKER_WINDOW=60, CLAUDE_BREAKER_MIN_CALLS=4, CLAUDE_BREAKER_ERROR_RATE=0.5,
+                   CLAUDE_BREAKER_OPEN_SECONDS=30, CLAUDE_BREAKER_HALF_OPEN_PROBES=1)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('test', clock=self.clock)
+        patcher = mock.patch('app.breaker.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail(self, error=None):
+        with self.assertRaises(Exception):
+            with self.breaker.call():
+                raise error or api_status_error(anthropic.InternalServerError, 500)
+
+    def succeed(self):
+        with self.breaker.call():
+            pass
+
+    def test_opens_at_error_rate_and_fails_fast(self):
+        self.succeed()
+        self.succeed()
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.clock.now += 10
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.succeed()
+        self.assertEqual(raised.exception.retry_after, 20)
+        self.assertEqual(self.breaker.snapshot()['rejected'], 1)
+
+    def test_old_failures_leave_the_window(self):
+        for _ in range(3):
+            self.fail()
+        self.clock.now += 61
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_client_errors_do_not_count(self):
+        for _ in range(5):
+            self.fail(api_status_error(anthropic.BadRequestError, 400))
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_closes_or_reopens(self):
+        for _ in range(4):
+            self.fail()
+        self.clock.now += 30
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+
+        self.clock.now += 30
+        with self.breaker.call():
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            # Only one probe at a time
+            with self.assertRaises(CircuitOpenError):
+                self.succeed()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.snapshot()['window_calls'], 1)
+
+
+@single_model
+@override_settings(CLAUDE_BREAKER_MIN_CALLS=2, CLAUDE_BREAKER_ERROR_RATE=0.5)
+class DegradedModeTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        claude_breaker.reset()
+        self.addCleanup(claude_breaker.reset)
+        patcher = mock.patch('app.breaker.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.client_mock.messages.create.return_value = fake_message()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, data):
+        return self.client.post(reverse('identify_predict'), {'image': upload(data)})
+
+    def trip(self):
+        self.client_mock.messages.create.side_effect = api_status_error(anthropic.InternalServerError, 500)
+        self.predict(encoded_image(seed=30))
+        self.predict(encoded_image(seed=31))
+        self.assertEqual(claude_breaker.state, OPEN)
+        self.client_mock.messages.create.reset_mock()
+
+    def test_open_breaker_fails_fast(self):
+        self.trip()
+        response = self.predict(encoded_image(seed=32))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('temporarily unavailable', response.json()['error'])
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.client_mock.messages.create.assert_not_called()
+
+    def test_open_breaker_serves_similar_cached_result(self):
+        self.predict(encoded_image(seed=33))
+        IdentificationResult.objects.update(version='older-model:prompt')
+        result_cache.memory.clear()
+        self.trip()
+
+        payload = self.predict(encoded_image(seed=33, noise=7)).json()
+        self.assertEqual(payload['class'], 'Laptop')
+        self.assertTrue(payload['degraded'])
+        self.client_mock.messages.create.assert_not_called()
+
+    def test_health_reports_breaker_state(self):
+        self.assertEqual(self.client.get(reverse('health')).json()['status'], 'ok')
+        self.trip()
+
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'degraded')
+        self.assertEqual(response.json()['claude']['state'], OPEN)
+
+    def test_jobs_wait_out_an_open_breaker(self):
+        self.assertTrue(jobs.is_retryable(CircuitOpenError('Claude API', 12)))
+        self.assertGreaterEqual(jobs.retry_delay(CircuitOpenError('Claude API', 12), 1), 12)
+
+
+@single_model
+class MetricsTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        message = fake_message()
+        message.usage = SimpleNamespace(input_tokens=1200, output_tokens=180)
+        self.client_mock.messages.create.return_value = message
+
+    def predict(self, seed=40):
+        return self.client.post(reverse('identify_predict'), {'image': upload(encoded_image(seed=seed))})
+
+    def test_metrics_exposes_request_stage_and_token_series(self):
+        self.assertEqual(self.predict().status_code, 200)
+
+        self.client.force_login(User.objects.create_user('ops', password='pw', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE greenbyte_request_duration_seconds histogram', body)
+        self.assertIn('greenbyte_request_duration_seconds_count{view="identify_predict",method="POST",status="200"}', body)
+        self.assertIn('greenbyte_stage_duration_seconds_bucket{stage="upstream_full",le="+Inf"}', body)
+        self.assertIn('greenbyte_stage_duration_seconds_count{stage="parse"}', body)
+        self.assertIn('greenbyte_request_db_queries_count{view="identify_predict"}', body)
+        self.assertIn(f'greenbyte_upstream_tokens_total{{model="{settings.IDENTIFY_MODEL}",direction="input"}}', body)
+        self.assertIn('greenbyte_claude_breaker_state 0', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_latency_seconds', "Test.", buckets=(0.1, 1))
+        metrics._registry.remove(histogram)
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.render()[2:], [
+            'test_latency_seconds_bucket{le="0.1"} 1',
+            'test_latency_seconds_bucket{le="1"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+            'test_latency_seconds_sum 6.05',
+            'test_latency_seconds_count 4',
+        ])
+
+    @override_settings(METRICS_LOG_REQUESTS=True)
+    def test_structured_request_log(self):
+        with self.assertLogs('app.metrics', 'INFO') as logs:
+            self.predict(seed=41)
+
+        entry = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((entry['view'], entry['status']), ('identify_predict', 200))
+        self.assertGreater(entry['bytes_in'], 0)
+        self.assertGreater(entry['bytes_out'], 0)
+        self.assertGreater(entry['db_queries'], 0)
+        self.assertLessEqual({'read_upload', 'prepare', 'cache_lookup', 'upstream_full', 'parse', 'cache_store'},
+                             set(entry['stages_ms']))
+        self.assertEqual(entry['tokens'], {'input': 1200, 'output': 180})
+
+    def test_metrics_are_not_public(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.force_login(User.objects.create_user('member', password='pw'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_request_metrics_are_attached_to_the_request(self):
+        response = self.predict(seed=42)
+        self.assertGreater(response.wsgi_request.metrics.queries, 0)
+        self.assertIn('upstream_full', response.wsgi_request.metrics.stages)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_are_inert(self):
+        self.assertIs(metrics.stage('parse'), metrics.stage('prepare'))
+        with self.assertRaises(MiddlewareNotUsed):
+            metrics.MetricsMiddleware(lambda request: None)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class FakeMessagesAPITests(TestCase):
+    # The benchmark stub, reached through the real SDK over HTTP
+    def setUp(self):
+        result_cache.memory.clear()
+        claude_breaker.reset()
+        self.addCleanup(claude_breaker.reset)
+
+    def predict(self, api, seed):
+        client = anthropic.Anthropic(api_key='test', base_url=api.url, max_retries=0)
+        with mock.patch('app.identify.claude_client', client):
+            return self.client.post(reverse('identify_predict'), {'image': upload(encoded_image(seed=seed))})
+
+    def test_identify_through_the_stub(self):
+        with FakeMessagesAPI([TRIAGE_RESPONSE.format(confidence=95)]) as api:
+            payload = self.predict(api, seed=50).json()
+
+        self.assertEqual(payload['class'], 'Laptop')
+        self.assertEqual(api.snapshot(), {'calls': {settings.IDENTIFY_MODEL: 1}, 'errors': 0})
+
+    @single_model
+    def test_stub_errors_surface_as_api_errors(self):
+        with FakeMessagesAPI([SAMPLE_RESPONSE], error_rate=1) as api:
+            payload = self.predict(api, seed=51).json()
+
+        self.assertIn('Claude API error', payload['error'])
+        self.assertEqual(api.snapshot()['errors'], 1)
+
+
+@single_model
+class BatchIdentifyTests(TransactionTestCase):
+    # Batch images are identified on worker threads, which need committed data
+
+    def setUp(self):
+        result_cache.memory.clear()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def create(**kwargs):
+            if kwargs['messages'][0]['content'][0]['source']['media_type'] == 'image/gif':
+                raise RuntimeError('upstream exploded')
+            return fake_message()
+        self.client_mock.messages.create.side_effect = create
+
+    def post_batch(self, **extra):
+        images = [
+            upload(encoded_image(seed=10), name='a.png'),
+            upload(b'GIF89a-not-really', name='b.gif', content_type='image/gif'),
+            upload(b'text', name='c.txt', content_type='text/plain'),
+            upload(encoded_image(seed=11), name='d.png'),
+        ]
+        return self.client.post(reverse('identify_predict_batch'), {'images': images, **extra})
+
+    def test_per_image_results_and_errors(self):
+        results = self.post_batch().json()['results']
+
+        self.assertEqual([r['filename'] for r in results], ['a.png', 'b.gif', 'c.txt', 'd.png'])
+        self.assertEqual(results[0]['result']['class'], 'Laptop')
+        self.assertEqual(results[1]['error'], 'Unexpected error: upstream exploded')
+        self.assertEqual(results[2]['error'], 'Invalid image format')
+        self.assertEqual(results[3]['result']['device_kwh'], 50)
+
+    def test_track_records_identified_devices_in_one_go(self):
+        user = User.objects.create_user('collector', password='pw')
+        self.client.force_login(user)
+
+        self.assertEqual(self.post_batch(track='1').json()['tracked'], 2)
+        tracker = UserTracker.objects.get(user_id=user)
+        self.assertEqual((tracker.total_devices, tracker.total_co2, tracker.total_kwh), (2, 600, 100))
+        self.assertEqual(DeviceTracker.objects.filter(user=user).count(), 2)
+
+    def test_track_requires_login(self):
+        self.assertEqual(self.post_batch(track='1').status_code, 403)
+
+    def test_track_requires_csrf_token(self):
+        user = User.objects.create_user('victim', password='pw')
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(user)
+
+        self.assertEqual(self.post_batch(track='1').status_code, 403)
+        self.assertFalse(DeviceTracker.objects.filter(user=user).exists())
+        # Identification alone stays open to cross-site callers
+        self.assertEqual(self.post_batch().status_code, 200)
+
+    @override_settings(IDENTIFY_BATCH_MAX_IMAGES=2)
+    def test_batch_size_is_capped(self):
+        self.assertEqual(self.post_batch().status_code, 400)
+
+
+def api_status_error(error_class, status_code, headers=None):
+    response = SimpleNamespace(status_code=status_code, headers=headers or {}, request=None)
+    return error_class('upstream error', response=response, body=None)
+
+
+@override_settings(IDENTIFY_JOB_WORKERS=0, IDENTIFY_JOB_MAX_ATTEMPTS=3)
+@single_model
+class IdentificationJobTests(TestCase):
+    def setUp(self):
+        result_cache.memory.clear()
+        claude_breaker.reset()
+        patcher = mock.patch('app.identify.claude_client')
+        self.client_mock = patcher.start()
+        self.api = self.client_mock.with_options.return_value.messages.create
+        self.addCleanup(patcher.stop)
+
+    def submit(self, seed=20):
+        response = self.client.post(reverse('identify_job_submit'), {'image': upload(encoded_image(seed=seed))})
+        self.assertEqual(response.status_code, 202)
+        return response.json()['job_id']
+
+    def poll(self, job_id, **params):
+        return self.client.get(reverse('identify_job_status', args=[job_id]), params).json()
+
+    def test_submit_then_poll(self):
+        self.api.return_value = fake_message()
+        job_id = self.submit()
+        self.assertEqual(self.poll(job_id)['status'], 'queued')
+
+        self.assertTrue(jobs.process_next())
+        done = self.poll(job_id)
+        self.assertEqual(done['status'], 'done')
+        self.assertEqual(done['result']['class'], 'Laptop')
+        self.client_mock.with_options.assert_called_with(max_retries=0)
+
+    def test_rate_limited_job_is_retried_after_retry_after(self):
+        self.api.side_effect = [api_status_error(anthropic.RateLimitError, 429, {'retry-after': '7'}), fake_message()]
+        job_id = self.submit()
+
+        jobs.process_next()
+        job = IdentificationJob.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertAlmostEqual((job.available_at - timezone.now()).total_seconds(), 7, delta=1)
+        self.assertFalse(jobs.process_next())
+
+        IdentificationJob.objects.filter(id=job_id).update(available_at=timezone.now())
+        jobs.process_next()
+        self.assertEqual(self.poll(job_id)['status'], 'done')
+        self.assertEqual(jobs.queue_stats()['retries'], 1)
+
+    def test_job_fails_after_max_attempts(self):
+        self.api.side_effect = api_status_error(anthropic.InternalServerError, 500)
+        job_id = self.submit()
+        for _ in range(3):
+            IdentificationJob.objects.filter(id=job_id).update(available_at=timezone.now())
+            jobs.process_next()
+
+        result = self.poll(job_id)
+        self.assertEqual((result['status'], result['attempts']), ('failed', 3))
+
+    def test_client_errors_are_not_retried(self):
+        self.api.side_effect = api_status_error(anthropic.BadRequestError, 400)
+        job_id = self.submit()
+        jobs.process_next()
+        self.assertEqual(self.poll(job_id)['status'], 'failed')
+
+    def test_backoff_is_jittered_and_capped(self):
+        error = RuntimeError('no response')
+        with override_settings(IDENTIFY_JOB_BACKOFF_BASE=1, IDENTIFY_JOB_BACKOFF_MAX=10):
+            delays = [jobs.retry_delay(error, attempt) for attempt in range(1, 30)]
+        self.assertTrue(all(0 <= delay <= 10 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_cached_upload_completes_immediately(self):
+        self.api.return_value = fake_message()
+        job_id = self.submit()
+        jobs.process_next()
+
+        again = self.client.post(reverse('identify_job_submit'), {'image': upload(encoded_image(seed=20))}).json()
+        self.assertEqual(again['status'], 'done')
+        self.assertNotEqual(again['job_id'], job_id)
+
+    def test_long_poll_returns_at_deadline(self):
+        job_id = self.submit()
+        self.assertEqual(self.poll(job_id, wait='0.3')['status'], 'queued')
+
+    def test_bad_wait_is_rejected(self):
+        job_id = self.submit()
+        for wait in ('nan', 'inf', 'soon'):
+            with self.subTest(wait=wait):
+                response = self.client.get(reverse('identify_job_status', args=[job_id]), {'wait': wait})
+                self.assertEqual(response.status_code, 400)
+
+    @override_settings(IDENTIFY_JOB_MAX_WAIT=0)
+    def test_wait_for_clamps_timeout(self):
+        job_id = self.submit()
+        start = time.monotonic()
+        self.assertEqual(jobs.wait_for(job_id, float('nan')).status, 'queued')
+        self.assertEqual(jobs.wait_for(job_id, 60).status, 'queued')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_queue_stats(self):
+        self.submit(seed=21)
+        self.submit(seed=22)
+        stats = jobs.queue_stats()
+        self.assertEqual(stats['queued'], 2)
+        self.assertGreaterEqual(stats['oldest_queued_seconds'], 0)
+
+
+@single_model
+class SingleFlightTests(TransactionTestCase):
+    def test_concurrent_callers_share_one_execution(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', work))) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while flight.snapshot()['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['answer'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.snapshot()['calls_saved'], 4)
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('key', lambda: (_ for _ in ()).throw(ValueError('boom')))
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+
+    def test_processes_coordinate_through_lock_file(self):
+        # Two instances stand in for two worker processes: flock locks
+        # belong to open file descriptions, so they exclude each other
+        shared_cache = {}
+        first, second = SingleFlight(), SingleFlight()
+        entered = threading.Event()
+
+        def slow():
+            entered.set()
+            time.sleep(0.2)
+            shared_cache['key'] = 'answer'
+            return 'answer'
+
+        with override_settings(IDENTIFY_SINGLEFLIGHT_LOCK_DIR=tempfile.mkdtemp()):
+            leader = threading.Thread(target=first.do, args=('key', slow))
+            leader.start()
+            entered.wait(5)
+            result = second.do('key', lambda: 'duplicate call', recheck=lambda: shared_cache.get('key'))
+            leader.join()
+
+        self.assertEqual(result, 'answer')
+        self.assertEqual(second.snapshot()['deduplicated_across_processes'], 1)
+
+    def test_different_keys_do_not_wait_on_each_other(self):
+        lock_dir = tempfile.mkdtemp()
+        flights = [SingleFlight() for _ in range(8)]
+
+        def slow():
+            time.sleep(0.3)
+            return 'answer'
+
+        with override_settings(IDENTIFY_SINGLEFLIGHT_LOCK_DIR=lock_dir):
+            threads = [threading.Thread(target=flight.do, args=(f'key-{i}', slow)) for i, flight in enumerate(flights)]
+            start = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertLess(time.monotonic() - start, 0.6)
+        # Lock files go away with their calls
+        self.assertEqual(os.listdir(lock_dir), [])
+
+    def test_waiters_give_up_on_a_hung_holder(self):
+        first, second = SingleFlight(), SingleFlight()
+        entered, release = threading.Event(), threading.Event()
+
+        def hung():
+            entered.set()
+            release.wait(5)
+            return 'late'
+
+        with override_settings(IDENTIFY_SINGLEFLIGHT_LOCK_DIR=tempfile.mkdtemp(), IDENTIFY_SINGLEFLIGHT_LOCK_WAIT=0.2):
+            leader = threading.Thread(target=first.do, args=('key', hung))
+            leader.start()
+            entered.wait(5)
+            start = time.monotonic()
+            result = second.do('key', lambda: 'own call', recheck=lambda: None)
+            waited = time.monotonic() - start
+            release.set()
+            leader.join()
+
+        self.assertEqual(result, 'own call')
+        self.assertLess(waited, 1)
+        self.assertEqual(second.snapshot()['lock_timeouts'], 1)
+
+    def test_identify_image_coalesces_duplicate_uploads(self):
+        result_cache.memory.clear()
+        single_flight.reset_stats()
+        gate = threading.Event()
+
+        def create(**kwargs):
+            gate.wait(5)
+            return fake_message()
+
+        with mock.patch('app.identify.claude_client') as client_mock:
+            client_mock.messages.create.side_effect = create
+            image = encoded_image(seed=30)
+            responses = []
+
+            def post():
+                responses.append(self.client_class().post(reverse('identify_predict'), {'image': upload(image)}).json())
+
+            threads = [threading.Thread(target=post) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            while single_flight.snapshot()['coalesced'] < 2:
+                time.sleep(0.01)
+            gate.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(client_mock.messages.create.call_count, 1)
+        self.assertEqual([r['class'] for r in responses], ['Laptop'] * 3)
+
+    def test_concurrent_streams_make_one_upstream_call(self):
+        result_cache.memory.clear()
+        single_flight.reset_stats()
+        gate = threading.Event()
+
+        def text_stream():
+            gate.wait(5)
+            yield SAMPLE_RESPONSE
+
+        with mock.patch('app.identify.claude_client') as client_mock:
+            client_mock.messages.stream.return_value.__enter__.return_value.text_stream = text_stream()
+            image = encoded_image(seed=31)
+            bodies = []
+
+            def post():
+                response = self.client_class().post(reverse('identify_predict_stream'), {'image': upload(image)})
+                bodies.append(b''.join(response.streaming_content).decode())
+
+            threads = [threading.Thread(target=post) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            # Bounded, so a regression fails on the call count rather than hanging
+            deadline = time.monotonic() + 5
+            while single_flight.snapshot()['coalesced'] < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            gate.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(client_mock.messages.stream.call_count, 1)
+        done = [body.strip().split('\n\n')[-1] for body in bodies]
+        self.assertEqual(done[0], done[1])
+        self.assertIn('"class": "Laptop"', done[0])
+
+    async def test_concurrent_async_misses_make_one_upstream_call(self):
+        result_cache.memory.clear()
+        gate = asyncio.Event()
+
+        async def create(**kwargs):
+            await gate.wait()
+            return fake_message()
+
+        client_mock = mock.MagicMock()
+        client_mock.messages.create = mock.AsyncMock(side_effect=create)
+        with mock.patch('app.identify.get_async_client', return_value=client_mock):
+            image = encoded_image(seed=32)
+            calls = [asyncio.ensure_future(aidentify_image(image, 'image/png')) for _ in range(3)]
+            while client_mock.messages.create.await_count < 1:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            gate.set()
+            payloads = await asyncio.gather(*calls)
+
+        self.assertEqual(client_mock.messages.create.await_count, 1)
+        self.assertEqual([payload['class'] for payload in payloads], ['Laptop'] * 3)
+
+    def test_abandoned_leader_is_taken_over(self):
+        flight = SingleFlight()
+        entered, release = threading.Event(), threading.Event()
+
+        def abandon():
+            try:
+                with flight.flight('key') as claim:
+                    entered.set()
+                    release.wait(5)
+                    raise GeneratorExit
+            except GeneratorExit:
+                pass
+
+        leader = threading.Thread(target=abandon)
+        leader.start()
+        entered.wait(5)
+        results = []
+        follower = threading.Thread(target=lambda: results.append(flight.do('key', lambda: 'own call')))
+        follower.start()
+        while flight.snapshot()['coalesced'] < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(results, ['own call'])
+
+
+def app_queries(context):
+    # Ignore savepoints and session/auth lookups made by the test client
+    return [q['sql'] for q in context.captured_queries if 'app_' in q['sql']]
+
+
+@single_model
+class UpdateTrackerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('recycler', password='pw')
+        self.client.force_login(self.user)
+
+    def track(self, name='Laptop', co2=300, kwh=50):
+        return self.client.post(
+            reverse('update_tracker'),
+            json.dumps({'action': 'dispose_reuse', 'device_name': name, 'device_co2': co2, 'device_kwh': kwh}),
+            content_type='application/json'
+        ).json()
+
+    def test_first_and_subsequent_updates(self):
+        self.assertEqual(self.track()['total_devices'], 1)
+        self.assertEqual(self.track('Phone', '70', '5')['total_devices'], 2)
+
+        tracker = UserTracker.objects.get(user_id=self.user)
+        self.assertEqual((tracker.total_devices, tracker.total_co2, tracker.total_kwh), (2, 370, 55))
+        self.assertEqual(
+            list(DeviceTracker.objects.filter(user=self.user).values_list('device_name', flat=True).order_by('id')),
+            ['Laptop', 'Phone']
+        )
+
+    def test_no_device_is_rejected(self):
+        self.assertFalse(self.track('No Device Detected')['success'])
+        self.assertFalse(UserTracker.objects.filter(user_id=self.user).exists())
+
+    def test_existing_tracker_update_statements(self):
+        self.track()
+        with CaptureQueriesContext(connection) as queries:
+            self.track()
+        # Previously SELECT + UPDATE + INSERT, outside any transaction; now
+        # UPDATE ... RETURNING + INSERT, plus one UPDATE per savings rollup,
+        # one for the community totals and the catalog version check
+        expected = 7 if connection.vendor in ('sqlite', 'postgresql') else 8
+        self.assertEqual(len(app_queries(queries)), expected)
+
+    def track_many(self, devices):
+        return self.client.post(
+            reverse('update_tracker'), json.dumps({'action': 'dispose_reuse_many', 'devices': devices}),
+            content_type='application/json'
+        ).json()
+
+    def test_selected_devices_are_recorded_together(self):
+        self.track()
+        devices = [
+            {'device_name': 'Smartphone', 'device_co2': 70, 'device_kwh': 5},
+            {'device_name': 'No Device Detected'},
+            {'device_name': 'Laptop charger', 'device_co2': '8', 'device_kwh': 0},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            data = self.track_many(devices)
+        self.assertEqual((data['tracked'], data['total_devices']), (2, 3))
+        # Same statements as a single device: one totals UPDATE, one INSERT
+        expected = 7 if connection.vendor in ('sqlite', 'postgresql') else 8
+        self.assertEqual(len(app_queries(queries)), expected)
+        tracker = UserTracker.objects.get(user_id=self.user)
+        self.assertEqual((tracker.total_co2, tracker.total_kwh), (378, 55))
+
+    def test_bad_device_lists_are_rejected(self):
+        too_many = [{'device_name': 'Laptop'}] * (settings.IDENTIFY_MULTI_MAX_DEVICES + 1)
+        for devices in ([], 'Laptop', ['Laptop'], too_many):
+            with self.subTest(devices=devices):
+                self.assertFalse(self.track_many(devices)['success'])
+        self.assertFalse(self.track_many([{'device_name': 'No Device Detected'}])['success'])
+        self.assertFalse(DeviceTracker.objects.filter(user=self.user).exists())
+
+
+class TrackerConcurrencyTests(TransactionTestCase):
+    def test_parallel_writers_keep_exact_totals(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("shared-cache in-memory SQLite does not wait on locks; "
+                          "run `manage.py stress_tracker` or use a file/server database")
+        user = User.objects.create_user('busy', password='pw')
+        writers, per_writer = 8, 25
+        errors = []
+
+        def write():
+            try:
+                for _ in range(per_writer):
+                    record_devices(user, [{'class': 'Phone', 'device_co2': 3, 'device_kwh': 2}])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        tracker = UserTracker.objects.get(user_id=user)
+        total = writers * per_writer
+        self.assertEqual((tracker.total_devices, tracker.total_co2, tracker.total_kwh), (total, 3 * total, 2 * total))
+        self.assertEqual(DeviceTracker.objects.filter(user=user).count(), total)
+
+
+class DeviceHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('historian', password='pw')
+        self.client.force_login(self.user)
+        start = timezone.now() - timedelta(days=30)
+        # Pairs share a timestamp so pages must break ties on id
+        DeviceTracker.objects.bulk_create([
+            DeviceTracker(
+                user=self.user, device_name=f'{"Phone" if i % 3 else "Laptop"} {i}',
+                device_co2=i, device_kwh=i, created_at=start + timedelta(hours=i // 2)
+            )
+            for i in range(23)
+        ])
+        other = User.objects.create_user('someone-else')
+        DeviceTracker.objects.create(user=other, device_name='Phone X', device_co2=1, device_kwh=1)
+
+    def walk(self, **kwargs):
+        names, cursor = [], None
+        while True:
+            devices, cursor = device_history(self.user, cursor, limit=5, **kwargs)
+            names.extend(device.device_name for device in devices)
+            if cursor is None:
+                return names
+
+    def test_pages_cover_history_newest_first_without_gaps(self):
+        expected = list(
+            DeviceTracker.objects.filter(user=self.user)
+            .order_by('-created_at', '-id').values_list('device_name', flat=True)
+        )
+        names = self.walk()
+        self.assertEqual(names, expected)
+        self.assertEqual(len(set(names)), 23)
+
+    def test_name_filter(self):
+        names = self.walk(name='laptop')
+        self.assertEqual(len(names), 8)
+        self.assertTrue(all(name.startswith('Laptop') for name in names))
+
+    def test_page_query_is_constant(self):
+        _, cursor = device_history(self.user, limit=5)
+        for _ in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                _, cursor = device_history(self.user, cursor, limit=5)
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_json_endpoint(self):
+        data = self.client.get(reverse('tracker_history'), {'limit': 20}).json()
+        self.assertEqual(len(data['devices']), 20)
+        self.assertEqual(set(data['devices'][0]), {'id', 'device_name', 'device_co2', 'device_kwh', 'created_at'})
+
+        rest = self.client.get(reverse('tracker_history'), {'limit': 20, 'cursor': data['next_cursor']}).json()
+        self.assertEqual(len(rest['devices']), 3)
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('tracker_history'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rows_fragment_and_tracker_page(self):
+        response = self.client.get(reverse('tracker_history_rows'), {'q': 'phone', 'limit': 100})
+        self.assertEqual(response.content.decode().count('<tr>'), 15)
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+        UserTracker.objects.create(user_id=self.user, total_devices=23, total_co2=0, total_kwh=0)
+        with self.settings(TRACKER_PAGE_SIZE=20):
+            page = self.client.get(reverse('tracker'))
+        self.assertEqual(len(page.context['devices']), 20)
+        self.assertTrue(page.context['next_cursor'])
+
+
+class TrackerExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('exporter', password='pw')
+        self.client.force_login(self.user)
+        start = timezone.make_aware(timezone.datetime(2024, 3, 1, 12))
+        DeviceTracker.objects.bulk_create([
+            DeviceTracker(
+                user=self.user, device_name=f'{"Phone" if i % 2 else "Laptop"} {i}',
+                device_co2=i * 10, device_kwh=i, created_at=start + timedelta(days=i)
+            )
+            for i in range(6)
+        ])
+        UserTracker.objects.create(user_id=self.user, total_devices=6, total_co2=150, total_kwh=15)
+        other = User.objects.create_user('someone-else')
+        DeviceTracker.objects.create(user=other, device_name='Phone X', device_co2=1, device_kwh=1)
+
+    def export(self, name='tracker_export', **params):
+        response = self.client.get(reverse(name), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def fill(self, user, rows):
+        # Generated in the database; a million model instances would take minutes
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s) "
+                f"INSERT INTO {DeviceTracker._meta.db_table} (user_id, device_name, device_co2, device_kwh, created_at) "
+                f"SELECT %s, 'Device ' || i, i %% 500, i %% 90, %s FROM n",
+                [rows, user.pk, timezone.now()]
+            )
+
+    def test_csv_export_of_own_history(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="greenbyte-exporter-devices.csv"', response['Content-Disposition'])
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'created_at,device_name,device_co2,device_kwh')
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[1].endswith(',Laptop 0,0,0'))
+        self.assertNotIn('Phone X', body.decode())
+
+    def test_csv_cells_cannot_start_formulas(self):
+        DeviceTracker.objects.create(user=self.user, device_name='=HYPERLINK("http://evil.example")',
+                                     device_co2=-5, device_kwh=1)
+        for name in ('+1 Phone', '-Tablet', '@Router'):
+            DeviceTracker.objects.create(user=self.user, device_name=name, device_co2=1, device_kwh=1)
+        _, body = self.export()
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual([row[1] for row in rows[-4:]],
+                         ['\'=HYPERLINK("http://evil.example")', "'+1 Phone", "'-Tablet", "'@Router"])
+        # Numbers are left alone
+        self.assertEqual(rows[-4][2], '-5')
+
+        _, body = self.export(format='ndjson')
+        self.assertIn('"=HYPERLINK', body.decode())
+
+    def test_ndjson_with_filters(self):
+        _, body = self.export(format='ndjson', start='2024-03-02', end='2024-03-05', device='phone')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['device_name'] for row in rows], ['Phone 1', 'Phone 3'])
+        self.assertEqual(set(rows[0]), {'created_at', 'device_name', 'device_co2', 'device_kwh'})
+
+    def test_gzip_and_totals(self):
+        response, body = self.export(data='totals', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('greenbyte-exporter-totals.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(body).decode().splitlines(),
+                         ['username,total_devices,total_co2,total_kwh', 'exporter,6,150,15'])
+
+    def test_bad_parameters_are_rejected(self):
+        for params in ({'format': 'xml'}, {'data': 'sessions'}, {'start': 'yesterday'}):
+            self.assertEqual(self.client.get(reverse('tracker_export'), params).status_code, 400)
+
+    def test_last_representable_end_date(self):
+        _, body = self.export(start='2024-03-04', end='9999-12-31')
+        self.assertEqual(len(body.decode().splitlines()), 4)
+
+    @override_settings(EXPORT_CHUNK_SIZE=500)
+    def test_rows_stream_through_a_chunked_iterator(self):
+        self.fill(self.user, 3000)
+        with mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            response = self.client.get(reverse('tracker_export'))
+            chunks = list(response.streaming_content)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(iterator.call_count, 1)
+        self.assertEqual(iterator.call_args.kwargs, {'chunk_size': 500})
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(chunk.count(b'\n') for chunk in chunks), 3007)
+
+    def test_site_wide_export_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('tracker_export_all')).status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        _, body = self.export('tracker_export_all')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'id,username,created_at,device_name,device_co2,device_kwh')
+        self.assertEqual(len(lines), 8)
+        self.assertIn(',someone-else,', lines[-1])
+
+    def test_memory_stays_flat_for_a_million_rows(self):
+        # Slow (about a minute under tracemalloc), so opt in
+        if not os.getenv('GREENBYTE_MILLION_ROW_EXPORT'):
+            self.skipTest("set GREENBYTE_MILLION_ROW_EXPORT=1 to export a million-row fixture")
+        small = User.objects.create_user('small-history')
+        large = User.objects.create_user('large-history')
+        self.fill(small, 10_000)
+        self.fill(large, 1_000_000)
+
+        def peak(user):
+            # Counts lines as chunks arrive; keeping the body would be what grows
+            self.client.force_login(user)
+            decompressor = zlib.decompressobj(wbits=31)
+            lines = 0
+            tracemalloc.start()
+            try:
+                response = self.client.get(reverse('tracker_export'), {'gzip': '1'})
+                for chunk in response.streaming_content:
+                    lines += decompressor.decompress(chunk).count(b'\n')
+                return tracemalloc.get_traced_memory()[1], lines
+            finally:
+                tracemalloc.stop()
+
+        peak(small)  # Warm up imports and caches
+        small_peak, _ = peak(small)
+        large_peak, lines = peak(large)
+        self.assertEqual(lines, 1_000_001)
+        # 100x the rows, same footprint: one fetch chunk and one output chunk at a time
+        self.assertLess(large_peak, small_peak + 1024 * 1024)
+
+
+class SavingsRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('roller', password='pw')
+        self.other = User.objects.create_user('other')
+        self.client.force_login(self.user)
+
+    def record_at(self, when, user=None, devices=1):
+        with mock.patch('app.tracking.timezone.now', return_value=when):
+            record_devices(user or self.user, [{'class': 'Phone', 'device_co2': 10, 'device_kwh': 2}] * devices)
+
+    def snapshot(self):
+        return {
+            model.__name__: sorted(model.objects.values_list(*fields))
+            for model, fields in (
+                (UserDailySavings, ('user_id', 'period', 'devices', 'co2', 'kwh')),
+                (UserMonthlySavings, ('user_id', 'period', 'devices', 'co2', 'kwh')),
+                (GlobalDailySavings, ('period', 'devices', 'co2', 'kwh')),
+            )
+        }
+
+    def seed(self):
+        self.record_at(timezone.make_aware(timezone.datetime(2024, 1, 30, 9)), devices=2)
+        self.record_at(timezone.make_aware(timezone.datetime(2024, 1, 30, 18)))
+        self.record_at(timezone.make_aware(timezone.datetime(2024, 2, 2, 12)))
+        self.record_at(timezone.make_aware(timezone.datetime(2024, 2, 2, 13)), user=self.other)
+
+    def test_incremental_rollups(self):
+        self.seed()
+        day = UserDailySavings.objects.get(user=self.user, period=date(2024, 1, 30))
+        self.assertEqual((day.devices, day.co2, day.kwh), (3, 30, 6))
+        self.assertEqual(
+            list(UserMonthlySavings.objects.filter(user=self.user).order_by('period').values_list('period', 'devices')),
+            [(date(2024, 1, 1), 3), (date(2024, 2, 1), 1)]
+        )
+        self.assertEqual(GlobalDailySavings.objects.get(period=date(2024, 2, 2)).devices, 2)
+
+    def test_rebuild_matches_incremental(self):
+        self.seed()
+        incremental = self.snapshot()
+        community = sorted(CommunityTotals.objects.filter(devices__gt=0).values_list('shard', 'devices', 'co2', 'kwh'))
+        GlobalDailySavings.objects.update(devices=0)
+        UserDailySavings.objects.filter(user=self.other).delete()
+
+        counts = rebuild_rollups(batch_size=1)
+        self.assertEqual(counts, {'user_daily': 3, 'user_monthly': 3, 'global_daily': 2})
+        self.assertEqual(self.snapshot(), incremental)
+        self.assertEqual(sorted(CommunityTotals.objects.values_list('shard', 'devices', 'co2', 'kwh')), community)
+
+    def test_series_buckets(self):
+        self.seed()
+        days = savings_series(self.user, 'day', date(2024, 1, 29), date(2024, 2, 3))
+        self.assertEqual([bucket['devices'] for bucket in days], [0, 3, 0, 0, 1, 0])
+        self.assertEqual(days[1], {'period': '2024-01-30', 'devices': 3, 'co2': 30, 'kwh': 6})
+
+        weeks = savings_series(self.user, 'week', date(2024, 1, 30), date(2024, 2, 5))
+        self.assertEqual([(b['period'], b['devices']) for b in weeks], [('2024-01-29', 4), ('2024-02-05', 0)])
+
+        months = savings_series(None, 'month', date(2024, 1, 15), date(2024, 2, 15))
+        self.assertEqual([(b['period'], b['devices']) for b in months], [('2024-01-01', 3), ('2024-02-01', 2)])
+
+    def test_series_query_count_does_not_grow_with_history(self):
+        for hour in range(20):
+            self.record_at(timezone.make_aware(timezone.datetime(2024, 3, 1, hour)))
+        with CaptureQueriesContext(connection) as queries:
+            savings_series(self.user, 'month', date(2024, 1, 1), date(2024, 12, 31))
+        self.assertEqual(len(queries), 1)
+
+    def test_series_endpoint(self):
+        self.seed()
+        data = self.client.get(reverse('tracker_series'), {
+            'granularity': 'month', 'start': '2024-01-01', 'end': '2024-02-29', 'scope': 'global'
+        }).json()
+        self.assertEqual([b['devices'] for b in data['series']], [3, 2])
+
+        default = self.client.get(reverse('tracker_series')).json()
+        self.assertEqual(len(default['series']), 30)
+
+        for params in ({'granularity': 'hour'}, {'start': 'yesterday'},
+                       {'start': '2024-02-01', 'end': '2024-01-01'}, {'start': '1900-01-01'},
+                       {'end': '9999-12-31'}, {'start': '9999-12-01', 'end': '9999-12-31', 'granularity': 'month'},
+                       {'end': '0001-01-05'}):
+            self.assertEqual(self.client.get(reverse('tracker_series'), params).status_code, 400)
+
+    def test_migration_backfills_existing_history(self):
+        self.seed()
+        incremental = self.snapshot()
+        for model in (UserDailySavings, UserMonthlySavings, GlobalDailySavings):
+            model.objects.all().delete()
+
+        import_module('app.migrations.0007_savings_rollups').backfill_rollups(django_apps, None)
+        self.assertEqual(self.snapshot(), incremental)
+
+
+class CommunityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f'member-{i}') for i in range(4)]
+
+    def record(self, user, co2):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_devices(user, [{'class': 'Monitor', 'device_co2': co2, 'device_kwh': 1}])
+
+    def test_totals_and_leaderboard(self):
+        for user, co2 in zip(self.users, (50, 400, 120, 400)):
+            self.record(user, co2)
+        UserTracker.objects.create(user_id=User.objects.create_user('lurker'))
+
+        snapshot = community_snapshot(3)
+        self.assertEqual(snapshot['totals'], {'devices': 4, 'co2': 970, 'kwh': 4})
+        self.assertEqual(
+            [(leader['rank'], leader['username']) for leader in snapshot['leaderboard']],
+            [(1, 'member-1'), (2, 'member-3'), (3, 'member-2')]
+        )
+
+    def test_cached_until_next_device(self):
+        self.record(self.users[0], 10)
+        community_snapshot()
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = community_snapshot()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(snapshot['totals']['co2'], 10)
+
+        self.record(self.users[1], 25)
+        self.assertEqual(community_snapshot()['totals']['co2'], 35)
+        self.assertEqual(community_snapshot()['leaderboard'][0]['username'], 'member-1')
+
+    def test_snapshot_queries_do_not_grow_with_users(self):
+        User.objects.bulk_create([User(username=f'bulk-{i}', password='!') for i in range(200)])
+        UserTracker.objects.bulk_create([
+            UserTracker(user_id=user, total_devices=1, total_co2=i + 1, total_kwh=1)
+            for i, user in enumerate(User.objects.filter(username__startswith='bulk-'))
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = community_snapshot(5)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(snapshot['leaderboard']), 5)
+        # Only the shards are summed, never the trackers
+        self.assertEqual(
+            [query['sql'] for query in queries if 'SUM(' in query['sql'].upper()],
+            [query['sql'] for query in queries if 'app_communitytotals' in query['sql']]
+        )
+
+    @override_settings(COMMUNITY_TOTALS_SHARDS=2)
+    def test_totals_are_sharded_by_user(self):
+        for user, co2 in zip(self.users, (50, 400, 120, 400)):
+            self.record(user, co2)
+        shards = dict(CommunityTotals.objects.values_list('shard', 'co2'))
+        self.assertEqual(set(shards), {0, 1})
+        self.assertEqual(sum(shards.values()), 970)
+        self.assertEqual(community_snapshot()['totals'], {'devices': 4, 'co2': 970, 'kwh': 4})
+
+    def test_pages(self):
+        self.record(self.users[2], 99)
+        self.assertContains(self.client.get(reverse('community')), 'member-2')
+        data = self.client.get(reverse('community_stats'), {'limit': 1000}).json()
+        self.assertEqual(data['totals']['co2'], 99)
+        self.assertEqual(len(data['leaderboard']), 1)
+
+
+class TrackerCacheTests(TransactionTestCase):
+    # Real commits, so invalidation runs exactly as it does in production
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cached', password='pw')
+        self.client.force_login(self.user)
+
+    def track(self, name, co2):
+        return self.client.post(
+            reverse('update_tracker'),
+            json.dumps({'action': 'dispose_reuse', 'device_name': name, 'device_co2': co2, 'device_kwh': 1}),
+            content_type='application/json'
+        ).json()
+
+    def tracker_queries(self, queries):
+        return [q['sql'] for q in queries.captured_queries if 'app_usertracker' in q['sql'] or 'app_devicetracker' in q['sql']]
+
+    def test_repeat_visit_only_reads_the_version(self):
+        self.track('Laptop', 300)
+        self.client.get(reverse('tracker'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('tracker'))
+        self.assertContains(response, 'Laptop')
+        sql = self.tracker_queries(queries)
+        self.assertEqual(len(sql), 1)
+        self.assertIn('"version"', sql[0])
+        self.assertNotIn('app_devicetracker', sql[0])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_revalidation_returns_304_until_a_write(self):
+        self.track('Laptop', 300)
+        first = self.client.get(reverse('tracker'))
+        etag, last_modified = first['ETag'], first['Last-Modified']
+
+        self.assertEqual(self.client.get(reverse('tracker'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('tracker'), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.track('Phone', 70)
+        response = self.client.get(reverse('tracker'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Phone')
+
+    def test_never_stale_after_write(self):
+        for i in range(1, 6):
+            self.client.get(reverse('tracker'))
+            self.assertEqual(self.track(f'Device {i}', 10)['total_devices'], i)
+            response = self.client.get(reverse('tracker'))
+            self.assertEqual(response.context['tracker'].total_devices, i)
+            self.assertContains(response, f'Device {i}')
+
+    def test_version_is_shared_without_the_cache(self):
+        # Another worker's cache never saw this write; the ETag still changes
+        self.track('Laptop', 300)
+        etag = self.client.get(reverse('tracker'))['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('tracker'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.track('Phone', 70)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('tracker'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_users_do_not_share_entries(self):
+        self.track('Laptop', 300)
+        self.client.get(reverse('tracker'))
+        other = User.objects.create_user('neighbour', password='pw')
+        self.client.force_login(other)
+        response = self.client.get(reverse('tracker'))
+        self.assertEqual(response.context['tracker'].total_devices, 0)
+        self.assertNotContains(response, 'Laptop')
+
+
+class DatabaseProfileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        patcher = mock.patch('app.routers.replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marked_reads_of_app_models_go_to_the_replica(self):
+        self.assertIsNone(self.router.db_for_read(UserTracker))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(UserTracker), 'replica')
+            self.assertEqual(self.router.db_for_read(DeviceTracker), 'replica')
+            # Sessions and users stay on the primary
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertEqual(self.router.db_for_write(UserTracker), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'app'))
+        self.assertIsNone(self.router.allow_migrate('default', 'app'))
+
+    def test_read_from_replica_decorator(self):
+        def view(request):
+            return self.router.db_for_read(DeviceTracker)
+
+        self.assertEqual(read_from_replica()(view)(None), 'replica')
+        self.assertIsNone(read_from_replica(primary_if=lambda request: True)(view)(None))
+
+    def test_writers_read_from_the_primary_until_the_replica_catches_up(self):
+        user = User.objects.create_user('writer')
+        with self.captureOnCommitCallbacks(execute=True):
+            record_devices(user, [{'class': 'Laptop', 'device_co2': 300, 'device_kwh': 50}])
+        self.assertTrue(tracker_recently_written(user.pk))
+        with override_settings(DB_REPLICA_MAX_LAG=0):
+            self.assertFalse(tracker_recently_written(user.pk))
+
+    def test_sqlite_connection_profile(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite connection profile")
+        connection.ensure_connection()
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+
+
+class CenterIndexTests(TestCase):
+    def brute_force(self, centers, lat, lon, k, accepts=None):
+        matches = [c for c in centers if accepts is None or accepts in c[5]]
+        return [c[0] for c in sorted(matches, key=lambda c: haversine_km(lat, lon, c[3], c[4]))[:k]]
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(7)
+        centers = [
+            (i, f'Center {i}', '', rng.uniform(-90, 90), rng.uniform(-180, 180),
+             rng.sample(EwasteCenter.CATEGORIES, 2), '')
+            for i in range(600)
+        ]
+        index = CenterIndex(centers)
+        # Includes points by the poles and either side of the antimeridian
+        queries = [(89.9, 0), (-89.9, 45), (10, 179.9), (10, -179.9)]
+        queries += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(30)]
+        for lat, lon in queries:
+            for accepts in (None, 'batteries'):
+                found = [center['id'] for center in index.nearest(lat, lon, 7, accepts)]
+                self.assertEqual(found, self.brute_force(centers, lat, lon, 7, accepts))
+
+    def test_distances_and_unknown_category(self):
+        index = CenterIndex([
+            (1, 'Near', '', 40.0, -75.0, ['phones'], ''),
+            (2, 'Far', '', 41.0, -75.0, ['Batteries'], ''),
+        ])
+        near, far = index.nearest(40.0, -75.0, 5)
+        self.assertEqual((near['name'], near['distance_km']), ('Near', 0))
+        self.assertAlmostEqual(far['distance_km'], 111.2, places=1)
+        self.assertEqual([c['name'] for c in index.nearest(40.0, -75.0, 5, 'BATTERIES')], ['Far'])
+        self.assertEqual(index.nearest(40.0, -75.0, 5, 'furniture'), [])
+        self.assertEqual(CenterIndex([]).nearest(0, 0, 3), [])
+
+
+@override_settings(FINDER_INDEX_BACKGROUND_REFRESH=False)
+class FinderNearestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def add_center(self, name, lat, lon, accepts):
+        with self.captureOnCommitCallbacks(execute=True):
+            return EwasteCenter.objects.create(name=name, latitude=lat, longitude=lon, accepts=accepts)
+
+    def nearest(self, **params):
+        return self.client.get(reverse('finder_nearest'), params)
+
+    def test_nearest_with_filter(self):
+        self.add_center('Downtown Drop-off', 37.78, -122.41, ['phones', 'computers'])
+        self.add_center('Battery Bin', 37.80, -122.27, ['batteries'])
+        self.add_center('Across Town', 37.33, -121.89, ['phones'])
+
+        data = self.nearest(lat=37.77, lon=-122.42, k=2).json()
+        self.assertEqual([c['name'] for c in data['centers']], ['Downtown Drop-off', 'Battery Bin'])
+        self.assertLess(data['centers'][0]['distance_km'], 2)
+
+        data = self.nearest(lat=37.77, lon=-122.42, accepts='batteries').json()
+        self.assertEqual([c['name'] for c in data['centers']], ['Battery Bin'])
+
+    def test_index_follows_changes(self):
+        center = self.add_center('Old Spot', 51.5, -0.12, ['tvs'])
+        self.assertEqual(len(self.nearest(lat=51.5, lon=-0.12).json()['centers']), 1)
+
+        self.add_center('New Spot', 51.51, -0.13, ['tvs'])
+        with self.captureOnCommitCallbacks(execute=True):
+            center.delete()
+        self.assertEqual([c['name'] for c in self.nearest(lat=51.5, lon=-0.12).json()['centers']], ['New Spot'])
+
+    def test_cached_index_needs_no_queries(self):
+        self.add_center('Old Spot', 51.5, -0.12, ['tvs'])
+        self.nearest(lat=51.5, lon=-0.12)
+        with CaptureQueriesContext(connection) as queries:
+            self.nearest(lat=51.5, lon=-0.12)
+        # Only the version check, which every worker shares
+        self.assertEqual(len(queries), 1)
+        self.assertIn('app_dataversion', queries[0]['sql'])
+        self.assertIs(live_index.get(), live_index.get())
+
+    def test_warm_builds_the_index_in_the_background(self):
+        index = LiveCenterIndex()
+        with override_settings(FINDER_INDEX_PRELOAD=False):
+            index.warm()
+        self.assertIsNone(index._index)
+
+        index.warm()
+        deadline = time.monotonic() + 5
+        while index._refreshing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(index._index)
+        with CaptureQueriesContext(connection) as queries:
+            index.get()
+        self.assertEqual(len(queries), 1)
+
+    def test_invalid_parameters(self):
+        for params in ({}, {'lat': 'north', 'lon': 0}, {'lat': 91, 'lon': 0}, {'lat': 0, 'lon': 200},
+                       {'lat': 0, 'lon': 0, 'k': 'many'}, {'lat': 'nan', 'lon': 0}):
+            self.assertEqual(self.nearest(**params).status_code, 400)
+
+
+class ImportCentersTests(TestCase):
+    CSV = (
+        "Site_Name,Lat,Lng,Address,Materials,URL\n"
+        "Green Depot,40.7128,-74.0060,1 Main St,Phones; Batteries,greendepot.example\n"
+        "Green  Depot ,40.71281,-74.00601,1 Main St,Phones; Batteries,greendepot.example\n"
+        "No Coordinates,,,,,\n"
+        "Off The Map,123,0,,,\n"
+        "Recycle Hub,34.05,-118.24,,Computers,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, content):
+        path = f'{self.tmpdir.name}/{name}'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_centers', path, stdout=out, stderr=err, batch_size=2, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_validates_and_dedupes(self):
+        out, err = self.run_import(self.write('centers.csv', self.CSV))
+        self.assertIn('5 rows', out)
+        self.assertIn('2 created', out)
+        self.assertIn('1 duplicates, 2 invalid', out)
+        self.assertIn('coordinates out of range', err)
+
+        depot = EwasteCenter.objects.get(name='Green Depot')
+        self.assertEqual(depot.accepts, ['batteries', 'phones'])
+        self.assertEqual(depot.website, 'https://greendepot.example')
+        self.assertEqual(depot.dedupe_key, EwasteCenter.make_dedupe_key('Green Depot', 40.7128, -74.006))
+
+    def test_reimport_touches_only_changed_rows(self):
+        path = self.write('centers.csv', self.CSV)
+        self.run_import(path)
+        before = dict(EwasteCenter.objects.values_list('name', 'updated_at'))
+
+        out, _ = self.run_import(path)
+        self.assertIn('0 created, 0 updated, 2 unchanged', out)
+
+        self.write('centers.csv', self.CSV.replace('Computers', 'Computers|TVs'))
+        with CaptureQueriesContext(connection) as queries:
+            out, _ = self.run_import(path)
+        self.assertIn('0 created, 1 updated, 1 unchanged', out)
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "app_ewastecenter"')]), 1)
+        self.assertEqual(EwasteCenter.objects.get(name='Recycle Hub').accepts, ['computers', 'tvs'])
+        self.assertEqual(EwasteCenter.objects.get(name='Green Depot').updated_at, before['Green Depot'])
+        self.assertEqual(EwasteCenter.objects.count(), 2)
+
+    @override_settings(FINDER_INDEX_BACKGROUND_REFRESH=False)
+    def test_import_changes_the_version_every_process_sees(self):
+        path = self.write('centers.csv', self.CSV)
+        # A worker that loaded the finder index before the import ran elsewhere
+        worker = LiveCenterIndex()
+        self.assertEqual(len(worker.get()), 0)
+        before = centers_version()
+
+        # Held in the database, not in any one process's cache
+        cache.clear()
+        self.assertEqual(centers_version(), before)
+
+        self.run_import(path)
+        self.assertNotEqual(centers_version(), before)
+        self.assertEqual(len(worker.get()), 2)
+
+        version = centers_version()
+        self.run_import(path)
+        self.assertEqual(centers_version(), version)
+
+    def test_matches_centers_added_by_hand(self):
+        EwasteCenter.objects.create(name='Recycle Hub', latitude=34.05, longitude=-118.24)
+        out, _ = self.run_import(self.write('centers.csv', self.CSV))
+        self.assertIn('1 created, 1 updated', out)
+        self.assertEqual(EwasteCenter.objects.count(), 2)
+
+    def test_geojson_formats(self):
+        features = [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-0.1276, 51.5072]},
+             'properties': {'name': 'London Drop', 'accepts': ['Cables', 'TVs']}},
+            {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': []}, 'properties': {'name': 'Area'}},
+        ]
+        collection = json.dumps({'type': 'FeatureCollection', 'name': 'sites', 'features': features}, indent=1)
+        out, _ = self.run_import(self.write('sites.geojson', collection))
+        self.assertIn('1 created', out)
+        self.assertIn('1 invalid', out)
+        self.assertEqual(EwasteCenter.objects.get().accepts, ['cables', 'tvs'])
+
+        lines = '\n'.join(json.dumps(feature) for feature in features)
+        out, _ = self.run_import(self.write('sites.ndjson', lines))
+        self.assertIn('1 unchanged', out)
+
+    def test_geojson_reader_streams_across_chunks(self):
+        features = [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [i * 0.001, 12.5]},
+             'properties': {'name': f'Site {i}'}}
+            for i in range(50)
+        ]
+        text = json.dumps({'features': features, 'type': 'FeatureCollection', 'bbox': [0, 0, 1, 1]})
+        rows = list(read_geojson(io.StringIO(text), chunk_size=7))
+        self.assertEqual([row['name'] for _, row in rows], [f'Site {i}' for i in range(50)])
+        self.assertEqual(rows[-1][1]['longitude'], 0.049)
+
+        with self.assertRaises(ValueError):
+            list(read_geojson(io.StringIO('{"features": [{"type": "Feature"} {"type": "Feature"}]}')))
+
+    def test_import_refreshes_finder(self):
+        self.run_import(self.write('centers.csv', self.CSV))
+        with self.settings(FINDER_INDEX_BACKGROUND_REFRESH=False):
+            data = self.client.get(reverse('finder_nearest'), {'lat': 34, 'lon': -118, 'k': 1}).json()
+        self.assertEqual(data['centers'][0]['name'], 'Recycle Hub')
+
+
+@single_model
+class DeviceCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        result_cache.memory.clear()
+        self.user = User.objects.create_user('cataloguer', password='pw')
+
+    def add_entry(self, name, co2, kwh, aliases=(), samples=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            return DeviceCatalog.objects.create(
+                name=name, device_co2=co2, device_kwh=kwh, aliases=list(aliases), samples=samples
+            )
+
+    def test_matcher(self):
+        entries = [
+            DeviceCatalog(id=1, name='Laptop', aliases=['Notebook Computer'], device_co2=250, device_kwh=40),
+            DeviceCatalog(id=2, name='Smartphone', aliases=['Mobile Phone', 'Cell Phone'], device_co2=60, device_kwh=4),
+            DeviceCatalog(id=3, name='Laptop Charger', device_co2=5, device_kwh=0),
+        ]
+        matcher = CatalogMatcher(entries)
+        self.assertEqual(matcher.match('LAPTOP').id, 1)
+        self.assertEqual(matcher.match('a notebook-computer').id, 1)
+        self.assertEqual(matcher.match('Dell Laptop').id, 1)
+        self.assertEqual(matcher.match('Old Cell Phones').id, 2)
+        self.assertEqual(matcher.match('Laptop chargers').id, 3)
+        self.assertIsNone(matcher.match('Electric Toothbrush'))
+        self.assertIsNone(matcher.match(''))
+
+    def test_identification_uses_catalog_figures(self):
+        self.add_entry('Laptop', 250, 40, samples=10)
+        with mock.patch('app.identify.claude_client') as client_mock:
+            client_mock.messages.create.return_value = fake_message()
+            data = self.client.post(reverse('identify_predict'), {'image': upload()}).json()
+
+            self.assertEqual((data['class'], data['device_co2'], data['device_kwh']), ('Laptop', 250, 40))
+            # The catalog stays out of the prompt
+            prompt = client_mock.messages.create.call_args.kwargs['messages'][0]['content'][1]['text']
+            self.assertEqual(prompt, IDENTIFY_PROMPT)
+            # The cached payload keeps the model's own answer
+            self.assertEqual(IdentificationResult.objects.get().payload['device_co2'], 300)
+
+            # Catalog edits neither change the cache key nor need another call
+            self.add_entry('Smartphone', 60, 4)
+            renamed = self.client.post(reverse('identify_predict'), {'image': upload()}).json()
+            self.assertEqual(client_mock.messages.create.call_count, 1)
+            self.assertEqual(renamed['class'], 'Laptop')
+
+    def test_catalog_version_is_shared_through_the_database(self):
+        record_devices(self.user, [{'class': 'Laptop', 'device_co2': 300, 'device_kwh': 50}])
+        before = catalog_version()
+        # A process whose cache never saw anything agrees on the version
+        cache.clear()
+        self.assertEqual(catalog_version(), before)
+
+        self.add_entry('Laptop', 250, 40)
+        self.assertNotEqual(catalog_version(), before)
+        rows, _ = record_devices(self.user, [{'class': 'Laptop', 'device_co2': 300, 'device_kwh': 50}])
+        self.assertEqual((rows[0].device_co2, rows[0].device_kwh), (250, 40))
+
+    def test_stream_sends_catalog_figures_first(self):
+        self.add_entry('Laptop', 250, 40)
+        events = list(catalog_events([
+            ('device', {'class': 'Gaming Laptop'}), ('device_co2', {'device_co2': 999}),
+            ('device_kwh', {'device_kwh': 999}), ('disposal', {'line': '- Recycle'}),
+        ]))
+        self.assertEqual(events, [
+            ('device', {'class': 'Laptop'}), ('device_co2', {'device_co2': 250}),
+            ('device_kwh', {'device_kwh': 40}), ('disposal', {'line': '- Recycle'}),
+        ])
+
+    def test_tracker_records_catalog_figures(self):
+        entry = self.add_entry('Smartphone', 60, 4, aliases=['Cell Phone'])
+        rows, totals = record_devices(self.user, [
+            {'class': 'cell phone', 'device_co2': 500, 'device_kwh': 500},
+            {'class': 'Toaster', 'device_co2': 20, 'device_kwh': 30},
+        ])
+        self.assertEqual([(r.device_name, r.catalog_id) for r in rows], [('Smartphone', entry.id), ('Toaster', None)])
+        self.assertEqual((totals['total_co2'], totals['total_kwh']), (80, 34))
+
+    def test_seed_from_history(self):
+        history = [('Laptop', 300, 50), ('laptop', 200, 40), ('Laptop', 260, 45), ('Laptop ', 9000, 45),
+                   ('Tablet', 100, 10), ('Tablet', 120, 12), ('Smart Phone', 70, 5)] + [('Smartphones', 60, 4)] * 3
+        DeviceTracker.objects.bulk_create([
+            DeviceTracker(user=self.user, device_name=name, device_co2=co2, device_kwh=kwh)
+            for name, co2, kwh in history
+        ])
+        phone = self.add_entry('Smartphone', 55, 3, aliases=['Smart Phone'])
+
+        report = seed_from_history(min_samples=3, dry_run=True)
+        self.assertEqual(DeviceCatalog.objects.count(), 1)
+        self.assertEqual([(item['action'], item['name']) for item in report],
+                         [('created', 'Laptop'), ('extended', 'Smartphone')])
+
+        out = io.StringIO()
+        call_command('seed_catalog', stdout=out)
+        laptop = DeviceCatalog.objects.get(name='Laptop')
+        self.assertEqual((laptop.device_co2, laptop.device_kwh, laptop.samples), (260, 45, 4))
+        self.assertEqual(laptop.aliases, ['Laptop ', 'laptop'])
+        phone.refresh_from_db()
+        self.assertEqual((phone.aliases, phone.device_co2, phone.samples), (['Smart Phone', 'Smartphones'], 55, 3))
+        self.assertEqual(DeviceTracker.objects.filter(catalog=laptop).count(), 4)
+        self.assertFalse(DeviceCatalog.objects.filter(name='Tablet').exists())
+        self.assertIn('1 entries created, 1 extended', out.getvalue())
@@ -0,0 +1,182 @@
+import base64
+import sqlite3
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import UserTracker, DeviceTracker
+from .parsing import NO_DEVICE
+from .catalog import live_catalog
+from .community import invalidate_community
+from .rollups import add_to_rollups
+
+TOTAL_FIELDS = ('total_devices', 'total_co2', 'total_kwh')
+
+
+def _supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)
+
+
+def _add_to_totals(user, devices, co2, kwh, version):
+    """Increment a user's totals, set its version and return the new totals.
+
+    Increments are applied by the database, so concurrent writers never
+    lose updates. Uses ``UPDATE ... RETURNING`` where available so the new
+    totals come back in the same statement. Returns None if the user has
+    no tracker row yet.
+    """
+    if not _supports_update_returning():
+        if not UserTracker.objects.filter(user_id=user).update(
+            total_devices=F('total_devices') + devices,
+            total_co2=F('total_co2') + co2,
+            total_kwh=F('total_kwh') + kwh,
+            version=version
+        ):
+            return None
+        return UserTracker.objects.filter(user_id=user).values(*TOTAL_FIELDS).get()
+
+    quote = connection.ops.quote_name
+    columns = [quote(name) for name in TOTAL_FIELDS]
+    assignments = ', '.join(f'{column} = {column} + %s' for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(UserTracker._meta.db_table)} SET {assignments}, {quote(UserTracker._meta.get_field('version').column)} = %s "
+            f"WHERE {quote(UserTracker._meta.get_field('user_id').column)} = %s "
+            f"RETURNING {', '.join(columns)}",
+            [devices, co2, kwh, version, user.pk]
+        )
+        row = cursor.fetchone()
+    return dict(zip(TOTAL_FIELDS, row)) if row else None
+
+
+def record_devices(user, devices):
+    """Add identified devices to a user's history and totals in one transaction.
+
+    ``devices`` is an iterable of payload-like dicts with ``class``,
+    ``device_co2`` and ``device_kwh``; "No Device Detected" entries are
+    skipped, and devices matching the catalog take its name and figures.
+    Totals are incremented with a single UPDATE (the tracker row is
+    created on first use), history rows with a single INSERT, and the
+    daily and monthly rollups in the same transaction.
+    Returns the created ``DeviceTracker`` rows and the user's new totals,
+    or ``([], None)`` when there was nothing to record.
+    """
+    now = timezone.now()
+    catalog = live_catalog.get()
+    rows = []
+    for device in devices:
+        if not device.get('class') or device['class'] == NO_DEVICE:
+            continue
+        row = DeviceTracker(
+            user=user,
+            created_at=now,
+            device_name=device['class'],
+            device_co2=int(device.get('device_co2') or 0),
+            device_kwh=int(device.get('device_kwh') or 0)
+        )
+        # Catalogued devices always count with the catalog's figures
+        entry = catalog.match(row.device_name)
+        if entry is not None:
+            row.catalog_id = entry.id
+            row.device_name, row.device_co2, row.device_kwh = entry.name, entry.device_co2, entry.device_kwh
+        rows.append(row)
+
+    if not rows:
+        return [], None
+
+    count = len(rows)
+    co2 = sum(row.device_co2 for row in rows)
+    kwh = sum(row.device_kwh for row in rows)
+
+    # Other workers see the new version only once the rows it covers commit
+    version = time.time_ns()
+    with transaction.atomic():
+        totals = _add_to_totals(user, count, co2, kwh, version)
+        if totals is None:
+            try:
+                with transaction.atomic():
+                    UserTracker.objects.create(
+                        user_id=user, total_devices=count, total_co2=co2, total_kwh=kwh, version=version
+                    )
+                totals = {'total_devices': count, 'total_co2': co2, 'total_kwh': kwh}
+            except IntegrityError:
+                # Another request created the tracker first
+                totals = _add_to_totals(user, count, co2, kwh, version)
+        DeviceTracker.objects.bulk_create(rows)
+        add_to_rollups(user, now, count, co2, kwh)
+        transaction.on_commit(invalidate_community)
+    return rows, totals
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; raises ValueError for malformed cursors."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def device_history(user, cursor=None, name=None, limit=25):
+    """One page of a user's tracked devices, newest first.
+
+    Keyset pagination on ``(created_at, id)`` walks the
+    ``(user, created_at)`` index, so every page costs the same however
+    deep it is. Returns the rows and the cursor for the next page (None on
+    the last page).
+    """
+    devices = DeviceTracker.objects.filter(user=user)
+    if name:
+        devices = devices.filter(device_name__icontains=name)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        devices = devices.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    rows = list(devices.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+    return rows, next_cursor
+
+
+def tracker_version(user_id):
+    """Nanosecond timestamp of the user's last tracked device, 0 before the first.
+
+    Read from the tracker row rather than a cache, so a write on one
+    worker changes the version every other worker serves.
+    """
+    return UserTracker.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def tracker_last_modified(user_id, version=None):
+    version = tracker_version(user_id) if version is None else version
+    return datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc) if version else None
+
+
+def tracker_recently_written(user_id, version=None):
+    # Whether a replica might not have the user's last write yet
+    version = tracker_version(user_id) if version is None else version
+    return time.time_ns() - version < settings.DB_REPLICA_MAX_LAG * 1e9
+
+
+def tracker_context(user, version=None):
+    """The tracker page's totals and first history page, cached per user version."""
+    version = tracker_version(user.pk) if version is None else version
+    key = f'tracker:{user.pk}:{version}:context'
+    context = cache.get(key)
+    if context is None:
+        tracker, _ = UserTracker.objects.get_or_create(user_id=user)
+        devices, next_cursor = device_history(user, limit=settings.TRACKER_PAGE_SIZE)
+        context = {'tracker': tracker, 'devices': devices, 'next_cursor': next_cursor}
+        cache.set(key, context, settings.TRACKER_CACHE_TTL)
+    return context
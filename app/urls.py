@@ -5,9 +5,26 @@ urlpatterns = [
     path("", views.identify_view, name="identify"),
     path("tracker/", views.tracker_view, name="tracker"),
     path("finder/", views.finder_view, name="finder"),
+    path("finder/nearest/", views.finder_nearest, name="finder_nearest"),
+    path("community/", views.community_view, name="community"),
+    path("community/stats/", views.community_stats, name="community_stats"),
     path("login/", views.login_view, name="login"),
     path("signup/", views.signup_view, name="signup"),
     path('logout/', views.logout_view, name='logout'),
     path('identify/predict/', views.identify_predict, name='identify_predict'),
+    path('identify/predict/async/', views.identify_predict_async, name='identify_predict_async'),
+    path('identify/predict/stream/', views.identify_predict_stream, name='identify_predict_stream'),
+    path('identify/batch/', views.identify_predict_batch, name='identify_predict_batch'),
+    path('identify/jobs/', views.identify_job_submit, name='identify_job_submit'),
+    path('identify/jobs/stats/', views.identify_job_stats, name='identify_job_stats'),
+    path('identify/jobs/<uuid:job_id>/', views.identify_job_status, name='identify_job_status'),
+    path('identify/cache/stats/', views.identify_cache_stats, name='identify_cache_stats'),
+    path('tracker/history/', views.tracker_history, name='tracker_history'),
+    path('tracker/history/rows/', views.tracker_history_rows, name='tracker_history_rows'),
+    path('tracker/series/', views.tracker_series, name='tracker_series'),
+    path('tracker/export/', views.tracker_export, name='tracker_export'),
+    path('tracker/export/all/', views.tracker_export_all, name='tracker_export_all'),
     path('update-tracker/', views.update_tracker, name='update_tracker'),
+    path('health/', views.health, name='health'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+import time
+from django.db import IntegrityError, transaction
+from .models import DataVersion
+
+
+def data_version(name):
+    # 0 until the dataset first changes
+    return DataVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def bump_version(name):
+    """Mark the dataset ``name`` as changed.
+
+    Call inside the transaction that changes it. The new version is a
+    timestamp rather than a counter, so it never repeats one that a
+    rolled-back transaction briefly made visible.
+    """
+    version = time.time_ns()
+    if DataVersion.objects.filter(name=name).update(version=version):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(name=name, version=version)
+    except IntegrityError:
+        # Another transaction added the row first
+        DataVersion.objects.filter(name=name).update(version=version)
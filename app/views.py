@@ -3,175 +3,79 @@ from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from PIL import Image
-import base64
 import io
-from .models import UserTracker, DeviceTracker
+import math
+from datetime import date, timedelta
+from django.utils import timezone
+from .models import IdentificationJob, EwasteCenter
+from .imaging import SUPPORTED_MEDIA_TYPES, normalization_stats
+from .identify import aidentify_image, identify_batch, identify_devices, identify_image, stream_identification
+from .breaker import CircuitOpenError, claude_breaker
+from .cascade import cascade_stats
+from .metrics import render as render_metrics, stage
+from .parsing import parse_stats
+from .result_cache import result_cache
+from .singleflight import single_flight
+from .tracking import (
+    device_history, record_devices, tracker_context, tracker_last_modified, tracker_recently_written, tracker_version
+)
+from .rollups import savings_series
+from .routers import read_from_replica
+from .community import community_snapshot
+from .spatial import live_index
+from . import exports, jobs
 import json
+from django.middleware.csrf import CsrfViewMiddleware
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition, require_http_methods
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import DatabaseError, connection
 import anthropic
 
-# Initialize Claude client
-claude_client = anthropic.Anthropic(api_key=settings.CLAUDE_API_KEY)
-
 def identify_view(request):
-    return render(request, "identify.html")
+    # How the page encodes captures before upload, matching the server's normalization
+    capture = {
+        'maxEdge': settings.IMAGE_MAX_EDGE,
+        'type': 'image/webp' if settings.IMAGE_FORMAT.upper() == 'WEBP' else 'image/jpeg',
+        'quality': settings.IMAGE_QUALITY / 100,
+        'maxBytes': settings.CAPTURE_MAX_BYTES,
+        'acceptedTypes': sorted(SUPPORTED_MEDIA_TYPES),
+    }
+    return render(request, "identify.html", {'capture': capture})
+
+def _unavailable(error):
+    # Fail fast while the Claude circuit breaker is open
+    response = JsonResponse({'error': _error_message(error), 'retry_after': round(error.retry_after)}, status=503)
+    response['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response
 
 @csrf_exempt
 def identify_predict(request):
     if request.method == 'POST' and request.FILES.get('image'):
         try:
             image_file = request.FILES['image']
-            
-            # Convert image to base64 for Claude API
-            image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
+            with stage('read_upload'):
+                image_data = image_file.read()
+
             # Determine image type
             image_type = image_file.content_type
             if not image_type.startswith('image/'):
                 return JsonResponse({'error': 'Invalid image format'})
-            
-            # Create message for Claude API
-            message = claude_client.messages.create(
-                model="claude-3-5-sonnet-20241022",  # or claude-3-opus-20240229 for higher accuracy
-                max_tokens=2000,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": image_type,
-                                    "data": image_base64
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": """Identify the electronic device or component in this image and provide comprehensive e-waste guidance. It is crucial that you only identify devices that are electronic. If the item in the image is not an electronic device (e.g., furniture, clothing, non-electronic household items), you must respond with "No Device Detected" for the device name.
-
-Please format your response EXACTLY as follows:
-
-DEVICE: [Name of the electronic device/component]
-DEVICE_CO2: [Estimated CO2 emissions for manufacturing this device in kg, as an integer]
-DEVICE_KWH: [Estimated kWh of electricity consumed by this device annually, as an integer]
-
-DISPOSAL:
-[Provide 3-5 bullet points on how to properly dispose of this device, including:
-- E-waste recycling centers
-- Manufacturer take-back programs
-- Retail drop-off locations
-- Special handling requirements (if any)
-- Environmental considerations]
-
-REUSE IDEAS:
-1. [Creative reuse idea #1]
-2. [Creative reuse idea #2]
-3. [Creative reuse idea #3]
-4. [Creative reuse idea #4]
-5. [Creative reuse idea #5]
-
-Focus on practical, safe, and creative ways to repurpose the device or its components. Consider both functional reuses and artistic/decorative purposes. If the device is still functional, prioritize extending its useful life. If it's broken, think about how individual components could be repurposed.
-
-If you cannot clearly identify the device, provide your best assessment and general e-waste guidance, and set CO2 and KWH to 0. If no device is detected, or if the item is not an electronic device, respond with "No Device Detected" for the device name and set all other fields to 0 or empty."""
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            # Extract the response from Claude
-            full_response = message.content[0].text.strip()
-            
-            # Parse the structured response
-            device_name = "Unknown Device"
-            device_co2 = 0
-            device_kwh = 0
-            disposal_info = ""
-            reuse_ideas = ""
-            
-            try:
-                # Split the response into sections
-                sections = full_response.split('\n')
-                current_section = None
-                disposal_lines = []
-                reuse_lines = []
-                
-                for line in sections:
-                    line = line.strip()
-                    if line.startswith('DEVICE:'):
-                        device_name = line.replace('DEVICE:', '').strip()
-                    elif line.startswith('DEVICE_CO2:'):
-                        try:
-                            device_co2_str = line.replace('DEVICE_CO2:', '').strip().split(' ')[0]
-                            device_co2 = int(device_co2_str)
-                        except (ValueError, TypeError):
-                            device_co2 = 0
-                    elif line.startswith('DEVICE_KWH:'):
-                        try:
-                            device_kwh_str = line.replace('DEVICE_KWH:', '').strip().split(' ')[0]
-                            device_kwh = int(device_kwh_str)
-                        except (ValueError, TypeError):
-                            device_kwh = 0
-                    elif line.startswith('DISPOSAL:'):
-                        current_section = 'disposal'
-                    elif line.startswith('REUSE IDEAS:'):
-                        current_section = 'reuse'
-                    elif line and current_section == 'disposal':
-                        disposal_lines.append(line)
-                    elif line and current_section == 'reuse':
-                        reuse_lines.append(line)
-                
-                disposal_info = '\n'.join(disposal_lines)
-                reuse_ideas = '\n'.join(reuse_lines)
-                
-            except Exception as parse_error:
-                # If parsing fails, extract device name from the beginning
-                lines = full_response.split('\n')
-                if lines:
-                    first_line = lines[0].strip()
-                    if 'DEVICE:' in first_line:
-                        device_name = first_line.replace('DEVICE:', '').strip()
-                    else:
-                        # Fallback: take first few words as device name
-                        words = first_line.split()
-                        device_name = ' '.join(words[:4]) if len(words) > 4 else first_line
-            
-            # Clean up device name
-            prefixes_to_remove = [
-                "This is a ", "This appears to be a ", "I can see a ", 
-                "The image shows a ", "This looks like a ", "I identify this as a "
-            ]
-            
-            for prefix in prefixes_to_remove:
-                if device_name.lower().startswith(prefix.lower()):
-                    device_name = device_name[len(prefix):].strip()
-            
-            # Remove parenthetical text
-            device_name = device_name.split('(')[0].strip()
 
-            # Capitalize first letter
-            if device_name:
-                device_name = device_name[0].upper() + device_name[1:] if len(device_name) > 1 else device_name.upper()
-
-            if device_name == "No Device Detected":
-                return JsonResponse({'class': device_name})
+            # Every device in the photo, e.g. a whole bin, from one call
+            if request.POST.get('mode') == 'multi':
+                return JsonResponse(identify_devices(image_data, image_type))
 
-            return JsonResponse({
-                'class': device_name,
-                'full_response': full_response,
-                'disposal_info': disposal_info,
-                'reuse_ideas': reuse_ideas,
-                'device_co2': device_co2,
-                'device_kwh': device_kwh
-            })
+            return JsonResponse(identify_image(image_data, image_type))
             
+        except CircuitOpenError as e:
+            return _unavailable(e)
         except anthropic.BadRequestError as e:
             return JsonResponse({'error': f'Claude API error: {str(e)}'})
         except anthropic.RateLimitError as e:
@@ -183,35 +87,373 @@ If you cannot clearly identify the device, provide your best assessment and gene
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+def _read_upload(request):
+    # Parsing multipart bodies and reading spooled uploads is blocking I/O
+    with stage('read_upload'):
+        image_file = request.FILES.get('image')
+        if image_file is None:
+            return None, None
+        return image_file.read(), image_file.content_type
+
+@csrf_exempt
+async def identify_predict_async(request):
+    if request.method == 'POST':
+        image_data, image_type = await sync_to_async(_read_upload, thread_sensitive=False)(request)
+        if image_data is None:
+            return JsonResponse({'error': 'Invalid request'}, status=400)
+        try:
+            if not image_type.startswith('image/'):
+                return JsonResponse({'error': 'Invalid image format'})
+
+            return JsonResponse(await aidentify_image(image_data, image_type))
+
+        except CircuitOpenError as e:
+            return _unavailable(e)
+        except anthropic.BadRequestError as e:
+            return JsonResponse({'error': f'Claude API error: {str(e)}'})
+        except anthropic.RateLimitError as e:
+            return JsonResponse({'error': 'Rate limit exceeded. Please try again later.'})
+        except anthropic.APIError as e:
+            return JsonResponse({'error': f'Claude API error: {str(e)}'})
+        except Exception as e:
+            return JsonResponse({'error': f'Unexpected error: {str(e)}'})
+
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+def _error_message(error):
+    if isinstance(error, CircuitOpenError):
+        return f'Identification is temporarily unavailable. Please try again in {max(1, round(error.retry_after))} seconds.'
+    if isinstance(error, anthropic.RateLimitError):
+        return 'Rate limit exceeded. Please try again later.'
+    if isinstance(error, anthropic.APIError):
+        return f'Claude API error: {str(error)}'
+    return f'Unexpected error: {str(error)}'
+
+def _csrf_failure(request):
+    # The CSRF check a csrf_exempt view skipped: None if the request passes
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def identify_predict_batch(request):
+    image_files = request.FILES.getlist('images')
+    if not image_files:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    if len(image_files) > settings.IDENTIFY_BATCH_MAX_IMAGES:
+        return JsonResponse({
+            'error': f'Too many images; the limit is {settings.IDENTIFY_BATCH_MAX_IMAGES} per batch'
+        }, status=400)
+
+    track = request.POST.get('track') in ('1', 'true')
+    if track and not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required to track devices'}, status=403)
+    # Identifying is open to other sites; writing to the user's tracker is not
+    if track and _csrf_failure(request) is not None:
+        return JsonResponse({'error': 'CSRF verification failed'}, status=403)
+
+    results = [{'index': i, 'filename': f.name} for i, f in enumerate(image_files)]
+    pending = []
+    for result, image_file in zip(results, image_files):
+        if image_file.content_type.startswith('image/'):
+            pending.append((result, (image_file.read(), image_file.content_type)))
+        else:
+            result['error'] = 'Invalid image format'
+
+    outcomes = identify_batch([image for _, image in pending])
+    for (result, _), (payload, error) in zip(pending, outcomes):
+        if error is not None:
+            result['error'] = _error_message(error)
+        else:
+            result['result'] = payload
+
+    response = {'results': results}
+    if track:
+        identified = [result['result'] for result in results if 'result' in result]
+        rows, _ = record_devices(request.user, identified)
+        response['tracked'] = len(rows)
+    return JsonResponse(response)
+
+def _job_response(job, status=200):
+    data = {'job_id': str(job.id), 'status': job.status, 'attempts': job.attempts}
+    if job.status == IdentificationJob.DONE:
+        data['result'] = job.result
+    elif job.status == IdentificationJob.FAILED:
+        data['error'] = job.error
+    return JsonResponse(data, status=status)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def identify_job_submit(request):
+    image_file = request.FILES.get('image')
+    if image_file is None:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    if not image_file.content_type.startswith('image/'):
+        return JsonResponse({'error': 'Invalid image format'})
+
+    job = jobs.submit(image_file.read(), image_file.content_type)
+    return _job_response(job, status=202)
+
+@require_http_methods(["GET"])
+def identify_job_status(request, job_id):
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = None
+    # NaN would never reach the polling deadline
+    if wait is None or not math.isfinite(wait):
+        return JsonResponse({'error': 'wait must be a number of seconds'}, status=400)
+    try:
+        job = jobs.wait_for(job_id, wait)
+    except IdentificationJob.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return _job_response(job)
+
+@staff_member_required
+def identify_job_stats(request):
+    return JsonResponse(jobs.queue_stats())
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _identification_events(image_data, image_type):
+    try:
+        for event, data in stream_identification(image_data, image_type):
+            yield _sse(event, data)
+    except Exception as e:
+        yield _sse('error', {'error': _error_message(e)})
+
+@csrf_exempt
+def identify_predict_stream(request):
+    if request.method == 'POST' and request.FILES.get('image'):
+        image_file = request.FILES['image']
+        image_type = image_file.content_type
+        if not image_type.startswith('image/'):
+            return JsonResponse({'error': 'Invalid image format'})
+
+        response = StreamingHttpResponse(
+            _identification_events(image_file.read(), image_type),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    return JsonResponse({'error': 'Invalid request'}, status=400)
+
+@never_cache
+def health(request):
+    # Liveness plus the state of our dependencies; only a dead database
+    # makes this instance unhealthy, since Claude outages degrade gracefully
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        database = 'ok'
+    except DatabaseError:
+        database = 'unavailable'
+    claude = claude_breaker.snapshot()
+    status = 'ok' if database == 'ok' and claude['state'] == 'closed' else 'degraded'
+    return JsonResponse({'status': status, 'database': database, 'claude': claude},
+                        status=200 if database == 'ok' else 503)
+
+@never_cache
+def metrics(request):
+    # Prometheus text exposition; guarded by a bearer token when one is set,
+    # and otherwise only open to staff outside DEBUG
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        allowed = request.headers.get('Authorization') == f'Bearer {settings.METRICS_TOKEN}'
+    else:
+        allowed = settings.DEBUG or request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def identify_cache_stats(request):
+    stats = result_cache.snapshot()
+    stats['single_flight'] = single_flight.snapshot()
+    stats['parser'] = parse_stats.snapshot()
+    stats['cascade'] = cascade_stats.snapshot()
+    stats['normalization'] = normalization_stats.snapshot()
+    return JsonResponse(stats)
+
+def _page_size(request):
+    try:
+        limit = int(request.GET.get('limit', settings.TRACKER_PAGE_SIZE))
+    except ValueError:
+        limit = settings.TRACKER_PAGE_SIZE
+    return max(1, min(limit, settings.TRACKER_MAX_PAGE_SIZE))
+
+def _tracker_version(request):
+    # One lookup per request, shared by the ETag, Last-Modified and replica checks
+    if not hasattr(request, '_tracker_version'):
+        request._tracker_version = tracker_version(request.user.pk)
+    return request._tracker_version
+
+def _tracker_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return f'{request.user.pk}-{_tracker_version(request)}'
+
+def _tracker_last_modified(request):
+    if not request.user.is_authenticated:
+        return None
+    return tracker_last_modified(request.user.pk, _tracker_version(request))
+
+def _tracker_recently_written(request):
+    return request.user.is_authenticated and tracker_recently_written(request.user.pk, _tracker_version(request))
+
+# Browsers must revalidate, which costs one version lookup and usually ends in a 304
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_tracker_etag, last_modified_func=_tracker_last_modified)
+@read_from_replica(primary_if=_tracker_recently_written)
 def tracker_view(request):
     # Initialize tracker data
-    tracker_data = None
-    devices = None
+    context = {'tracker': None, 'devices': None, 'next_cursor': None}
     
-    # If user is authenticated, get their tracker data
+    # If user is authenticated, get their tracker data (created on first visit)
     if request.user.is_authenticated:
-        try:
-            # Get the user's tracker
-            tracker_data = UserTracker.objects.get(user_id=request.user)
-            devices = DeviceTracker.objects.filter(user=request.user)
-        except UserTracker.DoesNotExist:
-            # Create a tracker if it doesn't exist
-            tracker_data = UserTracker.objects.create(
-                user_id=request.user,
-                total_devices=0,
-                total_co2=0,
-                total_kwh=0
-            )
+        with stage('tracker_context'):
+            context = tracker_context(request.user, _tracker_version(request))
     
-    # Pass the tracker data to the template
-    context = {
-        'tracker': tracker_data,
-        'devices': devices
-    }
     return render(request, "tracker.html", context=context)
 
+@login_required
+@require_http_methods(["GET"])
+def tracker_history(request):
+    try:
+        devices, next_cursor = device_history(
+            request.user, request.GET.get('cursor'), request.GET.get('q'), _page_size(request)
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'devices': [
+            {
+                'id': device.id,
+                'device_name': device.device_name,
+                'device_co2': device.device_co2,
+                'device_kwh': device.device_kwh,
+                'created_at': device.created_at.isoformat()
+            }
+            for device in devices
+        ],
+        'next_cursor': next_cursor
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def tracker_history_rows(request):
+    # Table rows for the tracker page's "load more" and name filter
+    try:
+        devices, next_cursor = device_history(
+            request.user, request.GET.get('cursor'), request.GET.get('q'), _page_size(request)
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = render(request, "tracker_rows.html", context={'devices': devices})
+    response['X-Next-Cursor'] = next_cursor or ''
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+def tracker_series(request):
+    # Chart data: savings per day, week or month for the user or the whole site
+    granularity = request.GET.get('granularity', 'day')
+    try:
+        end = date.fromisoformat(request.GET['end']) if 'end' in request.GET else timezone.localdate()
+        if 'start' in request.GET:
+            start = date.fromisoformat(request.GET['start'])
+        else:
+            start = end - timedelta(days=settings.TRACKER_SERIES_DEFAULT_DAYS - 1)
+        user = None if request.GET.get('scope') == 'global' else request.user
+        series = savings_series(user, granularity, start, end)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except OverflowError:
+        # Ranges touching the first or last representable date
+        return JsonResponse({'error': 'date out of range'}, status=400)
+
+    return JsonResponse({'granularity': granularity, 'series': series})
+
+def _export_response(request, user, name):
+    # ?format=csv|ndjson, data=devices|totals, start/end (ISO dates), device, gzip=1
+    export_format = request.GET.get('format', 'csv')
+    dataset = request.GET.get('data', 'devices')
+    try:
+        if export_format not in exports.CONTENT_TYPES:
+            raise ValueError(f"Unknown format: {export_format}")
+        if dataset not in exports.DATASETS:
+            raise ValueError(f"Unknown data: {dataset}")
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if dataset == 'devices':
+        columns, rows = exports.device_rows(user, start, end, request.GET.get('device'))
+    else:
+        columns, rows = exports.total_rows(user)
+    compress = request.GET.get('gzip') == '1'
+    filename = f'{name}-{dataset}.{export_format}' + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        exports.export_stream(columns, rows, export_format, compress),
+        content_type='application/gzip' if compress else exports.CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@never_cache
+@login_required
+@require_http_methods(["GET"])
+def tracker_export(request):
+    # The signed-in user's full history, streamed without loading it into memory
+    return _export_response(request, request.user, f'greenbyte-{request.user.username}')
+
+@never_cache
+@staff_member_required
+@require_http_methods(["GET"])
+def tracker_export_all(request):
+    return _export_response(request, None, 'greenbyte')
+
 def finder_view(request):
-    return render(request, "finder.html")
+    return render(request, "finder.html", context={'categories': EwasteCenter.CATEGORIES})
+
+@require_http_methods(["GET"])
+def finder_nearest(request):
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        k = int(request.GET.get('k', settings.FINDER_DEFAULT_RESULTS))
+    except KeyError:
+        return JsonResponse({'error': 'lat and lon are required'}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'lat, lon and k must be numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({'error': 'lat or lon out of range'}, status=400)
+
+    k = max(1, min(k, settings.FINDER_MAX_RESULTS))
+    centers = live_index.get().nearest(lat, lon, k, request.GET.get('accepts') or None)
+    return JsonResponse({'centers': centers})
+
+def _leaderboard_size(request):
+    try:
+        limit = int(request.GET.get('limit', settings.COMMUNITY_LEADERBOARD_SIZE))
+    except ValueError:
+        limit = settings.COMMUNITY_LEADERBOARD_SIZE
+    return max(1, min(limit, settings.COMMUNITY_LEADERBOARD_MAX_SIZE))
+
+def community_view(request):
+    return render(request, "community.html", context=community_snapshot())
+
+@require_http_methods(["GET"])
+def community_stats(request):
+    return JsonResponse(community_snapshot(_leaderboard_size(request)))
 
 def login_view(request):
     if request.method == 'POST':
@@ -256,36 +498,55 @@ def update_tracker(request):
                     'error': 'Cannot track "No Device Detected"'
                 })
 
-            device_co2 = data.get('device_co2', 0)
-            device_kwh = data.get('device_kwh', 0)
-
-            # Get or create user's tracker
-            tracker, created = UserTracker.objects.get_or_create(
-                user_id=request.user,
-                defaults={
-                    'total_devices': 0,
-                    'total_co2': 0,
-                    'total_kwh': 0
-                }
-            )
-            
-            # Increment total_devices by 1
-            tracker.total_devices += 1
-            tracker.total_co2 += device_co2
-            tracker.total_kwh += device_kwh
-            tracker.save()
-
-            # Create a new DeviceTracker entry
-            DeviceTracker.objects.create(
-                user=request.user,
-                device_name=device_name,
-                device_co2=device_co2,
-                device_kwh=device_kwh
-            )
-            
+            # Totals and history are written together in one transaction
+            with stage('record_devices'):
+                _, totals = record_devices(request.user, [{
+                    'class': device_name,
+                    'device_co2': data.get('device_co2', 0),
+                    'device_kwh': data.get('device_kwh', 0)
+                }])
+            if totals is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Missing device name'
+                })
+
+            return JsonResponse({
+                'success': True,
+                'total_devices': totals['total_devices'],
+                'message': 'Tracker updated successfully'
+            })
+        elif action == 'dispose_reuse_many':
+            # The items selected from a multi-device identification
+            devices = data.get('devices')
+            max_devices = settings.IDENTIFY_MULTI_MAX_DEVICES
+            if (not isinstance(devices, list) or not 0 < len(devices) <= max_devices
+                    or not all(isinstance(device, dict) for device in devices)):
+                return JsonResponse({
+                    'success': False,
+                    'error': f'Select between 1 and {max_devices} devices'
+                })
+
+            # All of them in one transaction, with one bulk INSERT
+            with stage('record_devices'):
+                rows, totals = record_devices(request.user, [
+                    {
+                        'class': device.get('device_name'),
+                        'device_co2': device.get('device_co2', 0),
+                        'device_kwh': device.get('device_kwh', 0)
+                    }
+                    for device in devices
+                ])
+            if totals is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'No devices to track'
+                })
+
             return JsonResponse({
                 'success': True,
-                'total_devices': tracker.total_devices,
+                'tracked': len(rows),
+                'total_devices': totals['total_devices'],
                 'message': 'Tracker updated successfully'
             })
         else:
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'greenbyte.settings')
 
 application = get_asgi_application()
+
+# Only server processes load this module, so management commands and tests never pay for it
+from app.spatial import live_index  # noqa: E402
+
+live_index.warm()
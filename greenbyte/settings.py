@@ -12,11 +12,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
+# Alternative Messages API endpoint, e.g. a gateway or the benchmark's stub
+CLAUDE_BASE_URL = os.getenv('CLAUDE_BASE_URL') or None
 
 if not CLAUDE_API_KEY:
     print("Warning: CLAUDE_API_KEY not found in environment variables")
@@ -50,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole stack
+    'app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,13 +88,78 @@ WSGI_APPLICATION = 'greenbyte.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the profile: "sqlite" (default) or "postgresql".
+#
+# SQLite runs in WAL mode so readers never wait for the writer, syncs at
+# NORMAL (durable across application crashes; a power cut can lose the last
+# commits), memory-maps up to SQLITE_MMAP_SIZE bytes of the file and waits
+# up to SQLITE_TIMEOUT seconds for a lock. Transactions begin IMMEDIATE, so
+# a writer takes the write lock up front instead of failing with "database
+# is locked" when it tries to upgrade a read lock mid-transaction.
+#
+# PostgreSQL draws connections from a psycopg pool of DB_POOL_MIN_SIZE to
+# DB_POOL_MAX_SIZE connections, or keeps one persistent connection per
+# worker when DB_POOL_MAX_SIZE is 0. Connections are otherwise reused for
+# DB_CONN_MAX_AGE seconds. Set DB_REPLICA_HOST to send reads from views
+# marked with read_from_replica to a streaming replica; a user's reads stay
+# on the primary for DB_REPLICA_MAX_LAG seconds after they write.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 600))
+DB_REPLICA_HOST = os.getenv('DB_REPLICA_HOST', '')
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'greenbyte'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', ''),
+            'PORT': os.getenv('DB_PORT', ''),
+            # The pool owns connection lifetimes; Django refuses both at once
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': DB_POOL_MAX_SIZE,
+                    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                },
+            } if DB_POOL_MAX_SIZE else {},
+        }
     }
-}
+    if DB_REPLICA_HOST:
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': DB_REPLICA_HOST,
+            'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))};"
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': float(os.getenv('SQLITE_TIMEOUT', 20)),
+            },
+            # A file rather than Django's in-memory default, whose shared cache
+            # does not wait on locks, so the concurrent writer tests can run
+            'TEST': {'NAME': os.getenv('SQLITE_TEST_PATH', BASE_DIR / 'test_db.sqlite3')},
+        }
+    }
+
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
 
 
 # Password validation
@@ -137,6 +207,144 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Identification models
+# Every identification goes to IDENTIFY_MODEL unless IDENTIFY_TRIAGE_MODEL
+# is set (e.g. claude-3-haiku-20240307). Then that fast model answers first,
+# with a CONFIDENCE line, and the full model is only called when the triage
+# answer is below IDENTIFY_ESCALATE_BELOW (0 to 1), gives no confidence or
+# names no device.
+IDENTIFY_MODEL = os.getenv('IDENTIFY_MODEL', 'claude-3-5-sonnet-20241022')
+IDENTIFY_MAX_TOKENS = int(os.getenv('IDENTIFY_MAX_TOKENS', 2000))
+IDENTIFY_TRIAGE_MODEL = os.getenv('IDENTIFY_TRIAGE_MODEL', '')
+IDENTIFY_TRIAGE_MAX_TOKENS = int(os.getenv('IDENTIFY_TRIAGE_MAX_TOKENS', 800))
+IDENTIFY_ESCALATE_BELOW = float(os.getenv('IDENTIFY_ESCALATE_BELOW', 0.8))
+# Multi-device mode (mode=multi on identify/predict/) names up to
+# IDENTIFY_MULTI_MAX_DEVICES items per photo in one IDENTIFY_MODEL call
+IDENTIFY_MULTI_MAX_DEVICES = int(os.getenv('IDENTIFY_MULTI_MAX_DEVICES', 12))
+IDENTIFY_MULTI_MAX_TOKENS = int(os.getenv('IDENTIFY_MULTI_MAX_TOKENS', 4000))
+
+# Claude circuit breaker
+# Calls time out after IDENTIFY_TIMEOUT seconds (IDENTIFY_TRIAGE_TIMEOUT for
+# the triage model). When at least CLAUDE_BREAKER_MIN_CALLS calls in the last
+# CLAUDE_BREAKER_WINDOW seconds failed at CLAUDE_BREAKER_ERROR_RATE or more,
+# identifications fail fast for CLAUDE_BREAKER_OPEN_SECONDS; then up to
+# CLAUDE_BREAKER_HALF_OPEN_PROBES trial calls decide whether to close it.
+# Meanwhile uploads within IDENTIFY_DEGRADED_PHASH_DISTANCE bits of any
+# cached result are answered from it (-1 to always fail fast).
+IDENTIFY_TIMEOUT = float(os.getenv('IDENTIFY_TIMEOUT', 60))
+IDENTIFY_TRIAGE_TIMEOUT = float(os.getenv('IDENTIFY_TRIAGE_TIMEOUT', 20))
+CLAUDE_BREAKER_WINDOW = float(os.getenv('CLAUDE_BREAKER_WINDOW', 60))
+CLAUDE_BREAKER_MIN_CALLS = int(os.getenv('CLAUDE_BREAKER_MIN_CALLS', 10))
+CLAUDE_BREAKER_ERROR_RATE = float(os.getenv('CLAUDE_BREAKER_ERROR_RATE', 0.5))
+CLAUDE_BREAKER_OPEN_SECONDS = float(os.getenv('CLAUDE_BREAKER_OPEN_SECONDS', 30))
+CLAUDE_BREAKER_HALF_OPEN_PROBES = int(os.getenv('CLAUDE_BREAKER_HALF_OPEN_PROBES', 1))
+IDENTIFY_DEGRADED_PHASH_DISTANCE = int(os.getenv('IDENTIFY_DEGRADED_PHASH_DISTANCE', 10))
+
+# Metrics
+# Request, stage and query timings, bytes and Claude token usage, exposed in
+# Prometheus text format at /metrics. Scrapers send METRICS_TOKEN as a bearer
+# token; without one, only staff can read it unless DEBUG is on, since it
+# shows traffic and token spend. METRICS_LOG_REQUESTS also logs one JSON line per request
+# to the app.metrics logger.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_LOG_REQUESTS = os.getenv('METRICS_LOG_REQUESTS', 'false').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Identification result cache
+# Parsed Claude identifications are cached by image digest, first in each
+# worker's memory and then in the IdentificationResult table.
+
+IDENTIFY_CACHE_TTL = int(os.getenv('IDENTIFY_CACHE_TTL', 7 * 24 * 60 * 60))
+IDENTIFY_CACHE_MEMORY_ENTRIES = int(os.getenv('IDENTIFY_CACHE_MEMORY_ENTRIES', 512))
+IDENTIFY_CACHE_DB_MAX_ENTRIES = int(os.getenv('IDENTIFY_CACHE_DB_MAX_ENTRIES', 100000))
+IDENTIFY_CACHE_PRUNE_EVERY = int(os.getenv('IDENTIFY_CACHE_PRUNE_EVERY', 100))
+
+# Uploads whose perceptual hash is within this many bits (of 64) of a cached
+# identification reuse it. Set to -1 to disable near-duplicate lookups.
+IDENTIFY_PHASH_MAX_DISTANCE = int(os.getenv('IDENTIFY_PHASH_MAX_DISTANCE', 6))
+
+# Upper bound on simultaneous Claude calls per process, and the fan-out
+# used by the batch endpoint
+IDENTIFY_MAX_CONCURRENT_CALLS = int(os.getenv('IDENTIFY_MAX_CONCURRENT_CALLS', 8))
+IDENTIFY_BATCH_CONCURRENCY = int(os.getenv('IDENTIFY_BATCH_CONCURRENCY', 4))
+IDENTIFY_BATCH_MAX_IMAGES = int(os.getenv('IDENTIFY_BATCH_MAX_IMAGES', 50))
+
+# Concurrent identifications of the same image share one Claude call. Worker
+# processes coordinate through advisory lock files in this directory; set it
+# empty to coalesce within each process only. A worker waits at most
+# IDENTIFY_SINGLEFLIGHT_LOCK_WAIT seconds for another's call before making its own.
+IDENTIFY_SINGLEFLIGHT_LOCK_DIR = os.getenv(
+    'IDENTIFY_SINGLEFLIGHT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'greenbyte-singleflight')
+)
+IDENTIFY_SINGLEFLIGHT_LOCK_WAIT = float(os.getenv('IDENTIFY_SINGLEFLIGHT_LOCK_WAIT', 30))
+
+# Identification job queue
+# Jobs live in the IdentificationJob table and are drained by
+# IDENTIFY_JOB_WORKERS threads in each web process (0 to rely solely on
+# `manage.py run_identify_workers`).
+
+IDENTIFY_JOB_WORKERS = int(os.getenv('IDENTIFY_JOB_WORKERS', 2))
+IDENTIFY_JOB_MAX_ATTEMPTS = int(os.getenv('IDENTIFY_JOB_MAX_ATTEMPTS', 5))
+IDENTIFY_JOB_BACKOFF_BASE = float(os.getenv('IDENTIFY_JOB_BACKOFF_BASE', 1.0))
+IDENTIFY_JOB_BACKOFF_MAX = float(os.getenv('IDENTIFY_JOB_BACKOFF_MAX', 60.0))
+IDENTIFY_JOB_POLL_INTERVAL = float(os.getenv('IDENTIFY_JOB_POLL_INTERVAL', 1.0))
+IDENTIFY_JOB_TIMEOUT = int(os.getenv('IDENTIFY_JOB_TIMEOUT', 300))
+IDENTIFY_JOB_MAX_WAIT = int(os.getenv('IDENTIFY_JOB_MAX_WAIT', 30))
+
+# Cache. The default is per-process; set a shared backend (e.g. Redis or
+# memcached) when running several workers so invalidation reaches them all.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Community page
+COMMUNITY_LEADERBOARD_SIZE = int(os.getenv('COMMUNITY_LEADERBOARD_SIZE', 10))
+COMMUNITY_LEADERBOARD_MAX_SIZE = 100
+COMMUNITY_CACHE_TTL = int(os.getenv('COMMUNITY_CACHE_TTL', 300))
+# Rows the site-wide totals are spread over; more means less write contention
+COMMUNITY_TOTALS_SHARDS = int(os.getenv('COMMUNITY_TOTALS_SHARDS', 16))
+
+# Device catalog
+# Minimum trigram similarity for a device name to match a catalog entry
+CATALOG_MATCH_THRESHOLD = float(os.getenv('CATALOG_MATCH_THRESHOLD', 0.5))
+
+# Finder
+FINDER_DEFAULT_RESULTS = 5
+FINDER_MAX_RESULTS = int(os.getenv('FINDER_MAX_RESULTS', 50))
+# Serve the previous spatial index while a changed one is rebuilt
+FINDER_INDEX_BACKGROUND_REFRESH = os.getenv('FINDER_INDEX_BACKGROUND_REFRESH', 'true').lower() == 'true'
+# Build the spatial index when a server process starts, not on the first finder request
+FINDER_INDEX_PRELOAD = os.getenv('FINDER_INDEX_PRELOAD', 'true').lower() == 'true'
+
+# Tracker history pagination
+TRACKER_PAGE_SIZE = int(os.getenv('TRACKER_PAGE_SIZE', 25))
+TRACKER_MAX_PAGE_SIZE = 100
+# Seconds a user's rendered tracker data stays cached; writes invalidate it sooner
+TRACKER_CACHE_TTL = int(os.getenv('TRACKER_CACHE_TTL', 3600))
+
+# Savings chart series
+TRACKER_SERIES_MAX_BUCKETS = int(os.getenv('TRACKER_SERIES_MAX_BUCKETS', 1000))
+TRACKER_SERIES_DEFAULT_DAYS = 30
+
+# Tracker exports
+# Rows fetched per database round trip while an export streams
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Upload normalization
+# Uploads are downscaled to IMAGE_MAX_EDGE pixels on the longest side and
+# re-encoded as IMAGE_FORMAT (JPEG or WEBP) before being sent to Claude.
+
+IMAGE_NORMALIZE = os.getenv('IMAGE_NORMALIZE', 'true').lower() == 'true'
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 1568))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+# The identify page encodes captures to the same edge, format and quality in
+# the browser, lowering quality until an upload fits in CAPTURE_MAX_BYTES
+CAPTURE_MAX_BYTES = int(os.getenv('CAPTURE_MAX_BYTES', 1024 * 1024))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 